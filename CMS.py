@@ -1,21 +1,207 @@
 import streamlit as st
 import pandas as pd
 import mysql.connector
+import mysql.connector.pooling
 from datetime import datetime, date, timedelta
 import re
-import hashlib
+import os
+import time
 import secrets
+import threading
+import tempfile
 from contextlib import contextmanager
 import json
+import sqlalchemy
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.pool import NullPool
+from repositories import get_repositories
+from passwords import password_context_from_settings
 
 # --- Database Configuration ---
 DB_CONFIG = {
     'host': 'localhost',
     'user': 'root',
     'password': 'root1',
-    'database': 'campus_management'
+    'database': 'campus_management',
+    # SQLAlchemy's MySQL dialect expects buffered cursors
+    'buffered': True,
+    # Lets the student bulk load use LOAD DATA LOCAL INFILE, limited to temp files
+    'allow_local_infile_in_path': tempfile.gettempdir(),
 }
 
+# --- Connection Pool Settings ---
+def get_setting(name, default, section="pool"):
+    """Read a setting from the CMS_<NAME> environment variable or st.secrets[section][name].
+
+    The value is converted to the type of `default`, so booleans accept
+    true/false/1/0/yes/no and numbers are parsed from strings.
+    """
+    value = os.environ.get(f"CMS_{name.upper()}")
+    if value is None:
+        try:
+            value = st.secrets.get(section, {}).get(name)
+        except Exception:  # No secrets.toml present
+            value = None
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
+
+# mysql.connector only prepares statements server-side for cursor(prepared=True),
+# which this app never uses, so there is no pooler mode to configure here.
+POOL_SETTINGS = {
+    "pool_size": min(get_setting("pool_size", 5), mysql.connector.pooling.CNX_POOL_MAXSIZE),
+    "max_overflow": get_setting("max_overflow", 10),
+    "pool_timeout": get_setting("pool_timeout", 30),
+    "pool_pre_ping": get_setting("pool_pre_ping", True),
+    "pool_recycle": get_setting("pool_recycle", 1800),
+}
+
+class PoolMetrics:
+    """Process-wide, thread-safe counters for connection checkouts and wait times."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.timeouts = 0
+        self.overflow_in_use = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # connection_id -> time the server connection was opened, for pool_recycle
+        self.connection_birth = {}
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def record_checkout(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def acquire_overflow(self, limit):
+        with self._lock:
+            if self.overflow_in_use >= limit:
+                return False
+            self.overflow_in_use += 1
+            return True
+
+    def release_overflow(self):
+        with self._lock:
+            self.overflow_in_use -= 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "new_connections": self.connects,
+                "timeouts": self.timeouts,
+                "overflow": self.overflow_in_use,
+                "avg_wait_ms": (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_pool_metrics():
+    return PoolMetrics()
+
+@st.cache_resource(show_spinner=False)
+def get_connection_pool():
+    """Create the MySQL pool once per process instead of connecting on every call."""
+    pool = mysql.connector.pooling.MySQLConnectionPool(
+        pool_name="cms_pool",
+        pool_size=POOL_SETTINGS["pool_size"],
+        pool_reset_session=True,
+        **DB_CONFIG
+    )
+    for _ in range(POOL_SETTINGS["pool_size"]):
+        get_pool_metrics().record_connect()
+    return pool
+
+def _refresh_pooled_connection(connection):
+    """Apply pool_recycle and pool_pre_ping to a connection just taken from the pool."""
+    metrics = get_pool_metrics()
+    now = time.monotonic()
+    birth = metrics.connection_birth.setdefault(connection.connection_id, now)
+    if POOL_SETTINGS["pool_recycle"] > 0 and now - birth > POOL_SETTINGS["pool_recycle"]:
+        metrics.connection_birth.pop(connection.connection_id, None)
+        connection.reconnect(attempts=1, delay=0)
+        metrics.connection_birth[connection.connection_id] = time.monotonic()
+        metrics.record_connect()
+    elif POOL_SETTINGS["pool_pre_ping"]:
+        connection.ping(reconnect=True, attempts=1, delay=0)
+
+def _checkout_connection():
+    """Borrow a pooled connection, opening an overflow connection when the pool is exhausted.
+
+    Returns (connection, is_overflow). Waits up to pool_timeout seconds before
+    giving up with a PoolError.
+    """
+    metrics = get_pool_metrics()
+    started = time.perf_counter()
+    deadline = time.monotonic() + POOL_SETTINGS["pool_timeout"]
+    while True:
+        try:
+            connection = get_connection_pool().get_connection()
+            try:
+                _refresh_pooled_connection(connection)
+            except mysql.connector.Error:
+                # close() hands the connection back to the pool even when its
+                # session reset fails; the pool reconnects it on a later checkout
+                try:
+                    connection.close()
+                except mysql.connector.Error:
+                    pass
+                raise
+            metrics.record_checkout(time.perf_counter() - started)
+            return connection, False
+        except mysql.connector.errors.PoolError:
+            if metrics.acquire_overflow(POOL_SETTINGS["max_overflow"]):
+                try:
+                    connection = mysql.connector.connect(**DB_CONFIG)
+                except mysql.connector.Error:
+                    metrics.release_overflow()
+                    raise
+                metrics.record_connect()
+                metrics.record_checkout(time.perf_counter() - started)
+                return connection, True
+            if time.monotonic() >= deadline:
+                metrics.record_timeout()
+                raise mysql.connector.errors.PoolError("Connection pool exhausted, timed out waiting for a connection")
+            time.sleep(0.05)
+
+def _on_engine_close(dbapi_connection, connection_record):
+    # Pooled connections go back to the pool on close(); anything else was an overflow connection
+    if not isinstance(dbapi_connection, mysql.connector.pooling.PooledMySQLConnection):
+        get_pool_metrics().release_overflow()
+
+@st.cache_resource(show_spinner=False)
+def get_engine():
+    """SQLAlchemy engine over the MySQL pool, for the shared repositories.
+
+    NullPool keeps SQLAlchemy from pooling a second time: every connection it
+    closes goes straight back to the pool above.
+    """
+    new_engine = create_engine("mysql+mysqlconnector://", creator=lambda: _checkout_connection()[0], poolclass=NullPool)
+    event.listen(new_engine, "close", _on_engine_close)
+    return new_engine
+
+# Shared data access (see repositories.py)
+repos = get_repositories("mysql")
+
+def get_pool_stats():
+    """Current pool configuration plus cumulative checkout/wait metrics."""
+    stats = get_pool_metrics().snapshot()
+    stats["pool_size"] = POOL_SETTINGS["pool_size"]
+    return stats
+
 # --- Initialize Session State ---
 if 'logged_in' not in st.session_state:
     st.session_state.logged_in = False
@@ -30,133 +216,135 @@ def get_db_connection():
     """Context manager for handling database connections."""
     connection = None
     try:
-        connection = mysql.connector.connect(**DB_CONFIG)
+        connection = get_engine().connect()
         yield connection
-    except mysql.connector.Error as e:
+    except sqlalchemy.exc.DBAPIError as e:
         st.error(f"Database connection error: {e}")
         yield None
     finally:
-        if connection and connection.is_connected():
+        if connection:
+            # close() hands the pooled connection back to the pool
             connection.close()
 
 def init_database():
     """Initialize all required database tables if they don't exist."""
     with get_db_connection() as conn:
         if conn is None: return False
-        cursor = conn.cursor()
-        
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS teachers (
-                teacher_id VARCHAR(20) PRIMARY KEY,
-                username VARCHAR(50) UNIQUE NOT NULL,
-                password VARCHAR(64) NOT NULL,
-                first_name VARCHAR(50) NOT NULL,
-                last_name VARCHAR(50) NOT NULL,
-                email VARCHAR(100) UNIQUE NOT NULL,
-                subjects JSON,
-                role ENUM('teacher', 'admin') NOT NULL DEFAULT 'teacher',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+        with conn.begin():
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS teachers (
+                    teacher_id VARCHAR(20) PRIMARY KEY,
+                    username VARCHAR(50) UNIQUE NOT NULL,
+                    password VARCHAR(255) NOT NULL,
+                    first_name VARCHAR(50) NOT NULL,
+                    last_name VARCHAR(50) NOT NULL,
+                    email VARCHAR(100) UNIQUE NOT NULL,
+                    subjects JSON,
+                    role ENUM('teacher', 'admin') NOT NULL DEFAULT 'teacher',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
         
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS students (
-                student_id VARCHAR(20) PRIMARY KEY,
-                first_name VARCHAR(50) NOT NULL,
-                last_name VARCHAR(50) NOT NULL,
-                email VARCHAR(100) UNIQUE NOT NULL,
-                phone VARCHAR(20) NOT NULL,
-                date_of_birth DATE NOT NULL,
-                gender ENUM('Male', 'Female', 'Other') NOT NULL,
-                course VARCHAR(100) NOT NULL,
-                year VARCHAR(20) NOT NULL,
-                semester VARCHAR(20) NOT NULL,
-                address TEXT,
-                emergency_contact VARCHAR(20),
-                enrollment_date DATE NOT NULL,
-                password VARCHAR(64) NOT NULL,
-                status ENUM('Active', 'Inactive', 'Graduated') DEFAULT 'Active',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS subjects (
-                subject_id VARCHAR(20) PRIMARY KEY,
-                name VARCHAR(100) NOT NULL UNIQUE,
-                credits INT NOT NULL
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS grades (
-                grade_id VARCHAR(20) PRIMARY KEY,
-                student_id VARCHAR(20) NOT NULL,
-                subject VARCHAR(100) NOT NULL,
-                exam_type ENUM('Mid-term', 'Final', 'Quiz', 'Assignment', 'Project') NOT NULL,
-                marks_obtained DECIMAL(5,2) NOT NULL,
-                total_marks DECIMAL(5,2) NOT NULL,
-                percentage DECIMAL(5,2) NOT NULL,
-                grade CHAR(2) NOT NULL,
-                date DATE NOT NULL,
-                teacher_id VARCHAR(20) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
-                FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE
-            )
-        """)
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS attendance (
-                attendance_id VARCHAR(20) PRIMARY KEY,
-                student_id VARCHAR(20) NOT NULL,
-                date DATE NOT NULL,
-                subject VARCHAR(100) NOT NULL,
-                status ENUM('Present', 'Absent') NOT NULL,
-                teacher_id VARCHAR(20) NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
-                FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE,
-                UNIQUE KEY unique_attendance (student_id, date, subject)
-            )
-        """)
-        conn.commit()
-        cursor.close()
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS students (
+                    student_id VARCHAR(20) PRIMARY KEY,
+                    first_name VARCHAR(50) NOT NULL,
+                    last_name VARCHAR(50) NOT NULL,
+                    email VARCHAR(100) UNIQUE NOT NULL,
+                    phone VARCHAR(20) NOT NULL,
+                    date_of_birth DATE NOT NULL,
+                    gender ENUM('Male', 'Female', 'Other') NOT NULL,
+                    course VARCHAR(100) NOT NULL,
+                    year VARCHAR(20) NOT NULL,
+                    semester VARCHAR(20) NOT NULL,
+                    address TEXT,
+                    emergency_contact VARCHAR(20),
+                    enrollment_date DATE NOT NULL,
+                    password VARCHAR(255) NOT NULL,
+                    status ENUM('Active', 'Inactive', 'Graduated') DEFAULT 'Active',
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS subjects (
+                    subject_id VARCHAR(20) PRIMARY KEY,
+                    name VARCHAR(100) NOT NULL UNIQUE,
+                    credits INT NOT NULL
+                )
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS grades (
+                    grade_id VARCHAR(20) PRIMARY KEY,
+                    student_id VARCHAR(20) NOT NULL,
+                    subject VARCHAR(100) NOT NULL,
+                    exam_type ENUM('Mid-term', 'Final', 'Quiz', 'Assignment', 'Project') NOT NULL,
+                    marks_obtained DECIMAL(5,2) NOT NULL,
+                    total_marks DECIMAL(5,2) NOT NULL,
+                    percentage DECIMAL(5,2) NOT NULL,
+                    grade CHAR(2) NOT NULL,
+                    date DATE NOT NULL,
+                    teacher_id VARCHAR(20) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
+                    FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE
+                )
+            """))
+            conn.execute(text("""
+                CREATE TABLE IF NOT EXISTS attendance (
+                    attendance_id VARCHAR(20) PRIMARY KEY,
+                    student_id VARCHAR(20) NOT NULL,
+                    date DATE NOT NULL,
+                    subject VARCHAR(100) NOT NULL,
+                    status ENUM('Present', 'Absent') NOT NULL,
+                    teacher_id VARCHAR(20) NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+                    FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
+                    FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE,
+                    UNIQUE KEY unique_attendance (student_id, date, subject)
+                )
+            """))
+            # Salted hashes (see passwords.py) outgrow the original VARCHAR(64)
+            for table in ("teachers", "students"):
+                width = conn.execute(text("""
+                    SELECT CHARACTER_MAXIMUM_LENGTH FROM information_schema.COLUMNS
+                    WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = :table AND COLUMN_NAME = 'password'
+                """), {"table": table}).scalar()
+                if width < 255:
+                    conn.execute(text(f"ALTER TABLE {table} MODIFY password VARCHAR(255) NOT NULL"))
         return True
 
+@st.cache_resource(show_spinner=False)
+def get_password_context():
+    return password_context_from_settings(get_setting)
+
 def hash_password(password):
-    """Hash password using SHA-256 for secure storage."""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash a password with a per-user salt for storage (see passwords.py)."""
+    return get_password_context().hash(password)
 
 def initialize_default_data():
     """Initialize the database with a default admin user and subjects if none exist."""
     with get_db_connection() as conn:
         if conn is None: return
-        cursor = conn.cursor()
-        
-        cursor.execute("SELECT COUNT(*) FROM teachers WHERE username = 'admin'")
-        if cursor.fetchone()[0] == 0:
-            cursor.execute("""
-                INSERT INTO teachers (teacher_id, username, password, first_name, last_name, email, subjects, role)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (
-                "TEA001", "admin", hash_password("admin123"), 
-                "Admin", "User", "admin@school.com", 
-                '["All Subjects"]', 'admin'
-            ))
-        
-        cursor.execute("SELECT COUNT(*) FROM subjects")
-        if cursor.fetchone()[0] == 0:
-            default_subjects = [
-                ("SUB001", "Data Science", 4), 
-                ("SUB002", "Computer Science", 4),
-                ("SUB003", "Machine Learning", 4),
-                ("SUB004", "Web Development", 4),
-                ("SUB005", "Database Systems", 3),
-                ("SUB006", "Software Engineering", 3)
-            ]
-            cursor.executemany("INSERT INTO subjects (subject_id, name, credits) VALUES (%s, %s, %s)", default_subjects)
-        
-        conn.commit()
-        cursor.close()
+        with conn.begin():
+            if conn.execute(text("SELECT COUNT(*) FROM teachers WHERE username = 'admin'")).scalar() == 0:
+                repos.teachers.insert(conn, {
+                    "teacher_id": "TEA001", "username": "admin", "password": hash_password("admin123"),
+                    "first_name": "Admin", "last_name": "User", "email": "admin@school.com",
+                    "subjects": '["All Subjects"]', "role": "admin",
+                })
+
+            if conn.execute(text("SELECT COUNT(*) FROM subjects")).scalar() == 0:
+                default_subjects = [
+                    ("SUB001", "Data Science", 4), 
+                    ("SUB002", "Computer Science", 4),
+                    ("SUB003", "Machine Learning", 4),
+                    ("SUB004", "Web Development", 4),
+                    ("SUB005", "Database Systems", 3),
+                    ("SUB006", "Software Engineering", 3)
+                ]
+                repos.subjects.insert_many(conn, [{"subject_id": sid, "name": name, "credits": credits}
+                                                  for sid, name, credits in default_subjects])
 
 # --- Utility Functions ---
 def validate_email(email):
@@ -164,18 +352,16 @@ def validate_email(email):
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return re.match(pattern, email) is not None
 
-def generate_id(prefix, table_name, column_name):
-    """Generic function to generate a new sequential ID."""
+def generate_id(prefix, table_name=None, column_name=None):
+    """Generate a new sequential ID for the given prefix.
+
+    table_name/column_name are accepted for backwards compatibility; the
+    table for each prefix is known to the repository layer.
+    """
     with get_db_connection() as conn:
         if conn is None: return f"{prefix}001"
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT {column_name} FROM {table_name} ORDER BY {column_name} DESC LIMIT 1")
-        result = cursor.fetchone()
-        cursor.close()
-        if result:
-            last_id = int(result[0][len(prefix):])
-            return f"{prefix}{last_id + 1:03d}"
-        return f"{prefix}001"
+        with conn.begin():
+            return repos.ids.reserve(conn, prefix, 1)[0]
 
 def generate_student_id():
     return generate_id("STU", "students", "student_id")
@@ -214,17 +400,31 @@ def calculate_grade(percentage):
 
 # --- Authentication ---
 def authenticate_user(username, password, user_type):
-    """Authenticate a user by checking credentials against the database."""
+    """Authenticate a user: look them up by login name, then verify the password in Python.
+
+    A stored hash from an older scheme or cost is replaced on a successful login.
+    """
     with get_db_connection() as conn:
         if conn is None: return None
-        cursor = conn.cursor(dictionary=True)
-        if user_type == "student":
-            cursor.execute("SELECT * FROM students WHERE student_id = %s AND password = %s", (username, hash_password(password)))
-        else: # teacher or admin
-            cursor.execute("SELECT * FROM teachers WHERE username = %s AND password = %s", (username, hash_password(password)))
-        user = cursor.fetchone()
-        cursor.close()
-        return user
+        with conn.begin():
+            if user_type == "student":
+                user = repos.students.find(conn, username)
+            else:  # teacher or admin
+                user = repos.teachers.find_by_username(conn, username)
+    # Verified with no connection checked out, so a login burst queues on the
+    # hashing pool instead of holding the connection pool
+    ok, new_hash = get_password_context().verify(password, user.pop("password") if user else None)
+    if not ok:
+        return None
+    if new_hash:
+        with get_db_connection() as conn:
+            if conn is not None:
+                with conn.begin():
+                    if user_type == "student":
+                        repos.students.set_password(conn, user["student_id"], new_hash)
+                    else:
+                        repos.teachers.set_password(conn, user["teacher_id"], new_hash)
+    return user
 
 def login_page():
     """Display the main login interface."""
@@ -277,27 +477,27 @@ def logout():
 def get_student_grades(student_id):
     with get_db_connection() as conn:
         if conn is None: return []
-        return pd.read_sql("SELECT * FROM grades WHERE student_id = %s ORDER BY date DESC", conn, params=(student_id,)).to_dict('records')
+        return repos.grades.for_student(conn, student_id).to_dict('records')
 
 def get_student_attendance(student_id):
     with get_db_connection() as conn:
         if conn is None: return []
-        return pd.read_sql("SELECT * FROM attendance WHERE student_id = %s ORDER BY date DESC", conn, params=(student_id,)).to_dict('records')
+        return repos.attendance.for_student(conn, student_id).to_dict('records')
 
 def get_all_students():
     with get_db_connection() as conn:
         if conn is None: return []
-        return pd.read_sql("SELECT * FROM students ORDER BY first_name, last_name", conn).to_dict('records')
+        return repos.students.list(conn).to_dict('records')
 
 def get_all_teachers():
     with get_db_connection() as conn:
         if conn is None: return []
-        return pd.read_sql("SELECT teacher_id, username, first_name, last_name, email, role FROM teachers ORDER BY first_name", conn).to_dict('records')
+        return repos.teachers.list(conn).to_dict('records')
 
 def get_all_subjects():
     with get_db_connection() as conn:
         if conn is None: return []
-        return pd.read_sql("SELECT * FROM subjects ORDER BY name", conn).to_dict('records')
+        return repos.subjects.list(conn).to_dict('records')
 
 # --- Admin Dashboard Functions ---
 def admin_dashboard():
@@ -330,6 +530,15 @@ def admin_home():
     col2.metric("Total Teachers", len(teachers))
     col3.metric("Total Subjects", len(subjects))
 
+    with st.expander("🔌 Database Connection Pool"):
+        stats = get_pool_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Pool Size", stats["pool_size"])
+        col2.metric("Overflow In Use", stats["overflow"])
+        col3.metric("Avg Checkout Wait", f"{stats['avg_wait_ms']:.1f} ms")
+        col4.metric("Pool Timeouts", stats["timeouts"])
+        st.json(stats)
+
 def manage_teachers_admin():
     """Admin interface for managing teachers."""
     st.subheader("👨‍🏫 Manage Teachers")
@@ -402,12 +611,11 @@ def manage_teachers_admin():
                         try:
                             teacher_id = generate_teacher_id()
                             with get_db_connection() as conn:
-                                cursor = conn.cursor()
-                                cursor.execute("""
-                                    INSERT INTO teachers (teacher_id, username, password, first_name, last_name, email, role)
-                                    VALUES (%s, %s, %s, %s, %s, %s, 'teacher')
-                                """, (teacher_id, username, hash_password(password), first_name, last_name, email))
-                                conn.commit()
+                                with conn.begin():
+                                    repos.teachers.insert(conn, {
+                                        "teacher_id": teacher_id, "username": username, "password": hash_password(password),
+                                        "first_name": first_name, "last_name": last_name, "email": email, "role": "teacher",
+                                    })
                             
                             st.session_state.new_teacher_credentials = {
                                 'id': teacher_id,
@@ -415,7 +623,7 @@ def manage_teachers_admin():
                                 'password': password if show_password else None
                             }
                             st.rerun()
-                        except mysql.connector.IntegrityError as e:
+                        except sqlalchemy.exc.IntegrityError as e:
                             if "username" in str(e):
                                 st.error("Username already exists!")
                             elif "email" in str(e):
@@ -454,10 +662,8 @@ def manage_teachers_admin():
                     if st.button("Generate & Set New Password", key=f"gen_teacher_pw_{teacher_id}"):
                         new_pw = generate_password()
                         with get_db_connection() as conn:
-                            cursor = conn.cursor()
-                            cursor.execute("UPDATE teachers SET password = %s WHERE teacher_id = %s", 
-                                           (hash_password(new_pw), teacher_id))
-                            conn.commit()
+                            with conn.begin():
+                                repos.teachers.set_password(conn, teacher_id, hash_password(new_pw))
                         st.session_state.teacher_password_reset_info = {
                             'teacher_id': teacher_id, 
                             'new_password': new_pw
@@ -470,10 +676,8 @@ def manage_teachers_admin():
                         if st.form_submit_button("Set Custom Password"):
                             if custom_pw:
                                 with get_db_connection() as conn:
-                                    cursor = conn.cursor()
-                                    cursor.execute("UPDATE teachers SET password = %s WHERE teacher_id = %s", 
-                                                   (hash_password(custom_pw), teacher_id))
-                                    conn.commit()
+                                    with conn.begin():
+                                        repos.teachers.set_password(conn, teacher_id, hash_password(custom_pw))
                                 st.success(f"Successfully set a new password for {teacher_id}.")
                             else:
                                 st.warning("Password cannot be empty.")
@@ -481,9 +685,8 @@ def manage_teachers_admin():
                     st.markdown("---")
                     if st.button("🗑️ Delete This Teacher", type="primary", key=f"del_teacher_{teacher_id}"):
                         with get_db_connection() as conn:
-                            cursor = conn.cursor()
-                            cursor.execute("DELETE FROM teachers WHERE teacher_id = %s", (teacher_id,))
-                            conn.commit()
+                            with conn.begin():
+                                repos.teachers.delete(conn, teacher_id)
                         st.success(f"Teacher {teacher_id} has been deleted.")
                         st.rerun()
         else:
@@ -501,12 +704,11 @@ def manage_subjects_admin():
             try:
                 subject_id = generate_id("SUB", "subjects", "subject_id")
                 with get_db_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("INSERT INTO subjects (subject_id, name, credits) VALUES (%s, %s, %s)", (subject_id, name, credits))
-                    conn.commit()
+                    with conn.begin():
+                        repos.subjects.insert_many(conn, [{"subject_id": subject_id, "name": name, "credits": credits}])
                     st.success(f"Subject '{name}' added!")
                     st.rerun()
-            except mysql.connector.IntegrityError:
+            except sqlalchemy.exc.IntegrityError:
                 st.error("Subject name already exists!")
 
     subjects = get_all_subjects()
@@ -547,11 +749,11 @@ def teacher_home():
     
     with get_db_connection() as conn:
         if conn:
-            recent_grades = pd.read_sql("""
-                SELECT COUNT(*) as count FROM grades 
-                WHERE teacher_id = %s AND date >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
-            """, conn, params=(st.session_state.current_user['teacher_id'],))
-            col3.metric("Grades This Week", recent_grades['count'].iloc[0] if not recent_grades.empty else 0)
+            recent_grades = conn.execute(text("""
+                SELECT COUNT(*) FROM grades 
+                WHERE teacher_id = :tid AND date >= DATE_SUB(CURDATE(), INTERVAL 7 DAY)
+            """), {"tid": st.session_state.current_user['teacher_id']}).scalar()
+            col3.metric("Grades This Week", recent_grades or 0)
 
 def teacher_record_grades():
     """Teacher interface for recording grades."""
@@ -590,18 +792,20 @@ def teacher_record_grades():
         if submitted:
             if selected_student and selected_subject and marks_obtained is not None and total_marks > 0:
                 student_id = selected_student.split(" - ")[0]
-                percentage = (marks_obtained / total_marks) * 100
+                # Graded from the value the DECIMAL(5,2) column will store
+                percentage = round(marks_obtained / total_marks * 100, 2)
                 grade = calculate_grade(percentage)
                 grade_id = generate_grade_id()
                 
                 try:
                     with get_db_connection() as conn:
-                        cursor = conn.cursor()
-                        cursor.execute("""
-                            INSERT INTO grades (grade_id, student_id, subject, exam_type, marks_obtained, total_marks, percentage, grade, date, teacher_id)
-                            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
-                        """, (grade_id, student_id, selected_subject, exam_type, marks_obtained, total_marks, percentage, grade, exam_date, st.session_state.current_user['teacher_id']))
-                        conn.commit()
+                        with conn.begin():
+                            repos.grades.insert_many(conn, [{
+                                "grade_id": grade_id, "student_id": student_id, "subject": selected_subject,
+                                "exam_type": exam_type, "marks_obtained": marks_obtained, "total_marks": total_marks,
+                                "percentage": percentage, "grade": grade, "date": exam_date,
+                                "teacher_id": st.session_state.current_user['teacher_id'],
+                            }])
                         st.success(f"Grade recorded successfully! Grade: {grade} ({percentage:.1f}%)")
                 except Exception as e:
                     st.error(f"Error recording grade: {e}")
@@ -613,15 +817,7 @@ def teacher_record_grades():
     
     with get_db_connection() as conn:
         if conn:
-            recent_grades = pd.read_sql("""
-                SELECT g.grade_id, g.student_id, s.first_name, s.last_name, g.subject, g.exam_type, 
-                       g.marks_obtained, g.total_marks, g.percentage, g.grade, g.date
-                FROM grades g
-                JOIN students s ON g.student_id = s.student_id
-                WHERE g.teacher_id = %s
-                ORDER BY g.date DESC
-                LIMIT 10
-            """, conn, params=(st.session_state.current_user['teacher_id'],))
+            recent_grades = repos.grades.recent_for_teacher(conn, st.session_state.current_user['teacher_id'])
             
             if not recent_grades.empty:
                 st.dataframe(recent_grades, use_container_width=True)
@@ -655,8 +851,7 @@ def teacher_mark_attendance():
 
         with get_db_connection() as conn:
             if conn:
-                query = "SELECT student_id, status FROM attendance WHERE date = %s AND subject = %s"
-                existing_df = pd.read_sql(query, conn, params=(attendance_date, selected_subject))
+                existing_df = repos.attendance.for_class(conn, attendance_date, selected_subject)
                 existing_attendance = dict(zip(existing_df['student_id'], existing_df['status']))
             else:
                 existing_attendance = {}
@@ -682,28 +877,10 @@ def teacher_mark_attendance():
             if st.form_submit_button("Save Attendance"):
                 try:
                     with get_db_connection() as conn:
-                        cursor = conn.cursor()
-                        records_to_insert = []
-                        for student_id, status in attendance_data.items():
-                            records_to_insert.append((
-                                generate_attendance_id(),
-                                student_id,
-                                attendance_date,
-                                selected_subject,
-                                status,
-                                st.session_state.current_user['teacher_id']
-                            ))
-                        
-                        delete_query = "DELETE FROM attendance WHERE date = %s AND subject = %s"
-                        cursor.execute(delete_query, (attendance_date, selected_subject))
-
-                        insert_query = """
-                            INSERT INTO attendance (attendance_id, student_id, date, subject, status, teacher_id)
-                            VALUES (%s, %s, %s, %s, %s, %s)
-                        """
-                        cursor.executemany(insert_query, records_to_insert)
-                        
-                        conn.commit()
+                        # Only rows whose status changed are written, with IDs reserved in one query
+                        with conn.begin():
+                            repos.attendance.save_class(conn, attendance_date, selected_subject, attendance_data,
+                                                        st.session_state.current_user['teacher_id'])
                         st.success("Attendance saved successfully!")
                         st.rerun()
                 except Exception as e:
@@ -965,21 +1142,20 @@ def add_student_form():
                     try:
                         student_id = generate_student_id()
                         with get_db_connection() as conn:
-                            cursor = conn.cursor()
-                            cursor.execute("""
-                                INSERT INTO students (student_id, first_name, last_name, email, phone, date_of_birth, 
-                                                      gender, course, year, semester, enrollment_date, password, status)
-                                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, 'Active')
-                            """, (student_id, first_name, last_name, email, phone, date_of_birth, 
-                                  gender, course, year, semester, date.today(), hash_password(password)))
-                            conn.commit()
+                            with conn.begin():
+                                repos.students.insert(conn, {
+                                    "student_id": student_id, "first_name": first_name, "last_name": last_name,
+                                    "email": email, "phone": phone, "date_of_birth": date_of_birth, "gender": gender,
+                                    "course": course, "year": year, "semester": semester,
+                                    "enrollment_date": date.today(), "password": hash_password(password), "status": "Active",
+                                })
                         
                         st.session_state.new_student_credentials = {
                             "id": student_id,
                             "password": password if show_password_in_message else None
                         }
                         st.rerun()
-                    except mysql.connector.IntegrityError as e:
+                    except sqlalchemy.exc.IntegrityError as e:
                         st.error(f"Database error: {e}")
 
 def student_management_interface(can_delete=False):
@@ -1014,9 +1190,8 @@ def student_management_interface(can_delete=False):
             if st.button("Generate & Set New Password", key=f"gen_pw_{student_id}"):
                 new_pw = generate_password()
                 with get_db_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute("UPDATE students SET password = %s WHERE student_id = %s", (hash_password(new_pw), student_id))
-                    conn.commit()
+                    with conn.begin():
+                        repos.students.set_password(conn, student_id, hash_password(new_pw))
                 st.session_state.password_reset_info = {'student_id': student_id, 'new_password': new_pw}
                 st.rerun()
 
@@ -1026,9 +1201,8 @@ def student_management_interface(can_delete=False):
                 if st.form_submit_button("Set Custom Password"):
                     if custom_pw:
                         with get_db_connection() as conn:
-                            cursor = conn.cursor()
-                            cursor.execute("UPDATE students SET password = %s WHERE student_id = %s", (hash_password(custom_pw), student_id))
-                            conn.commit()
+                            with conn.begin():
+                                repos.students.set_password(conn, student_id, hash_password(custom_pw))
                         st.success(f"Successfully set a new password for {student_id}.")
                     else:
                         st.warning("Password cannot be empty.")
@@ -1037,9 +1211,8 @@ def student_management_interface(can_delete=False):
                 st.markdown("---")
                 if st.button("🗑️ Delete This Student", type="primary", key=f"del_student_{student_id}"):
                     with get_db_connection() as conn:
-                        cursor = conn.cursor()
-                        cursor.execute("DELETE FROM students WHERE student_id = %s", (student_id,))
-                        conn.commit()
+                        with conn.begin():
+                            repos.students.delete(conn, student_id)
                     st.success(f"Student {student_id} has been deleted.")
                     st.rerun()
 
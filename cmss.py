@@ -1,13 +1,29 @@
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
 from datetime import datetime, date, timedelta
 import re
-import hashlib
+import os
+import math
+import time
 import secrets
+import threading
+import tempfile
+import glob
+import logging
+from collections import Counter, deque
 from contextlib import contextmanager
 import json
+import sqlite3
 import sqlalchemy
-from sqlalchemy import create_engine, text, exc
+from sqlalchemy import create_engine, text, exc, event, bindparam
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from repositories import ID_SEQUENCES, STUDENT_FIELDS, read_frame, get_repositories
+from passwords import password_context_from_settings
 from urllib.parse import quote_plus  # 1. यह इम्पोर्ट ज़रूरी है
 
 
@@ -17,22 +33,337 @@ DB_HOST = "aws-1-ap-south-1.pooler.supabase.com"
 DB_PORT = "6543"
 DB_NAME = "postgres" 
 
+# --- Connection Pool Settings ---
+def get_setting(name, default, section="pool"):
+    """Read a setting from the CMS_<NAME> environment variable or st.secrets[section][name].
+
+    The value is converted to the type of `default`, so booleans accept
+    true/false/1/0/yes/no and numbers are parsed from strings.
+    """
+    value = os.environ.get(f"CMS_{name.upper()}")
+    if value is None:
+        try:
+            value = st.secrets.get(section, {}).get(name)
+        except Exception:  # No secrets.toml present
+            value = None
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
+
+# Supabase's transaction pooler listens on 6543; it hands every transaction to a
+# different backend, so server-side prepared statements must stay off there.
+POOL_SETTINGS = {
+    "driver": get_setting("driver", "psycopg2"),
+    "pool_size": get_setting("pool_size", 5),
+    "max_overflow": get_setting("max_overflow", 10),
+    "pool_timeout": get_setting("pool_timeout", 30),
+    "pool_pre_ping": get_setting("pool_pre_ping", True),
+    "pool_recycle": get_setting("pool_recycle", 1800),
+    "pooler_mode": get_setting("pooler_mode", DB_PORT == "6543"),
+}
+
+# Offline mode: CMS_DATABASE_URL (or database_url under [database] in secrets)
+# set to a sqlite:///path/to/campus.db URL runs the app on an embedded database
+# file instead of the server above. The same migrations build its schema.
+DATABASE_URL = get_setting("database_url", "", section="database")
+EMBEDDED_SETTINGS = {
+    # How long a writer waits for another connection's write lock before failing
+    "busy_timeout_ms": get_setting("busy_timeout_ms", 5000, section="embedded"),
+    # NORMAL is durable across application crashes in WAL mode; FULL also survives power loss
+    "synchronous": get_setting("synchronous", "NORMAL", section="embedded"),
+}
+
+def pooler_connect_args(driver):
+    """DBAPI connect() arguments that disable prepared-statement caching for a driver."""
+    if driver == "psycopg":
+        # psycopg 3 prepares a statement after it has run a few times
+        return {"prepare_threshold": None}
+    # psycopg2 never prepares statements server-side, so nothing to turn off
+    return {}
+
+class PoolMetrics:
+    """Process-wide, thread-safe counters for connection checkouts and wait times."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def attach(self, pool_engine):
+        event.listen(pool_engine, "connect", self._on_connect)
+        event.listen(pool_engine, "invalidate", self._on_invalidate)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record, exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def record_checkout(self, wait):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def record_timeout(self):
+        with self._lock:
+            self.timeouts += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "new_connections": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": (self.total_wait / self.checkouts * 1000) if self.checkouts else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
+
+@st.cache_resource(show_spinner=False)
+def get_pool_metrics():
+    return PoolMetrics()
+
+DEBUG_SETTINGS = {
+    # Statements slower than this are logged with their parameters redacted
+    "slow_query_ms": get_setting("slow_query_ms", 500, section="debug"),
+    # Statements kept per rerun and slow statements kept per process, for the admin debug panel
+    "rerun_log_size": get_setting("rerun_log_size", 200, section="debug"),
+    "slow_log_size": get_setting("slow_log_size", 50, section="debug"),
+}
+slow_query_logger = logging.getLogger("cms.slow_queries")
+
+def redact_parameters(parameters):
+    """Replace bound values with their type names so logs never carry personal data or passwords."""
+    if isinstance(parameters, dict):
+        return {key: f"<{type(value).__name__}>" for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        if parameters and isinstance(parameters[0], (dict, list, tuple)):
+            return f"<{len(parameters)} parameter sets>"
+        return [f"<{type(value).__name__}>" for value in parameters]
+    return parameters
+
+class RerunQueryLog:
+    """Queries, timings and connection checkouts of one Streamlit rerun."""
+
+    def __init__(self, page=None):
+        self.page = page
+        self.queries = 0
+        self.connections = 0
+        self.rows = 0
+        self.total_ms = 0.0
+        self.statements = deque(maxlen=DEBUG_SETTINGS["rerun_log_size"])
+        self.repeats = Counter()
+
+class QueryMetrics:
+    """Per-rerun and per-page query statistics, fed by SQLAlchemy engine events.
+
+    Each Streamlit session runs its script on its own thread, so the current
+    rerun's log lives in a thread-local; page totals and the slow-query list
+    are shared by the process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.pages = {}
+        self.slow_queries = deque(maxlen=DEBUG_SETTINGS["slow_log_size"])
+
+    def attach(self, query_engine):
+        event.listen(query_engine, "before_cursor_execute", self._before_execute)
+        event.listen(query_engine, "after_cursor_execute", self._after_execute)
+        event.listen(query_engine, "checkout", self._on_checkout)
+
+    def start_rerun(self):
+        """Begin a fresh log for the rerun executing on this thread and return it."""
+        self._local.log = RerunQueryLog()
+        return self._local.log
+
+    def current(self):
+        return getattr(self._local, "log", None)
+
+    def set_page(self, page):
+        """Attribute this rerun, including queries already run, to a page."""
+        log = self.current()
+        if log is None:
+            return
+        log.page = page
+        with self._lock:
+            totals = self.pages.setdefault(page, {"reruns": 0, "queries": 0, "connections": 0, "db_ms": 0.0})
+            totals["reruns"] += 1
+            totals["queries"] += log.queries
+            totals["connections"] += log.connections
+            totals["db_ms"] += log.total_ms
+
+    def _page_totals(self, log):
+        return self.pages.get(log.page) if log.page is not None else None
+
+    def _on_checkout(self, dbapi_connection, connection_record, connection_proxy):
+        log = self.current()
+        if log is None:
+            return
+        log.connections += 1
+        with self._lock:
+            totals = self._page_totals(log)
+            if totals is not None:
+                totals["connections"] += 1
+
+    # The start time rides on the execution context, which is dropped with the
+    # statement, so a statement that fails never leaves it behind
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.query_started = time.perf_counter()
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "query_started", None)
+        if started is None:
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        statement = " ".join(statement.split())
+        # Server-side cursors report -1 until they are read
+        rows = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+
+        log = self.current()
+        if log is not None:
+            log.queries += 1
+            log.rows += rows or 0
+            log.total_ms += elapsed_ms
+            log.repeats[statement] += 1
+            log.statements.append({"statement": statement, "ms": round(elapsed_ms, 2), "rows": rows})
+            with self._lock:
+                totals = self._page_totals(log)
+                if totals is not None:
+                    totals["queries"] += 1
+                    totals["db_ms"] += elapsed_ms
+
+        if elapsed_ms >= DEBUG_SETTINGS["slow_query_ms"]:
+            redacted = redact_parameters(parameters)
+            page = log.page if log is not None else None
+            slow_query_logger.warning("Slow query (%.0f ms, page %s): %s params=%s", elapsed_ms, page, statement, redacted)
+            with self._lock:
+                self.slow_queries.append({"at": datetime.now().strftime("%H:%M:%S"), "page": page,
+                                          "ms": round(elapsed_ms, 1), "rows": rows,
+                                          "statement": statement, "parameters": str(redacted)})
+
+@st.cache_resource(show_spinner=False)
+def get_query_metrics():
+    return QueryMetrics()
+
+def _configure_sqlite_connection(dbapi_connection, connection_record):
+    # WAL lets readers run alongside the single writer; foreign keys are off by default in SQLite
+    dbapi_connection.isolation_level = None  # transactions are started by _begin_sqlite below
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute(f"PRAGMA synchronous={EMBEDDED_SETTINGS['synchronous']}")
+    cursor.execute(f"PRAGMA busy_timeout={int(EMBEDDED_SETTINGS['busy_timeout_ms'])}")
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+def _begin_sqlite(conn):
+    # pysqlite defers BEGIN until the first write, which leaves reads and DDL
+    # outside the transaction; emitting it ourselves makes conn.begin() cover both.
+    # Autobegun and plain conn.begin() transactions start deferred and only
+    # hold a WAL read snapshot, which never blocks writers. begin_write()
+    # transactions start IMMEDIATE (see there).
+    conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.info.get("begin_immediate") else "BEGIN")
+
+def begin_write(conn):
+    """conn.begin() for a transaction that writes.
+
+    On SQLite the transaction starts BEGIN IMMEDIATE, taking the write lock up
+    front (waiting up to busy_timeout): a deferred transaction that reads and
+    then writes cannot upgrade its WAL snapshot once another writer commits,
+    and fails with "database is locked". Other backends get a plain begin().
+    """
+    conn.info["begin_immediate"] = True
+    try:
+        return conn.begin()
+    finally:
+        conn.info.pop("begin_immediate", None)
+
+def create_embedded_engine(url):
+    """Engine for an embedded SQLite database file (offline mode).
+
+    DATE and TIMESTAMP columns come back as date/datetime objects, as they do
+    from PostgreSQL.
+    """
+    new_engine = create_engine(
+        url,
+        pool_size=POOL_SETTINGS["pool_size"],
+        max_overflow=POOL_SETTINGS["max_overflow"],
+        pool_timeout=POOL_SETTINGS["pool_timeout"],
+        connect_args={"detect_types": sqlite3.PARSE_DECLTYPES},
+    )
+    event.listen(new_engine, "connect", _configure_sqlite_connection)
+    event.listen(new_engine, "begin", _begin_sqlite)
+    return new_engine
+
+def create_database_engine(url):
+    """Engine for a database URL: embedded SQLite for sqlite:// URLs, a pooled server engine otherwise."""
+    if url.startswith("sqlite"):
+        return create_embedded_engine(url)
+    connect_args = pooler_connect_args(POOL_SETTINGS["driver"]) if POOL_SETTINGS["pooler_mode"] else {}
+    return create_engine(
+        url,
+        pool_size=POOL_SETTINGS["pool_size"],
+        max_overflow=POOL_SETTINGS["max_overflow"],
+        pool_timeout=POOL_SETTINGS["pool_timeout"],
+        pool_pre_ping=POOL_SETTINGS["pool_pre_ping"],
+        pool_recycle=POOL_SETTINGS["pool_recycle"],
+        connect_args=connect_args,
+    )
+
 # Create the PostgreSQL connection string and SQLAlchemy engine
-try:
-    # 4. (यह Pooler का फिक्स है) - यूज़रनेम को एनकोड करें
-    ENCODED_USER = quote_plus(DB_USER)
-    
-    # 5. पासवर्ड को भी एनकोड करें
-    ENCODED_PASS = quote_plus(DB_PASS)
-    
-    # 6. दोनों एनकोडेड वैल्यू का इस्तेमाल करें
-    DATABASE_URL = f"postgresql://{ENCODED_USER}:{ENCODED_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+@st.cache_resource(show_spinner=False)
+def get_engine():
+    """Build the engine once per process; Streamlit re-executes this script on every
+    rerun, and a module-level create_engine() would start a fresh pool each time."""
+    database_url = DATABASE_URL
+    if not database_url:
+        # 4. (यह Pooler का फिक्स है) - यूज़रनेम को एनकोड करें
+        encoded_user = quote_plus(DB_USER)
+        
+        # 5. पासवर्ड को भी एनकोड करें
+        encoded_pass = quote_plus(DB_PASS)
+        
+        # 6. दोनों एनकोडेड वैल्यू का इस्तेमाल करें
+        database_url = f"postgresql+{POOL_SETTINGS['driver']}://{encoded_user}:{encoded_pass}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
     
-    engine = create_engine(DATABASE_URL)
+    new_engine = create_database_engine(database_url)
+    get_pool_metrics().attach(new_engine)
+    get_query_metrics().attach(new_engine)
+    return new_engine
+
+try:
+    engine = get_engine()
 except Exception as e:
     st.error(f"Error creating database engine: {e}")
     st.stop()
 
+# Shared data access (see repositories.py); PostgreSQL-only features stay in this file
+repos = get_repositories(engine.dialect.name)
+
+def get_pool_stats():
+    """Current pool occupancy plus cumulative checkout/wait metrics."""
+    stats = get_pool_metrics().snapshot()
+    pool = engine.pool
+    if hasattr(pool, "checkedout"):
+        stats.update({
+            "pool_size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "idle": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+        })
+    return stats
+
 # --- Initialize Session State ---
 # (बाकी सारा कोड जैसा था वैसा ही रहेगा)
 # ...
@@ -55,8 +386,14 @@ def get_db_connection():
     """Context manager for handling database connections."""
     connection = None
     try:
+        started = time.perf_counter()
         connection = engine.connect()
+        get_pool_metrics().record_checkout(time.perf_counter() - started)
         yield connection
+    except sqlalchemy.exc.TimeoutError as e:
+        get_pool_metrics().record_timeout()
+        st.error(f"Database connection pool exhausted: {e}")
+        yield None
     except sqlalchemy.exc.OperationalError as e:
         st.error(f"Database connection error: {e}")
         yield None
@@ -64,158 +401,522 @@ def get_db_connection():
         if connection:
             connection.close()
 
+# Each ID prefix in ID_SEQUENCES is backed by a database sequence, so
+# allocation is a single nextval() call that is safe under concurrent inserts
+# and never depends on string ordering of existing IDs ('STU999' sorts after 'STU1000').
+# Prefixes whose sequences migration 2 creates; later prefixes arrive with their tables
+BASE_ID_PREFIXES = ("STU", "TEA", "GRA", "ATT", "SUB")
+
+def sync_id_sequences(conn, prefixes=None):
+    """Move ID sequences (all, or just `prefixes`) past the highest numeric ID stored in their tables.
+
+    Only for migration and bulk-load time, under lock_migrations(): on Postgres
+    reading a sequence and calling setval() is not atomic, so a nextval() in
+    between could be rolled back and its ID handed out twice. A sequence that is
+    already ahead of its table is left alone. On SQLite the sequences are rows
+    of the id_sequences table.
+    """
+    for prefix in prefixes or ID_SEQUENCES:
+        if conn.dialect.name == "sqlite":
+            _sync_sqlite_id_sequence(conn, prefix)
+            continue
+        sequence_name, table_name, column_name = ID_SEQUENCES[prefix]
+        # Use f-string for table/column names, which is safe as they are not user-input
+        conn.execute(text(f"""
+            SELECT setval('{sequence_name}', stored.max_id)
+            FROM (SELECT COALESCE(MAX(CAST(SUBSTRING({column_name} FROM {len(prefix) + 1}) AS BIGINT)), 0) AS max_id
+                  FROM {table_name} WHERE {column_name} ~ '^{prefix}[0-9]+$') AS stored
+            WHERE stored.max_id > (SELECT CASE WHEN is_called THEN last_value ELSE 0 END FROM {sequence_name})
+        """))
+
+def _sync_sqlite_id_sequence(conn, prefix):
+    _, table_name, column_name = ID_SEQUENCES[prefix]
+    suffix = f"SUBSTR({column_name}, {len(prefix) + 1})"
+    conn.execute(text(f"""
+        INSERT INTO id_sequences (prefix, last_value)
+        SELECT :prefix, COALESCE(MAX(CAST({suffix} AS INTEGER)), 0)
+        FROM {table_name} WHERE {column_name} GLOB '{prefix}[0-9]*' AND {suffix} NOT GLOB '*[^0-9]*'
+        ON CONFLICT (prefix) DO UPDATE SET last_value = MAX(last_value, excluded.last_value)
+    """), {"prefix": prefix})
+
+# The text search_students() matches against; migration 6 indexes this exact expression
+STUDENT_SEARCH_EXPRESSION = "lower(student_id || ' ' || first_name || ' ' || last_name || ' ' || email)"
+
+def create_student_search_index(conn):
+    """Trigram index over the expression search_students() matches with LIKE '%term%'.
+
+    Skipped on servers that don't ship pg_trgm, when the role may not
+    install it, and on embedded databases; search still works there, it just
+    scans the table.
+    """
+    if conn.dialect.name != "postgresql":
+        return
+    installed = conn.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).scalar()
+    if not installed and not conn.execute(text("SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm'")).scalar():
+        return
+    try:
+        # A savepoint, so a refused CREATE EXTENSION leaves the migration transaction usable
+        with conn.begin_nested():
+            if not installed:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+            conn.execute(text(f"CREATE INDEX IF NOT EXISTS idx_students_search_trgm ON students USING GIN (({STUDENT_SEARCH_EXPRESSION}) gin_trgm_ops)"))
+    except sqlalchemy.exc.ProgrammingError:
+        pass  # e.g. insufficient privilege to create extensions
+
+# --- Schema Migrations ---
+# Each migration is (version, name, steps). A step is either a SQL string or a
+# callable taking the open connection. Migrations run in version order inside
+# one transaction and are recorded in schema_migrations, so each applies once.
+# Version 1 keeps IF NOT EXISTS so databases created before the runner existed
+# are adopted without changes.
+def dialect_step(postgresql, sqlite=None):
+    """A migration step whose SQL differs by backend; a backend given None skips it."""
+    def step(conn):
+        sql = {"postgresql": postgresql, "sqlite": sqlite}.get(conn.dialect.name)
+        if sql:
+            conn.execute(text(sql))
+    return step
+
+MIGRATIONS = [
+    (1, "create base tables", [
+        """
+            CREATE TABLE IF NOT EXISTS teachers (
+                teacher_id VARCHAR(20) PRIMARY KEY,
+                username VARCHAR(50) UNIQUE NOT NULL,
+                password VARCHAR(255) NOT NULL,
+                first_name VARCHAR(50) NOT NULL,
+                last_name VARCHAR(50) NOT NULL,
+                email VARCHAR(100) UNIQUE NOT NULL,
+                subjects JSON,
+                role VARCHAR(10) NOT NULL DEFAULT 'teacher', -- Using VARCHAR instead of ENUM for better cross-DB compatibility
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS students (
+                student_id VARCHAR(20) PRIMARY KEY,
+                first_name VARCHAR(50) NOT NULL,
+                last_name VARCHAR(50) NOT NULL,
+                email VARCHAR(100) UNIQUE NOT NULL,
+                phone VARCHAR(20) NOT NULL,
+                date_of_birth DATE NOT NULL,
+                gender VARCHAR(10) NOT NULL,
+                course VARCHAR(100) NOT NULL,
+                year VARCHAR(20) NOT NULL,
+                semester VARCHAR(20) NOT NULL,
+                address TEXT,
+                emergency_contact VARCHAR(20),
+                enrollment_date DATE NOT NULL,
+                password VARCHAR(255) NOT NULL,
+                status VARCHAR(20) DEFAULT 'Active',
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS subjects (
+                subject_id VARCHAR(20) PRIMARY KEY,
+                name VARCHAR(100) NOT NULL UNIQUE,
+                credits INT NOT NULL
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS grades (
+                grade_id VARCHAR(20) PRIMARY KEY,
+                student_id VARCHAR(20) NOT NULL,
+                subject VARCHAR(100) NOT NULL,
+                exam_type VARCHAR(20) NOT NULL,
+                marks_obtained DECIMAL(5,2) NOT NULL,
+                total_marks DECIMAL(5,2) NOT NULL,
+                percentage DECIMAL(5,2) NOT NULL,
+                grade CHAR(2) NOT NULL,
+                date DATE NOT NULL,
+                teacher_id VARCHAR(20) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
+                FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS attendance (
+                attendance_id VARCHAR(20) PRIMARY KEY,
+                student_id VARCHAR(20) NOT NULL,
+                date DATE NOT NULL,
+                subject VARCHAR(100) NOT NULL,
+                status VARCHAR(10) NOT NULL,
+                teacher_id VARCHAR(20) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Removed MySQL-specific 'ON UPDATE'
+                FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
+                FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE,
+                UNIQUE (student_id, date, subject) -- Standard SQL for UNIQUE constraint
+            )
+        """,
+    ]),
+    (2, "create id sequences", [
+        # SQLite has no sequences; one counter row per prefix stands in for them
+        dialect_step(None, "CREATE TABLE IF NOT EXISTS id_sequences (prefix VARCHAR(10) PRIMARY KEY, last_value BIGINT NOT NULL)"),
+        *[dialect_step(f"CREATE SEQUENCE IF NOT EXISTS {ID_SEQUENCES[prefix][0]} MINVALUE 0 START WITH 1")
+          for prefix in BASE_ID_PREFIXES],
+        lambda conn: sync_id_sequences(conn, BASE_ID_PREFIXES),
+    ]),
+    (3, "add indexes for grade and attendance lookups", [
+        # get_student_grades: WHERE student_id = ? ORDER BY date DESC
+        "CREATE INDEX IF NOT EXISTS idx_grades_student_date ON grades (student_id, date DESC)",
+        # teacher_home weekly count and the Recent Grades list: WHERE teacher_id = ? AND/ORDER BY date
+        "CREATE INDEX IF NOT EXISTS idx_grades_teacher_date ON grades (teacher_id, date DESC)",
+        # teacher_mark_attendance: WHERE date = ? AND subject = ?, answered from the index alone
+        # (SQLite has no INCLUDE, so the covered columns become trailing key columns there)
+        dialect_step("CREATE INDEX IF NOT EXISTS idx_attendance_date_subject ON attendance (date, subject) INCLUDE (student_id, status)",
+                     "CREATE INDEX IF NOT EXISTS idx_attendance_date_subject ON attendance (date, subject, student_id, status)"),
+        # get_student_attendance (WHERE student_id = ? ORDER BY date DESC) is already served
+        # by the UNIQUE (student_id, date, subject) index, so it gets no extra index.
+    ]),
+    (4, "seed default admin and subjects", [
+        lambda conn: seed_default_data(conn),
+    ]),
+    (5, "add keyset pagination indexes", [
+        # Keyset pages seek on (first_name, last_name, id) > (...) in this order
+        "CREATE INDEX IF NOT EXISTS idx_students_name_keyset ON students (first_name, last_name, student_id)",
+        "CREATE INDEX IF NOT EXISTS idx_teachers_name_keyset ON teachers (first_name, last_name, teacher_id)",
+    ]),
+    (6, "add student search indexes", [
+        lambda conn: create_student_search_index(conn),
+        # Lets ID prefix matches (LIKE 'STU12%') use a btree regardless of collation
+        dialect_step("CREATE INDEX IF NOT EXISTS idx_students_id_prefix ON students (lower(student_id) text_pattern_ops)",
+                     "CREATE INDEX IF NOT EXISTS idx_students_id_prefix ON students (lower(student_id))"),
+    ]),
+    (7, "add class sections and enrollments", [
+        # A section is one subject taught to one cohort (course/year/semester) by one teacher
+        """
+            CREATE TABLE IF NOT EXISTS sections (
+                section_id VARCHAR(20) PRIMARY KEY,
+                subject_id VARCHAR(20) NOT NULL,
+                teacher_id VARCHAR(20) NOT NULL,
+                course VARCHAR(100) NOT NULL,
+                year VARCHAR(20) NOT NULL,
+                semester VARCHAR(20) NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                FOREIGN KEY (subject_id) REFERENCES subjects(subject_id) ON DELETE CASCADE,
+                FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE,
+                UNIQUE (subject_id, course, year, semester)
+            )
+        """,
+        """
+            CREATE TABLE IF NOT EXISTS enrollments (
+                section_id VARCHAR(20) NOT NULL,
+                student_id VARCHAR(20) NOT NULL,
+                enrolled_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (section_id, student_id),
+                FOREIGN KEY (section_id) REFERENCES sections(section_id) ON DELETE CASCADE,
+                FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE
+            )
+        """,
+        # Rosters are read through the enrollments primary key (section_id, student_id)
+        "CREATE INDEX IF NOT EXISTS idx_enrollments_student ON enrollments (student_id)",
+        "CREATE INDEX IF NOT EXISTS idx_sections_teacher ON sections (teacher_id)",
+        # Enrolling a cohort into a new section filters students on these columns
+        "CREATE INDEX IF NOT EXISTS idx_students_cohort ON students (course, year, semester)",
+        dialect_step("CREATE SEQUENCE IF NOT EXISTS section_id_seq MINVALUE 0 START WITH 1"),
+    ]),
+    (8, "add grading scales", [
+        # boundaries is a JSON list of [minimum_percentage, letter]; course and
+        # semester narrow the scale's scope, NULL meaning any
+        """
+            CREATE TABLE IF NOT EXISTS grading_scales (
+                scale_id VARCHAR(20) PRIMARY KEY,
+                name VARCHAR(100) NOT NULL,
+                course VARCHAR(100),
+                semester VARCHAR(20),
+                boundaries JSON NOT NULL,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_grading_scales_scope ON grading_scales (COALESCE(course, ''), COALESCE(semester, ''))",
+        dialect_step("CREATE SEQUENCE IF NOT EXISTS scale_id_seq MINVALUE 0 START WITH 1"),
+        lambda conn: conn.execute(text("""
+            INSERT INTO grading_scales (scale_id, name, boundaries) VALUES (:sid, 'Default', :boundaries)
+            ON CONFLICT DO NOTHING
+        """), {"sid": reserve_ids("SCL", 1, conn)[0], "boundaries": json.dumps(DEFAULT_GRADING_SCALE)}),
+    ]),
+    (9, "add covering indexes for student summaries", [
+        # Per-student GROUP BY subject over grades/attendance, answered from the index
+        # alone; the summary checker and rebuild aggregate this way
+        dialect_step("CREATE INDEX IF NOT EXISTS idx_grades_student_subject ON grades (student_id, subject) INCLUDE (percentage)",
+                     "CREATE INDEX IF NOT EXISTS idx_grades_student_subject ON grades (student_id, subject, percentage)"),
+        dialect_step("CREATE INDEX IF NOT EXISTS idx_attendance_student_subject ON attendance (student_id, subject) INCLUDE (status)",
+                     "CREATE INDEX IF NOT EXISTS idx_attendance_student_subject ON attendance (student_id, subject, status)"),
+    ]),
+    (10, "add student subject summary", [
+        # One row per student and subject, kept current by the grade and
+        # attendance write paths; average percentage is percentage_sum / exams
+        """
+            CREATE TABLE IF NOT EXISTS student_subject_summary (
+                student_id VARCHAR(20) NOT NULL,
+                subject VARCHAR(100) NOT NULL,
+                exams INTEGER NOT NULL DEFAULT 0,
+                percentage_sum DECIMAL(14,2) NOT NULL DEFAULT 0,
+                last_exam_date DATE,
+                classes INTEGER NOT NULL DEFAULT 0,
+                present INTEGER NOT NULL DEFAULT 0,
+                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (student_id, subject),
+                FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE
+            )
+        """,
+        lambda conn: rebuild_student_subject_summary(conn),
+    ]),
+    (11, "widen password columns for salted hashes", [
+        # Databases created before salted hashing; new ones start at 255. SQLite ignores VARCHAR lengths
+        dialect_step("ALTER TABLE students ALTER COLUMN password TYPE VARCHAR(255)"),
+        dialect_step("ALTER TABLE teachers ALTER COLUMN password TYPE VARCHAR(255)"),
+    ]),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+# Arbitrary constant for pg_advisory_xact_lock so concurrent app processes
+# don't apply the same migration twice.
+MIGRATION_LOCK_KEY = 4242001
+
+def lock_migrations(conn):
+    """Serialize schema and seed changes across app processes until the transaction ends."""
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": MIGRATION_LOCK_KEY})
+
+def run_migrations(conn):
+    """Apply pending migrations on an open connection inside the caller's transaction.
+
+    Returns the list of versions that were applied.
+    """
+    # Locked before anything else: two processes racing CREATE TABLE IF NOT
+    # EXISTS on a fresh database can both pass the existence check and fail
+    # on pg_type. On SQLite the caller's begin_write() transaction already holds
+    # the write lock; a second process waits and then finds the schema current.
+    lock_migrations(conn)
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name VARCHAR(100) NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    applied = set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+    newly_applied = []
+    for version, name, steps in MIGRATIONS:
+        if version in applied:
+            continue
+        for step in steps:
+            if callable(step):
+                step(conn)
+            else:
+                conn.execute(text(step))
+        conn.execute(text("INSERT INTO schema_migrations (version, name) VALUES (:version, :name)"),
+                     {"version": version, "name": name})
+        newly_applied.append(version)
+    return newly_applied
+
+def get_schema_version(conn):
+    """Highest applied migration version, or 0 for a database the runner has never touched."""
+    if not sqlalchemy.inspect(conn).has_table("schema_migrations"):
+        return 0
+    return conn.execute(text("SELECT COALESCE(MAX(version), 0) FROM schema_migrations")).scalar()
+
 def init_database():
-    """Initialize all required database tables if they don't exist."""
+    """Bring the database schema up to date by applying any pending migrations."""
     with get_db_connection() as conn:
         if conn is None: return False
         try:
-            # Wrap all table creation in a single transaction
-            with conn.begin():
-                conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS teachers (
-                        teacher_id VARCHAR(20) PRIMARY KEY,
-                        username VARCHAR(50) UNIQUE NOT NULL,
-                        password VARCHAR(64) NOT NULL,
-                        first_name VARCHAR(50) NOT NULL,
-                        last_name VARCHAR(50) NOT NULL,
-                        email VARCHAR(100) UNIQUE NOT NULL,
-                        subjects JSON,
-                        role VARCHAR(10) NOT NULL DEFAULT 'teacher', -- Using VARCHAR instead of ENUM for better cross-DB compatibility
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """))
-                
-                conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS students (
-                        student_id VARCHAR(20) PRIMARY KEY,
-                        first_name VARCHAR(50) NOT NULL,
-                        last_name VARCHAR(50) NOT NULL,
-                        email VARCHAR(100) UNIQUE NOT NULL,
-                        phone VARCHAR(20) NOT NULL,
-                        date_of_birth DATE NOT NULL,
-                        gender VARCHAR(10) NOT NULL,
-                        course VARCHAR(100) NOT NULL,
-                        year VARCHAR(20) NOT NULL,
-                        semester VARCHAR(20) NOT NULL,
-                        address TEXT,
-                        emergency_contact VARCHAR(20),
-                        enrollment_date DATE NOT NULL,
-                        password VARCHAR(64) NOT NULL,
-                        status VARCHAR(20) DEFAULT 'Active',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                    )
-                """))
-                
-                conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS subjects (
-                        subject_id VARCHAR(20) PRIMARY KEY,
-                        name VARCHAR(100) NOT NULL UNIQUE,
-                        credits INT NOT NULL
-                    )
-                """))
-                
-                conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS grades (
-                        grade_id VARCHAR(20) PRIMARY KEY,
-                        student_id VARCHAR(20) NOT NULL,
-                        subject VARCHAR(100) NOT NULL,
-                        exam_type VARCHAR(20) NOT NULL,
-                        marks_obtained DECIMAL(5,2) NOT NULL,
-                        total_marks DECIMAL(5,2) NOT NULL,
-                        percentage DECIMAL(5,2) NOT NULL,
-                        grade CHAR(2) NOT NULL,
-                        date DATE NOT NULL,
-                        teacher_id VARCHAR(20) NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
-                        FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE
-                    )
-                """))
-                
-                conn.execute(text("""
-                    CREATE TABLE IF NOT EXISTS attendance (
-                        attendance_id VARCHAR(20) PRIMARY KEY,
-                        student_id VARCHAR(20) NOT NULL,
-                        date DATE NOT NULL,
-                        subject VARCHAR(100) NOT NULL,
-                        status VARCHAR(10) NOT NULL,
-                        teacher_id VARCHAR(20) NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, -- Removed MySQL-specific 'ON UPDATE'
-                        FOREIGN KEY (student_id) REFERENCES students(student_id) ON DELETE CASCADE,
-                        FOREIGN KEY (teacher_id) REFERENCES teachers(teacher_id) ON DELETE CASCADE,
-                        UNIQUE (student_id, date, subject) -- Standard SQL for UNIQUE constraint
-                    )
-                """))
+            with begin_write(conn):
+                run_migrations(conn)
             return True
         except sqlalchemy.exc.SQLAlchemyError as e:
             st.error(f"Error during database initialization: {e}")
             return False
 
+@st.cache_resource(show_spinner="Initializing database... Please wait.")
+def bootstrap_database():
+    """Make sure the schema is current, once per server process.
+
+    Every session shares the cached result, so new browser tabs cost nothing.
+    The first call in a process is a single version lookup; migrations (and the
+    default-data seed they include) only run when the database is behind.
+    Raises on failure so a failed bootstrap is retried instead of cached.
+    """
+    with get_db_connection() as conn:
+        if conn is None: raise Exception("Database connection failed")
+        with conn.begin():
+            current_version = get_schema_version(conn)
+    if current_version < SCHEMA_VERSION and not init_database():
+        raise Exception("Database migrations failed")
+    return True
+
+# Hot queries paired with the index each one should use. Parameters only need
+# the right types; the values don't have to exist.
+QUERY_PLAN_CHECKS = [
+    ("Student grades",
+     "SELECT * FROM grades WHERE student_id = :sid ORDER BY date DESC",
+     {"sid": "STU001"}, "idx_grades_student_date"),
+    ("Teacher grades this week",
+     "SELECT COUNT(*) FROM grades WHERE teacher_id = :tid AND date >= :since",
+     {"tid": "TEA001", "since": date(2024, 1, 1)}, "idx_grades_teacher_date"),
+    ("Teacher recent grades",
+     "SELECT * FROM grades WHERE teacher_id = :tid ORDER BY date DESC LIMIT 10",
+     {"tid": "TEA001"}, "idx_grades_teacher_date"),
+    ("Attendance sheet",
+     "SELECT student_id, status FROM attendance WHERE date = :date AND subject = :subject",
+     {"date": date(2024, 1, 1), "subject": "Data Science"}, "idx_attendance_date_subject"),
+    ("Student attendance",
+     "SELECT * FROM attendance WHERE student_id = :sid ORDER BY date DESC",
+     {"sid": "STU001"}, "attendance_student_id_date_subject_key"),
+    ("Student subject summary",
+     "SELECT * FROM student_subject_summary WHERE student_id = :sid",
+     {"sid": "STU001"}, "student_subject_summary_pkey"),
+]
+
+def _plan_index_names(plan):
+    """Collect every index referenced anywhere in an EXPLAIN (FORMAT JSON) plan tree."""
+    names = set()
+    if "Index Name" in plan:
+        names.add(plan["Index Name"])
+    for child in plan.get("Plans", []):
+        names |= _plan_index_names(child)
+    return names
+
+def check_query_plans():
+    """EXPLAIN each hot query and report whether the planner picks its index.
+
+    Sequential scans are disabled for the check: on small tables the planner
+    rightly prefers them, and the goal here is to confirm each index is usable
+    for its access path.
+    """
+    results = []
+    with get_db_connection() as conn:
+        if conn is None: raise Exception("Database connection failed")
+        with conn.begin() as transaction:
+            conn.execute(text("SET LOCAL enable_seqscan = off"))
+            for label, query, params, expected_index in QUERY_PLAN_CHECKS:
+                plan = conn.execute(text(f"EXPLAIN (FORMAT JSON) {query}"), params).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                indexes = _plan_index_names(plan[0]["Plan"])
+                results.append({
+                    "query": label,
+                    "expected_index": expected_index,
+                    "uses_index": expected_index in indexes,
+                    "indexes_in_plan": ", ".join(sorted(indexes)) or "none",
+                })
+            transaction.rollback()
+    return results
+
+@st.cache_resource(show_spinner=False)
+def get_password_context():
+    return password_context_from_settings(get_setting)
+
 def hash_password(password):
-    """Hash password using SHA-256 for secure storage."""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash a password with a per-user salt for storage (see passwords.py)."""
+    return get_password_context().hash(password)
+
+def hash_import_passwords(passwords, generated):
+    """Hash an import's passwords across the hashing pool.
+
+    Generated passwords (the `generated` mask) are random, so they get the
+    cheaper import cost and are upgraded to the full cost on first login.
+    """
+    context = get_password_context()
+    hashed = pd.Series("", index=passwords.index, dtype=object)
+    hashed[~generated] = context.hash_many(passwords[~generated])
+    hashed[generated] = context.hash_many(passwords[generated], context.bulk_hasher)
+    return hashed
+
+def seed_default_data(conn):
+    """Insert the default admin user and subjects on an open connection if none exist."""
+    # Check for admin
+    result = conn.execute(text("SELECT COUNT(*) FROM teachers WHERE username = :user"), {"user": "admin"})
+    if result.scalar() == 0:
+        conn.execute(text("""
+            INSERT INTO teachers (teacher_id, username, password, first_name, last_name, email, subjects, role)
+            VALUES (:tid, :user, :pass, :fname, :lname, :email, :subjects, :role)
+        """), {
+            "tid": "TEA001", 
+            "user": "admin", 
+            "pass": hash_password("admin123"),
+            "fname": "Admin", 
+            "lname": "User", 
+            "email": "admin@school.com",
+            "subjects": '["All Subjects"]', 
+            "role": "admin"
+        })
+                
+    # Check for subjects
+    result = conn.execute(text("SELECT COUNT(*) FROM subjects"))
+    if result.scalar() == 0:
+        default_subjects = [
+            {"id": "SUB001", "name": "Data Science", "credits": 4},
+            {"id": "SUB002", "name": "Computer Science", "credits": 4},
+            {"id": "SUB003", "name": "Machine Learning", "credits": 4},
+            {"id": "SUB004", "name": "Web Development", "credits": 4},
+            {"id": "SUB005", "name": "Database Systems", "credits": 3},
+            {"id": "SUB006", "name": "Software Engineering", "credits": 3}
+        ]
+        # Use executemany with a list of dictionaries
+        conn.execute(text("INSERT INTO subjects (subject_id, name, credits) VALUES (:id, :name, :credits)"), default_subjects)
+
+    # The defaults above use fixed IDs, so move the sequences past them
+    sync_id_sequences(conn, ("TEA", "SUB"))
 
 def initialize_default_data():
     """Initialize the database with a default admin user and subjects if none exist."""
     with get_db_connection() as conn:
         if conn is None: return
         try:
-            with conn.begin(): # Start transaction
-                # Check for admin
-                result = conn.execute(text("SELECT COUNT(*) FROM teachers WHERE username = :user"), {"user": "admin"})
-                if result.scalar() == 0:
-                    conn.execute(text("""
-                        INSERT INTO teachers (teacher_id, username, password, first_name, last_name, email, subjects, role)
-                        VALUES (:tid, :user, :pass, :fname, :lname, :email, :subjects, :role)
-                    """), {
-                        "tid": "TEA001", 
-                        "user": "admin", 
-                        "pass": hash_password("admin123"),
-                        "fname": "Admin", 
-                        "lname": "User", 
-                        "email": "admin@school.com",
-                        "subjects": '["All Subjects"]', 
-                        "role": "admin"
-                    })
-                
-                # Check for subjects
-                result = conn.execute(text("SELECT COUNT(*) FROM subjects"))
-                if result.scalar() == 0:
-                    default_subjects = [
-                        {"id": "SUB001", "name": "Data Science", "credits": 4},
-                        {"id": "SUB002", "name": "Computer Science", "credits": 4},
-                        {"id": "SUB003", "name": "Machine Learning", "credits": 4},
-                        {"id": "SUB004", "name": "Web Development", "credits": 4},
-                        {"id": "SUB005", "name": "Database Systems", "credits": 3},
-                        {"id": "SUB006", "name": "Software Engineering", "credits": 3}
-                    ]
-                    # Use executemany with a list of dictionaries
-                    conn.execute(text("INSERT INTO subjects (subject_id, name, credits) VALUES (:id, :name, :credits)"), default_subjects)
+            with begin_write(conn): # Start transaction
+                lock_migrations(conn)  # seeding re-syncs the ID sequences
+                seed_default_data(conn)
         except sqlalchemy.exc.SQLAlchemyError as e:
             st.error(f"Error initializing default data: {e}")
 
+# --- Academic Structure ---
+YEAR_OPTIONS = ["1st Year", "2nd Year", "3rd Year", "4th Year"]
+SEMESTER_MAP = {
+    "1st Year": ["1st Semester", "2nd Semester"],
+    "2nd Year": ["3rd Semester", "4th Semester"],
+    "3rd Year": ["5th Semester", "6th Semester"],
+    "4th Year": ["7th Semester", "8th Semester"],
+}
+COURSE_OPTIONS = ["Data Science", "Computer Science", "Machine Learning", "Web Development", "Software Engineering"]
+GENDER_OPTIONS = ["Male", "Female", "Other"]
+EXAM_TYPES = ["Mid-term", "Final", "Quiz", "Assignment", "Project"]
+
 # --- Utility Functions ---
+EMAIL_PATTERN = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
+
 def validate_email(email):
     """Validate email format using regex."""
-    pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
-    return re.match(pattern, email) is not None
-
-def generate_id(prefix, table_name, column_name):
-    """Generic function to generate a new sequential ID."""
-    with get_db_connection() as conn:
-        if conn is None: return f"{prefix}001"
-        try:
-            # Use f-string for table/column names, which is safe as they are not user-input
-            query = text(f"SELECT {column_name} FROM {table_name} ORDER BY {column_name} DESC LIMIT 1")
-            result = conn.execute(query).fetchone()
-            if result:
-                last_id = int(result[0][len(prefix):])
-                return f"{prefix}{last_id + 1:03d}"
-            return f"{prefix}001"
-        except sqlalchemy.exc.SQLAlchemyError as e:
-            st.error(f"Error generating ID: {e}")
-            return f"{prefix}001"
+    return re.match(EMAIL_PATTERN, email) is not None
+
+def reserve_ids(prefix, n, conn=None):
+    """Reserve n unique IDs for the given prefix in a single round trip.
+
+    Pass an open connection to reserve inside an existing transaction;
+    otherwise a connection is borrowed just for the reservation.
+    """
+    if n <= 0:
+        return []
+    if conn is not None:
+        return repos.ids.reserve(conn, prefix, n)
+    with get_db_connection() as own_conn:
+        if own_conn is None: raise Exception("Database connection failed")
+        with begin_write(own_conn):
+            return repos.ids.reserve(own_conn, prefix, n)
+
+def generate_id(prefix, table_name=None, column_name=None):
+    """Allocate a new ID for the given prefix from its database sequence.
+
+    table_name/column_name are accepted for backwards compatibility; the
+    sequence for the prefix is looked up in ID_SEQUENCES.
+    """
+    return reserve_ids(prefix, 1)[0]
 
 def generate_student_id():
     return generate_id("STU", "students", "student_id")
@@ -233,44 +934,101 @@ def generate_password():
     """Generate a random, secure 8-character password."""
     return secrets.token_urlsafe(8)
 
-def calculate_grade(percentage):
-    """Calculate letter grade based on percentage."""
-    if percentage >= 90:
-        return 'A+'
-    elif percentage >= 85:
-        return 'A'
-    elif percentage >= 80:
-        return 'B+'
-    elif percentage >= 75:
-        return 'B'
-    elif percentage >= 70:
-        return 'C+'
-    elif percentage >= 65:
-        return 'C'
-    elif percentage >= 60:
-        return 'D'
-    else:
-        return 'F'
+# A grading scale is a list of [minimum_percentage, letter]; each letter
+# covers percentages from its minimum up to the next one. The scale seeded as
+# 'Default' and used when no stored scale applies.
+DEFAULT_GRADING_SCALE = [[0, 'F'], [60, 'D'], [65, 'C'], [70, 'C+'], [75, 'B'], [80, 'B+'], [85, 'A'], [90, 'A+']]
+
+def validate_grading_scale(boundaries):
+    """Return an error message for a malformed scale, or None if it is usable."""
+    if not boundaries:
+        return "A scale needs at least one boundary."
+    minimums = [b[0] for b in boundaries]
+    if any(m is None or not 0 <= m <= 100 for m in minimums):
+        return "Minimum percentages must be between 0 and 100."
+    if 0 not in minimums:
+        return "One boundary must start at 0%."
+    if len(set(minimums)) != len(minimums):
+        return "Minimum percentages must be unique."
+    if any(not isinstance(b[1], str) or not 1 <= len(b[1].strip()) <= 2 for b in boundaries):
+        return "Letters must be one or two characters."
+    return None
+
+def exam_percentage(marks_obtained, total_marks):
+    """Percentage rounded to the 2 decimals grades.percentage stores.
+
+    Grades are assigned from this rounded value, so a grade always matches
+    the stored percentage and regrade() never changes it (89.996% is 90.00%).
+    Works on scalars and Series alike.
+    """
+    return np.round(marks_obtained / total_marks * 100, 2)
+
+def calculate_grades(percentages, boundaries=DEFAULT_GRADING_SCALE):
+    """Letter grades for an array of percentages in one sorted-bin lookup. Drop NaNs first."""
+    ordered = sorted(boundaries)
+    minimums = np.array([b[0] for b in ordered], dtype=float)
+    letters = np.array([b[1] for b in ordered], dtype=object)
+    positions = np.searchsorted(minimums, np.asarray(percentages, dtype=float), side="right") - 1
+    return letters[np.clip(positions, 0, None)]
+
+def resolve_grading_scale(scales, course, semester):
+    """Pick the most specific scale: course and semester, course, semester, then the default."""
+    by_scope = {(s['course'], s['semester']): s['boundaries'] for s in scales}
+    for scope in ((course, semester), (course, None), (None, semester), (None, None)):
+        if scope in by_scope:
+            return by_scope[scope]
+    return DEFAULT_GRADING_SCALE
+
+def apply_grading_scales(percentages, courses, semesters, scales):
+    """Grade many rows at once, one vectorized lookup per (course, semester) group."""
+    percentages = np.asarray(percentages, dtype=float)
+    grades = np.empty(len(percentages), dtype=object)
+    groups = pd.DataFrame({"course": courses, "semester": semesters}).groupby(["course", "semester"], dropna=False).indices
+    for (course, semester), positions in groups.items():
+        course = None if pd.isna(course) else course
+        semester = None if pd.isna(semester) else semester
+        grades[positions] = calculate_grades(percentages[positions], resolve_grading_scale(scales, course, semester))
+    return grades
+
+def calculate_grade(percentage, course=None, semester=None):
+    """Calculate letter grade based on percentage, using the scale for the course/semester."""
+    return str(calculate_grades([percentage], resolve_grading_scale(get_grading_scales(), course, semester))[0])
 
 # --- Authentication ---
 def authenticate_user(username, password, user_type):
-    """Authenticate a user by checking credentials against the database."""
-    with get_db_connection() as conn:
-        if conn is None: return None
-        hashed_pass = hash_password(password)
+    """Authenticate a user: look them up by login name, then verify the password in Python.
+
+    A stored hash from an older scheme or cost is replaced on a successful login.
+    """
+    try:
+        with get_db_connection() as conn:
+            if conn is None: return None
+            with conn.begin():
+                if user_type == "student":
+                    user = repos.students.find(conn, username, (*STUDENT_PROFILE_COLUMNS, "password"))
+                else:  # teacher or admin
+                    user = repos.teachers.find_by_username(conn, username, (*TEACHER_PROFILE_COLUMNS, "password"))
+    except sqlalchemy.exc.SQLAlchemyError as e:
+        st.error(f"Authentication error: {e}")
+        return None
+    # The connection is back in the pool before the KDF runs, so a login burst
+    # queues on the hashing pool instead of holding database connections.
+    # The hash itself never reaches the session.
+    ok, new_hash = get_password_context().verify(password, user.pop("password") if user else None)
+    if not ok:
+        return None
+    if new_hash:
         try:
-            if user_type == "student":
-                query = text("SELECT * FROM students WHERE student_id = :user AND password = :pass")
-            else: # teacher or admin
-                query = text("SELECT * FROM teachers WHERE username = :user AND password = :pass")
-            
-            result = conn.execute(query, {"user": username, "pass": hashed_pass})
-            # .mappings().fetchone() returns a dict-like object (replaces dictionary=True)
-            user = result.mappings().fetchone()
-            return user
-        except sqlalchemy.exc.SQLAlchemyError as e:
-            st.error(f"Authentication error: {e}")
-            return None
+            with get_db_connection() as conn:
+                if conn is not None:
+                    with begin_write(conn):
+                        if user_type == "student":
+                            repos.students.set_password(conn, user["student_id"], new_hash)
+                        else:
+                            repos.teachers.set_password(conn, user["teacher_id"], new_hash)
+        except sqlalchemy.exc.SQLAlchemyError:
+            pass  # The old hash still verifies; the upgrade is retried on the next login
+    return user
 
 def login_page():
     """Display the main login interface."""
@@ -322,50 +1080,1190 @@ def logout():
 
 # --- Data Retrieval Functions ---
 # pd.read_sql works fine with the SQLAlchemy connection and %s param style for psycopg2
+
+# Reference datasets (students, teachers, subjects) are re-read on every rerun by
+# several pages, so they are cached process-wide and shared across sessions.
+# Write paths call invalidate_reference_cache() so edits show up immediately;
+# the TTL only bounds staleness for changes made outside this app.
+REFERENCE_CACHE_TTL = 300  # seconds
+REFERENCE_CACHE_MAX_ENTRIES = 16
+
+# Data helpers return DataFrames end to end, built column-wise from the
+# cursor, so pages render and filter them without per-row dicts. Code that
+# needs a single row as a dict uses first_row(). An empty DataFrame stands in
+# for "no rows" and for errors already reported with st.error.
+def first_row(frame):
+    """The first row of a frame as a plain dict (NULLs as None), or None if it is empty."""
+    if frame.empty:
+        return None
+    return {key: None if pd.isna(value) else value for key, value in frame.iloc[0].items()}
+
+# Grade and attendance results repeat a handful of labels and IDs across many
+# rows and carry DECIMAL marks. read_arrow decodes them into these Arrow types as rows
+# stream in: dictionary-encoded labels (categoricals in pandas), float32 marks
+# and date32 dates. Other columns keep the type Arrow infers.
+COMPACT_COLUMN_TYPES = {
+    "student_id": pa.dictionary(pa.int32(), pa.string()),
+    "teacher_id": pa.dictionary(pa.int32(), pa.string()),
+    "subject": pa.dictionary(pa.int32(), pa.string()),
+    "status": pa.dictionary(pa.int32(), pa.string()),
+    "grade": pa.dictionary(pa.int32(), pa.string()),
+    "exam_type": pa.dictionary(pa.int32(), pa.string()),
+    "percentage": pa.float32(),
+    "marks_obtained": pa.float32(),
+    "total_marks": pa.float32(),
+    "date": pa.date32(),
+}
+COMPACT_FETCH_ROWS = 50000  # rows decoded per batch from the server-side cursor
+
+def _arrow_column(name, values):
+    arrow_type = COMPACT_COLUMN_TYPES.get(name)
+    if arrow_type is None:
+        return pa.array(values)
+    if pa.types.is_dictionary(arrow_type):
+        return pa.array(values, type=pa.string()).dictionary_encode()
+    if pa.types.is_floating(arrow_type):
+        # DECIMAL values arrive as Decimal; Arrow casts decimal128 to float in bulk
+        return pa.array(values).cast(arrow_type)
+    return pa.array(values, type=arrow_type)
+
+def stream_query(conn, query, params=None, batch_rows=COMPACT_FETCH_ROWS):
+    """Execute a query on a server-side cursor that buffers at most batch_rows rows client-side."""
+    return repos.stream(conn, query, params, batch_rows)
+
+def arrow_batches(result, batch_rows=COMPACT_FETCH_ROWS):
+    """Yield a streamed result as Arrow tables of up to batch_rows rows with compact column types."""
+    names = list(result.keys())
+    for rows in result.partitions(batch_rows):
+        yield pa.table([_arrow_column(name, list(values)) for name, values in zip(names, zip(*rows))], names=names)
+
+def read_arrow(conn, query, params=None, batch_rows=COMPACT_FETCH_ROWS):
+    """Run a query into an Arrow table with compact column types.
+
+    Rows are streamed from a server-side cursor and converted a batch at a
+    time, so Python objects only ever exist for one batch.
+    """
+    result = stream_query(conn, query, params, batch_rows)
+    names = list(result.keys())
+    batches = list(arrow_batches(result, batch_rows))
+    if not batches:
+        return pa.table({name: pa.array([], type=COMPACT_COLUMN_TYPES.get(name, pa.null())) for name in names})
+    return pa.concat_tables(batches, promote_options="permissive").unify_dictionaries()
+
+def _compact_pandas_type(arrow_type):
+    # Keep dates as Arrow date32 in pandas; the default would make Python date objects
+    return pd.ArrowDtype(arrow_type) if arrow_type == pa.date32() else None
+
+def read_compact_frame(conn, query, params=None):
+    """read_arrow, converted to a DataFrame with categorical labels, float32 marks and date32 dates."""
+    return read_arrow(conn, query, params).to_pandas(types_mapper=_compact_pandas_type)
+
 def get_student_grades(student_id):
     with get_db_connection() as conn:
-        if conn is None: return []
+        if conn is None: return pd.DataFrame()
         try:
-            return pd.read_sql("SELECT * FROM grades WHERE student_id = %s ORDER BY date DESC", conn, params=(student_id,)).to_dict('records')
+            return repos.grades.for_student(conn, student_id, read=read_compact_frame)
         except Exception as e:
             st.error(f"Error fetching grades: {e}")
-            return []
+            return pd.DataFrame()
 
 def get_student_attendance(student_id):
     with get_db_connection() as conn:
-        if conn is None: return []
+        if conn is None: return pd.DataFrame()
         try:
-            return pd.read_sql("SELECT * FROM attendance WHERE student_id = %s ORDER BY date DESC", conn, params=(student_id,)).to_dict('records')
+            return repos.attendance.for_student(conn, student_id, read=read_compact_frame)
         except Exception as e:
             st.error(f"Error fetching attendance: {e}")
-            return []
+            return pd.DataFrame()
+
+# Per-student aggregates, read from the few student_subject_summary rows of
+# one student rather than from grade and attendance history. ROLLUP returns
+# one row per subject plus a grand total row (subject NULL), which is present
+# even when there is no history.
+def _summary_queries(columns, having):
+    """The per-subject plus grand total query for each backend."""
+    return {
+        "postgresql": f"""
+            SELECT subject, {columns}
+            FROM student_subject_summary
+            WHERE student_id = :sid
+            GROUP BY ROLLUP (subject)
+            HAVING GROUPING(subject) = 1 OR {having}
+            ORDER BY subject
+        """,
+        # SQLite has no ROLLUP, so the total row is a second aggregate over the same few rows
+        "sqlite": f"""
+            SELECT subject, {columns}
+            FROM student_subject_summary
+            WHERE student_id = :sid
+            GROUP BY subject
+            HAVING {having}
+            UNION ALL
+            SELECT NULL, {columns}
+            FROM student_subject_summary
+            WHERE student_id = :sid
+            ORDER BY subject
+        """,
+    }
+
+GRADE_SUMMARY_QUERY = _summary_queries(
+    """CAST(SUM(exams) AS INTEGER) AS exams,
+           CAST(SUM(percentage_sum) / NULLIF(SUM(exams), 0) AS FLOAT) AS average_percentage""",
+    "SUM(exams) > 0")
+ATTENDANCE_SUMMARY_QUERY = _summary_queries(
+    """CAST(SUM(classes) AS INTEGER) AS classes, CAST(SUM(present) AS INTEGER) AS present,
+           CAST(100.0 * SUM(present) / NULLIF(SUM(classes), 0) AS FLOAT) AS attendance_percentage""",
+    "SUM(classes) > 0")
+
+def _student_summary(queries, student_id, label):
+    """Run a ROLLUP summary query (one of _summary_queries) on the connected backend.
+
+    Returns (overall, by_subject): overall is a dict, by_subject a DataFrame.
+    On failure returns (None, empty DataFrame).
+    """
+    with get_db_connection() as conn:
+        if conn is None: return None, pd.DataFrame()
+        try:
+            frame = read_frame(conn, queries[conn.dialect.name], {"sid": student_id})
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            st.error(f"Error fetching {label} summary: {e}")
+            return None, pd.DataFrame()
+    totals = frame['subject'].isna()
+    overall = first_row(frame[totals])
+    # SUM over no rows is NULL; report an empty history as zero counts
+    for key in ("exams", "classes", "present"):
+        if key in overall and overall[key] is None:
+            overall[key] = 0
+    return overall, frame[~totals].reset_index(drop=True)
+
+def get_grade_summary(student_id):
+    """Exam count and average percentage, overall and per subject, aggregated in the database."""
+    return _student_summary(GRADE_SUMMARY_QUERY, student_id, "grade")
+
+def get_attendance_summary(student_id):
+    """Classes, classes present and attendance %, overall and per subject, aggregated in the database."""
+    return _student_summary(ATTENDANCE_SUMMARY_QUERY, student_id, "attendance")
+
+def get_section_overview(teacher_id):
+    """Average percentage and attendance % per section of a teacher, from the summary rows of its roster."""
+    with get_db_connection() as conn:
+        if conn is None: return pd.DataFrame()
+        try:
+            return read_frame(conn, """
+                SELECT sub.name AS subject, sec.course, sec.year, sec.semester, COUNT(e.student_id) AS students,
+                       CAST(SUM(ss.percentage_sum) / NULLIF(SUM(ss.exams), 0) AS FLOAT) AS average_percentage,
+                       CAST(100.0 * SUM(ss.present) / NULLIF(SUM(ss.classes), 0) AS FLOAT) AS attendance_percentage
+                FROM sections sec
+                JOIN subjects sub ON sub.subject_id = sec.subject_id
+                LEFT JOIN enrollments e ON e.section_id = sec.section_id
+                LEFT JOIN student_subject_summary ss ON ss.student_id = e.student_id AND ss.subject = sub.name
+                WHERE sec.teacher_id = :tid
+                GROUP BY sec.section_id, sub.name, sec.course, sec.year, sec.semester
+                ORDER BY sub.name, sec.course, sec.year, sec.semester
+            """, {"tid": teacher_id})
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            st.error(f"Error fetching class overview: {e}")
+            return pd.DataFrame()
 
-def get_all_students():
+def _read_reference_table(query):
+    """Run a reference-table query, raising on failure so errors are never cached."""
+    with get_db_connection() as conn:
+        if conn is None: raise Exception("Database connection failed")
+        return read_frame(conn, query)
+
+# Student reads name the columns they need instead of SELECT *: the picker
+# projection is a small fraction of a full row, and list views never need the
+# password hash. Heavy profile fields load one student at a time.
+STUDENT_COLUMNS = (
+    "student_id", "first_name", "last_name", "email", "phone", "date_of_birth", "gender",
+    "course", "year", "semester", "address", "emergency_contact", "enrollment_date",
+    "password", "status", "created_at",
+)
+STUDENT_PICKER_COLUMNS = ("student_id", "first_name", "last_name")
+STUDENT_LIST_COLUMNS = ("student_id", "first_name", "last_name", "gender", "course", "email", "phone", "status")
+STUDENT_PROFILE_COLUMNS = tuple(c for c in STUDENT_COLUMNS if c != "password")
+TEACHER_PROFILE_COLUMNS = ("teacher_id", "username", "first_name", "last_name", "email", "subjects", "role", "created_at")
+
+def _select_columns(columns, allowed):
+    """Validate a projection against a table's known columns and render it for SQL."""
+    unknown = [c for c in columns if c not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown columns requested: {', '.join(unknown)}")
+    return ", ".join(columns)
+
+@st.cache_data(ttl=REFERENCE_CACHE_TTL, max_entries=REFERENCE_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_students(columns):
+    projection = _select_columns(columns, STUDENT_COLUMNS)
+    return _read_reference_table(f"SELECT {projection} FROM students ORDER BY first_name, last_name")
+
+@st.cache_data(ttl=REFERENCE_CACHE_TTL, max_entries=REFERENCE_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_teachers():
+    return _read_reference_table("SELECT teacher_id, username, first_name, last_name, email, role FROM teachers ORDER BY first_name")
+
+@st.cache_data(ttl=REFERENCE_CACHE_TTL, max_entries=REFERENCE_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_subjects():
+    return _read_reference_table("SELECT * FROM subjects ORDER BY name")
+
+@st.cache_data(ttl=REFERENCE_CACHE_TTL, max_entries=REFERENCE_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_sections():
+    return _read_reference_table("""
+        SELECT sec.section_id, sec.subject_id, sub.name AS subject, sec.teacher_id,
+               t.first_name || ' ' || t.last_name AS teacher, sec.course, sec.year, sec.semester,
+               (SELECT COUNT(*) FROM enrollments e WHERE e.section_id = sec.section_id) AS students
+        FROM sections sec
+        JOIN subjects sub ON sub.subject_id = sec.subject_id
+        JOIN teachers t ON t.teacher_id = sec.teacher_id
+        ORDER BY sub.name, sec.course, sec.year, sec.semester
+    """)
+
+@st.cache_data(ttl=REFERENCE_CACHE_TTL, max_entries=256, show_spinner=False)
+def _cached_section_roster(section_id):
+    with get_db_connection() as conn:
+        if conn is None: raise Exception("Database connection failed")
+        return read_frame(conn, """
+            SELECT s.student_id, s.first_name, s.last_name
+            FROM enrollments e
+            JOIN students s ON s.student_id = e.student_id
+            WHERE e.section_id = :section_id
+            ORDER BY s.first_name, s.last_name, s.student_id
+        """, {"section_id": section_id})
+
+@st.cache_data(ttl=REFERENCE_CACHE_TTL, max_entries=REFERENCE_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_grading_scales():
     with get_db_connection() as conn:
-        if conn is None: return []
+        if conn is None: raise Exception("Database connection failed")
+        return load_grading_scales(conn)
+
+def load_grading_scales(conn):
+    """Read the grading scales on an open connection, bypassing the cache."""
+    # Scales stay a list of dicts: a few rows with JSON boundaries, and a NULL
+    # scope must stay None rather than become NaN
+    rows = conn.execute(text("""
+        SELECT scale_id, name, course, semester, boundaries FROM grading_scales
+        ORDER BY course NULLS FIRST, semester NULLS FIRST
+    """)).mappings().all()
+    # psycopg2 decodes JSON columns; SQLite hands back the stored text
+    return [{**row, "boundaries": json.loads(row["boundaries"]) if isinstance(row["boundaries"], str) else row["boundaries"]}
+            for row in rows]
+
+# Which cached loaders depend on each table. Rosters read students and
+# enrollments, so student changes clear them too.
+_REFERENCE_CACHES = {
+    "students": (_cached_students, _cached_sections, _cached_section_roster),
+    "teachers": (_cached_teachers, _cached_sections),
+    "subjects": (_cached_subjects, _cached_sections),
+    "sections": (_cached_sections, _cached_section_roster),
+    "grading_scales": (_cached_grading_scales,),
+}
+
+def invalidate_reference_cache(*tables):
+    """Drop cached reference data for the given tables (all of them if none given)."""
+    for table in tables or _REFERENCE_CACHES:
+        for cached in _REFERENCE_CACHES[table]:
+            cached.clear()
+    _cached_row_count.clear()
+    if not tables or "students" in tables:
+        _cached_student_search.clear()
+
+# Above this many rows the planner's estimate (pg_class.reltuples, kept fresh
+# by autovacuum) is shown instead of running COUNT(*) over the whole table.
+# Embedded databases keep no such estimate and always count.
+EXACT_COUNT_THRESHOLD = 10000
+
+@st.cache_data(ttl=REFERENCE_CACHE_TTL, max_entries=REFERENCE_CACHE_MAX_ENTRIES, show_spinner=False)
+def _cached_row_count(table, where=None):
+    with get_db_connection() as conn:
+        if conn is None: raise Exception("Database connection failed")
+        if where is None and conn.dialect.name == "postgresql":
+            estimate = conn.execute(text("SELECT reltuples::BIGINT FROM pg_class WHERE oid = to_regclass(:t)"),
+                                    {"t": table}).scalar()
+            if estimate is not None and estimate >= EXACT_COUNT_THRESHOLD:
+                return int(estimate), True
+        # Use f-string for table names and filters, which are not user input
+        query = f"SELECT COUNT(*) FROM {table}" + (f" WHERE {where}" if where else "")
+        return conn.execute(text(query)).scalar(), False
+
+def count_rows(table, where=None):
+    """Return (row_count, is_estimate) for a table, cheap enough to call on every rerun."""
+    try:
+        return _cached_row_count(table, where)
+    except Exception as e:
+        st.error(f"Error counting {table}: {e}")
+        return 0, False
+
+def fetch_keyset_page(table, columns, key_columns, after=None, page_size=25, where=None):
+    """One page of rows ordered by key_columns, starting after the key tuple `after`.
+
+    Returns (rows, has_more) with rows as a DataFrame. Pages seek with a
+    row-value comparison on an index over key_columns, so the last page costs
+    the same as the first.
+    """
+    order = ", ".join(key_columns)
+    conditions = [where] if where else []
+    params = {"limit": page_size + 1}
+    if after is not None:
+        placeholders = ", ".join(f":k{i}" for i in range(len(key_columns)))
+        conditions.append(f"({order}) > ({placeholders})")
+        params.update({f"k{i}": value for i, value in enumerate(after)})
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    with get_db_connection() as conn:
+        if conn is None: return pd.DataFrame(columns=list(columns)), False
         try:
-            return pd.read_sql("SELECT * FROM students ORDER BY first_name, last_name", conn).to_dict('records')
-        except Exception as e:
-            st.error(f"Error fetching students: {e}")
-            return []
+            rows = read_frame(conn, f"SELECT {', '.join(columns)} FROM {table} {where_sql} ORDER BY {order} LIMIT :limit", params)
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            st.error(f"Error fetching {table}: {e}")
+            return pd.DataFrame(columns=list(columns)), False
+    return rows.iloc[:page_size], len(rows) > page_size
 
-def get_all_teachers():
+STUDENT_KEYSET = ("first_name", "last_name", "student_id")
+TEACHER_KEYSET = ("first_name", "last_name", "teacher_id")
+TEACHER_LIST_COLUMNS = ("teacher_id", "username", "first_name", "last_name", "email", "role")
+NON_ADMIN_TEACHERS = "role <> 'admin'"
+
+def get_students_page(after=None, page_size=25, columns=STUDENT_LIST_COLUMNS):
+    return fetch_keyset_page("students", columns, STUDENT_KEYSET, after, page_size)
+
+def get_teachers_page(after=None, page_size=25, columns=TEACHER_LIST_COLUMNS):
+    return fetch_keyset_page("teachers", columns, TEACHER_KEYSET, after, page_size, where=NON_ADMIN_TEACHERS)
+
+SEARCH_RESULT_LIMIT = 20
+SEARCH_CACHE_TTL = 60  # seconds; typeahead reruns repeat the same term
+
+def _escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+@st.cache_data(ttl=SEARCH_CACHE_TTL, max_entries=256, show_spinner=False)
+def _cached_student_search(term, limit):
+    # Spelled out: SQLite has no default LIKE escape character
+    needle = _escape_like(term.strip().lower())
+    with get_db_connection() as conn:
+        if conn is None: raise Exception("Database connection failed")
+        return read_frame(conn, f"""
+            SELECT student_id, first_name, last_name, email
+            FROM students
+            WHERE {STUDENT_SEARCH_EXPRESSION} LIKE :contains ESCAPE '\\'
+               OR lower(student_id) LIKE :prefix ESCAPE '\\'
+            ORDER BY
+                CASE
+                    WHEN lower(student_id) = :exact THEN 0
+                    WHEN lower(student_id) LIKE :prefix ESCAPE '\\' THEN 1
+                    WHEN lower(first_name || ' ' || last_name) LIKE :prefix ESCAPE '\\' THEN 2
+                    WHEN lower(email) LIKE :prefix ESCAPE '\\' THEN 3
+                    ELSE 4
+                END,
+                first_name, last_name, student_id
+            LIMIT :limit
+        """, {"contains": f"%{needle}%", "prefix": f"{needle}%", "exact": needle, "limit": limit})
+
+def search_students(term, limit=SEARCH_RESULT_LIMIT):
+    """Top matches for a typeahead term by student ID, name or email.
+
+    Ranks exact ID, then ID prefix, then name and email prefix matches ahead
+    of substring matches. The pg_trgm index keeps substring search fast once
+    the term is three or more characters long.
+    """
+    if not term or not term.strip():
+        return pd.DataFrame()
+    try:
+        return _cached_student_search(term.strip().lower(), limit)
+    except Exception as e:
+        st.error(f"Error searching students: {e}")
+        return pd.DataFrame()
+
+def student_search_picker(label, key):
+    """Typeahead student selector. Returns the chosen student_id, or None."""
+    term = st.text_input(label, key=f"{key}_term", placeholder="Type a student ID, name or email")
+    if not term:
+        return None
+    matches = search_students(term)
+    if matches.empty:
+        st.caption("No matching students.")
+        return None
+    labels = dict(zip(matches['student_id'], matches['student_id'] + " - " + matches['first_name'] + " "
+                      + matches['last_name'] + " (" + matches['email'] + ")"))
+    return st.selectbox("Matching students", options=list(labels), format_func=labels.get, key=f"{key}_choice")
+
+PAGE_SIZE_OPTIONS = [25, 50, 100]
+
+def keyset_pager(state_key, fetch_page, key_columns, total, noun):
+    """Render page-size and previous/next controls for a keyset-paginated list.
+
+    fetch_page(after, page_size) returns (rows, has_more); total is the
+    (count, is_estimate) pair from count_rows(). The stack of page-start
+    cursors lives in session state, so moving back needs no extra query.
+    Returns the rows of the current page as a DataFrame.
+    """
+    cursor_key = f"{state_key}_cursors"
+    if cursor_key not in st.session_state:
+        st.session_state[cursor_key] = [None]
+
+    def reset_cursors():
+        st.session_state[cursor_key] = [None]
+
+    page_size = st.selectbox("Rows per page", PAGE_SIZE_OPTIONS, key=f"{state_key}_page_size", on_change=reset_cursors)
+    cursors = st.session_state[cursor_key]
+    rows, has_more = fetch_page(cursors[-1], page_size)
+    if rows.empty and len(cursors) > 1:
+        # The page emptied out (e.g. after a delete); start over from the top
+        reset_cursors()
+        cursors = st.session_state[cursor_key]
+        rows, has_more = fetch_page(None, page_size)
+
+    count, is_estimate = total
+    approx = "~" if is_estimate else ""
+    next_cursor = tuple(rows.iloc[-1][list(key_columns)].tolist()) if not rows.empty else None
+
+    col1, col2, col3 = st.columns([1, 3, 1])
+    col1.button("⬅️ Previous", key=f"{state_key}_prev", disabled=len(cursors) == 1,
+                on_click=lambda: cursors.pop())
+    col2.caption(f"Page {len(cursors)} of {approx}{max(1, math.ceil(count / page_size))} · {approx}{count} {noun}")
+    col3.button("Next ➡️", key=f"{state_key}_next", disabled=not has_more,
+                on_click=lambda: cursors.append(next_cursor))
+    return rows
+
+def get_all_students(columns=STUDENT_PICKER_COLUMNS):
+    """All students, fetching only `columns` (names and IDs by default)."""
+    try:
+        return _cached_students(tuple(columns))
+    except Exception as e:
+        st.error(f"Error fetching students: {e}")
+        return pd.DataFrame(columns=list(columns))
+
+def get_sections(teacher_id=None):
+    """All class sections, or only those taught by teacher_id, with subject name and enrolled count."""
+    try:
+        sections = _cached_sections()
+    except Exception as e:
+        st.error(f"Error fetching sections: {e}")
+        return pd.DataFrame()
+    if teacher_id is None or sections.empty:
+        return sections
+    return sections[sections['teacher_id'] == teacher_id].reset_index(drop=True)
+
+def get_grading_scales():
+    """All stored grading scales; an empty list (default scale only) if they cannot be read."""
+    try:
+        return _cached_grading_scales()
+    except Exception as e:
+        st.error(f"Error fetching grading scales: {e}")
+        return []
+
+def get_section_roster(section_id):
+    """Students enrolled in one section, read through the enrollments index."""
+    try:
+        return _cached_section_roster(section_id)
+    except Exception as e:
+        st.error(f"Error fetching class roster: {e}")
+        return pd.DataFrame(columns=list(STUDENT_PICKER_COLUMNS))
+
+def section_labels(sections):
+    """Display label for every row of a sections frame."""
+    return sections['subject'] + " · " + sections['course'] + " · " + sections['year'] + ", " + sections['semester']
+
+def get_student_profile(student_id, columns=STUDENT_PROFILE_COLUMNS):
+    """Load the full profile of one student, for views where a single student is selected."""
+    projection = _select_columns(columns, STUDENT_COLUMNS)
     with get_db_connection() as conn:
-        if conn is None: return []
+        if conn is None: return None
         try:
-            return pd.read_sql("SELECT teacher_id, username, first_name, last_name, email, role FROM teachers ORDER BY first_name", conn).to_dict('records')
-        except Exception as e:
-            st.error(f"Error fetching teachers: {e}")
-            return []
+            return conn.execute(text(f"SELECT {projection} FROM students WHERE student_id = :sid"),
+                                {"sid": student_id}).mappings().fetchone()
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            st.error(f"Error fetching student profile: {e}")
+            return None
+
+def get_all_teachers():
+    try:
+        return _cached_teachers()
+    except Exception as e:
+        st.error(f"Error fetching teachers: {e}")
+        return pd.DataFrame()
 
 def get_all_subjects():
+    try:
+        return _cached_subjects()
+    except Exception as e:
+        st.error(f"Error fetching subjects: {e}")
+        return pd.DataFrame()
+
+# --- Section Write Path ---
+def enroll_in_cohort_sections(conn, student_ids):
+    """Enroll students into every existing section for their course/year/semester."""
+    conn.execute(text("""
+        INSERT INTO enrollments (section_id, student_id)
+        SELECT sec.section_id, s.student_id
+        FROM students s
+        JOIN sections sec ON sec.course = s.course AND sec.year = s.year AND sec.semester = s.semester
+        WHERE s.student_id IN :ids
+        ON CONFLICT DO NOTHING
+    """).bindparams(bindparam("ids", expanding=True)), {"ids": list(student_ids)})
+
+def enroll_cohort(conn, section_id):
+    """Enroll all active students of a section's cohort. Returns the number of new enrollments."""
+    return conn.execute(text("""
+        INSERT INTO enrollments (section_id, student_id)
+        SELECT sec.section_id, s.student_id
+        FROM sections sec
+        JOIN students s ON s.course = sec.course AND s.year = sec.year AND s.semester = sec.semester
+        WHERE sec.section_id = :section_id AND s.status = 'Active'
+        ON CONFLICT DO NOTHING
+    """), {"section_id": section_id}).rowcount
+
+# Adds a subject to teachers.subjects (a JSON list) unless it is already there
+TEACHER_SUBJECT_APPEND = {
+    "postgresql": """
+        UPDATE teachers
+        SET subjects = (COALESCE(subjects::jsonb, '[]'::jsonb) || jsonb_build_array(CAST(:subject AS TEXT)))::json
+        WHERE teacher_id = :teacher_id
+          AND NOT COALESCE(subjects::jsonb, '[]'::jsonb) @> jsonb_build_array(CAST(:subject AS TEXT))
+    """,
+    "sqlite": """
+        UPDATE teachers
+        SET subjects = json_insert(COALESCE(subjects, '[]'), '$[#]', :subject)
+        WHERE teacher_id = :teacher_id
+          AND NOT EXISTS (SELECT 1 FROM json_each(COALESCE(teachers.subjects, '[]')) WHERE value = :subject)
+    """,
+}
+
+def create_section(subject_id, subject_name, teacher_id, course, year, semester):
+    """Create a section, enroll its cohort and record the subject on the teacher's profile.
+
+    Returns (section_id, enrolled_count).
+    """
+    with get_db_connection() as conn:
+        if conn is None: raise Exception("Database connection failed")
+        with begin_write(conn):
+            section_id = reserve_ids("SEC", 1, conn)[0]
+            conn.execute(text("""
+                INSERT INTO sections (section_id, subject_id, teacher_id, course, year, semester)
+                VALUES (:section_id, :subject_id, :teacher_id, :course, :year, :semester)
+            """), {"section_id": section_id, "subject_id": subject_id, "teacher_id": teacher_id,
+                   "course": course, "year": year, "semester": semester})
+            enrolled = enroll_cohort(conn, section_id)
+            # Keep teachers.subjects listing what the teacher actually teaches
+            conn.execute(text(TEACHER_SUBJECT_APPEND[conn.dialect.name]),
+                         {"subject": subject_name, "teacher_id": teacher_id})
+    invalidate_reference_cache("sections")
+    return section_id, enrolled
+
+# --- Summary Maintenance ---
+SUMMARY_TABLE = sqlalchemy.table(
+    "student_subject_summary",
+    *[sqlalchemy.column(name) for name in ("student_id", "subject", "exams", "percentage_sum", "last_exam_date",
+                                           "classes", "present", "updated_at")]
+)
+SUMMARY_COUNTERS = ("exams", "percentage_sum", "classes", "present")
+
+# The summary recomputed from the base tables; used to rebuild and to check it
+SUMMARY_FROM_BASE_TABLES = """
+    SELECT COALESCE(g.student_id, a.student_id) AS student_id, COALESCE(g.subject, a.subject) AS subject,
+           COALESCE(g.exams, 0) AS exams, COALESCE(g.percentage_sum, 0) AS percentage_sum, g.last_exam_date,
+           COALESCE(a.classes, 0) AS classes, COALESCE(a.present, 0) AS present
+    FROM (
+        SELECT student_id, subject, COUNT(*) AS exams, SUM(percentage) AS percentage_sum, MAX(date) AS last_exam_date
+        FROM grades GROUP BY student_id, subject
+    ) g
+    FULL OUTER JOIN (
+        SELECT student_id, subject, COUNT(*) AS classes, COUNT(*) FILTER (WHERE status = 'Present') AS present
+        FROM attendance GROUP BY student_id, subject
+    ) a ON a.student_id = g.student_id AND a.subject = g.subject
+"""
+
+def apply_summary_deltas(conn, deltas):
+    """Add per-(student, subject) changes to student_subject_summary inside the caller's transaction.
+
+    deltas is a list of dicts with student_id and subject plus any of exams,
+    percentage_sum, classes, present (increments) and last_exam_date. The
+    increments are applied by the upsert itself, so concurrent writers for
+    the same student and subject cannot lose each other's changes.
+    """
+    if not deltas:
+        return
+    frame = pd.DataFrame(deltas)
+    for counter in SUMMARY_COUNTERS:
+        frame[counter] = frame[counter].fillna(0) if counter in frame else 0
+    if "last_exam_date" not in frame:
+        frame["last_exam_date"] = None
+    # Collapse to one row per key; sorted keys keep concurrent upserts from deadlocking
+    frame = frame.groupby(["student_id", "subject"], sort=True).agg(
+        {**{counter: "sum" for counter in SUMMARY_COUNTERS}, "last_exam_date": "max"}).reset_index()
+    frame["exams"] = frame["exams"].astype(int)
+    frame["classes"] = frame["classes"].astype(int)
+    frame["present"] = frame["present"].astype(int)
+    frame["last_exam_date"] = frame["last_exam_date"].astype(object).where(frame["last_exam_date"].notna(), None)
+
+    if conn.dialect.name == "postgresql":
+        stmt = pg_insert(SUMMARY_TABLE).values(frame.to_dict("records"))
+        last_exam_date = sqlalchemy.func.greatest(SUMMARY_TABLE.c.last_exam_date, stmt.excluded.last_exam_date)
+    else:
+        # SQLite's two-argument max() is NULL if either side is; GREATEST ignores NULLs
+        stmt = sqlite_insert(SUMMARY_TABLE).values(frame.to_dict("records"))
+        stored, new = SUMMARY_TABLE.c.last_exam_date, stmt.excluded.last_exam_date
+        last_exam_date = sqlalchemy.func.max(sqlalchemy.func.coalesce(stored, new), sqlalchemy.func.coalesce(new, stored))
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["student_id", "subject"],
+        set_={
+            **{counter: SUMMARY_TABLE.c[counter] + stmt.excluded[counter] for counter in SUMMARY_COUNTERS},
+            "last_exam_date": last_exam_date,
+            "updated_at": sqlalchemy.func.current_timestamp(),
+        },
+    )
+    conn.execute(stmt)
+
+def rebuild_student_subject_summary(conn):
+    """Recompute the whole summary from grades and attendance inside the caller's transaction.
+
+    Takes an exclusive lock so write paths wait instead of applying deltas
+    to rows that are being replaced (on SQLite the DELETE takes the database
+    write lock, which does the same). Returns the number of summary rows.
+    """
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("LOCK TABLE student_subject_summary IN EXCLUSIVE MODE"))
+    conn.execute(text("DELETE FROM student_subject_summary"))
+    return conn.execute(text(f"""
+        INSERT INTO student_subject_summary (student_id, subject, exams, percentage_sum, last_exam_date, classes, present)
+        {SUMMARY_FROM_BASE_TABLES}
+    """)).rowcount
+
+def recompute_summary_keys(conn, keys):
+    """Recompute the summary rows for specific (student_id, subject) pairs from the base tables.
+
+    For writes that remove history (such as deleting a teacher, which
+    cascades to their grades and attendance), where a delta cannot restore
+    last_exam_date.
+    """
+    if not keys:
+        return
+    keys = sorted(set(keys))
+    if conn.dialect.name == "postgresql":
+        student_ids, subjects = (list(column) for column in zip(*keys))
+        params = {"sids": student_ids, "subjects": subjects}
+        keyset = "(student_id, subject) IN (SELECT * FROM unnest(CAST(:sids AS TEXT[]), CAST(:subjects AS TEXT[])))"
+    else:
+        # No arrays in SQLite; the pairs travel as one JSON parameter instead
+        params = {"keys": json.dumps(keys)}
+        keyset = ("(student_id, subject) IN "
+                  "(SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(:keys))")
+    conn.execute(text(f"DELETE FROM student_subject_summary WHERE {keyset}"), params)
+    conn.execute(text(f"""
+        INSERT INTO student_subject_summary (student_id, subject, exams, percentage_sum, last_exam_date, classes, present)
+        SELECT * FROM ({SUMMARY_FROM_BASE_TABLES}) recomputed WHERE {keyset}
+    """), params)
+
+def check_student_subject_summary():
+    """Compare the summary with the base tables. Returns the rows that disagree as a DataFrame."""
+    with get_db_connection() as conn:
+        if conn is None: raise Exception("Database connection failed")
+        return pd.read_sql(text(f"""
+            SELECT COALESCE(e.student_id, s.student_id) AS student_id, COALESCE(e.subject, s.subject) AS subject,
+                   s.exams AS stored_exams, e.exams AS expected_exams,
+                   s.percentage_sum AS stored_percentage_sum, e.percentage_sum AS expected_percentage_sum,
+                   s.last_exam_date AS stored_last_exam_date, e.last_exam_date AS expected_last_exam_date,
+                   s.classes AS stored_classes, e.classes AS expected_classes,
+                   s.present AS stored_present, e.present AS expected_present
+            FROM ({SUMMARY_FROM_BASE_TABLES}) e
+            FULL OUTER JOIN student_subject_summary s ON s.student_id = e.student_id AND s.subject = e.subject
+            WHERE (s.exams, ROUND(s.percentage_sum, 2), s.last_exam_date, s.classes, s.present)
+                  IS DISTINCT FROM (e.exams, ROUND(e.percentage_sum, 2), e.last_exam_date, e.classes, e.present)
+            ORDER BY 1, 2
+        """), conn)
+
+# --- Attendance Write Path ---
+def save_attendance(attendance_date, subject, statuses, teacher_id):
+    """Write attendance for one date and subject, touching only rows whose status changed.
+
+    statuses maps student_id -> 'Present'/'Absent'. Rows for students not in
+    statuses are left alone, so other teachers' entries for the same class
+    survive. Returns {"inserted": n, "updated": n, "unchanged": n}.
+    """
+    result = {"inserted": 0, "updated": 0, "unchanged": 0}
+    if not statuses:
+        return result
+
     with get_db_connection() as conn:
-        if conn is None: return []
+        if conn is None: raise Exception("Database connection failed")
+        with begin_write(conn):
+            deltas = []
+            for row in repos.attendance.save_class(conn, attendance_date, subject, statuses, teacher_id):
+                result["inserted" if row["inserted"] else "updated"] += 1
+                present = row["status"] == 'Present'
+                # Updates only happen when the status changed, and there are
+                # two statuses, so an update flips present by one
+                deltas.append({"student_id": row["student_id"], "subject": subject,
+                               "classes": 1 if row["inserted"] else 0,
+                               "present": int(present) if row["inserted"] else (1 if present else -1)})
+            apply_summary_deltas(conn, deltas)
+
+    result["unchanged"] = len(statuses) - result["inserted"] - result["updated"]
+    return result
+
+def load_attendance_grid(students, attendance_date, subject):
+    """Build the attendance editor frame for a roster.
+
+    Columns: select, student_id, name, present (defaults to True for students
+    with no saved row) and saved_status (None when nothing is stored yet),
+    which the save path diffs against so only changed rows are written.
+    """
+    roster = students.reset_index(drop=True)
+    existing = pd.DataFrame(columns=["student_id", "status"])
+    with get_db_connection() as conn:
+        if conn:
+            try:
+                existing = repos.attendance.for_class(conn, attendance_date, subject)
+            except Exception as e:
+                st.error(f"Error loading existing attendance: {e}")
+    saved_status = roster['student_id'].map(existing.set_index('student_id')['status'])
+    return pd.DataFrame({
+        "select": False,
+        "student_id": roster['student_id'],
+        "name": roster['first_name'] + " " + roster['last_name'],
+        "present": saved_status.fillna('Present').eq('Present'),
+        "saved_status": saved_status.astype(object).where(saved_status.notna(), None),
+    })
+
+# --- Grade Write Path ---
+def prepare_exam_marks(marks, total_marks, roster_ids):
+    """Validate one exam's marks and compute percentage and grade for all rows at once.
+
+    marks has student_id and marks_obtained columns; rows with blank marks
+    are skipped. Returns (rows, errors): rows has student_id, marks_obtained
+    and percentage; errors has student_id and error, one row per problem.
+    """
+    raw = marks["marks_obtained"]
+    entered = raw.notna() & (raw.astype(str).str.strip() != "")
+    obtained = pd.to_numeric(raw, errors="coerce")
+    student_id = marks["student_id"].astype(str).str.strip()
+
+    checks = [
+        (entered & obtained.isna(), "marks are not a number"),
+        (obtained < 0, "marks cannot be negative"),
+        (obtained > total_marks, f"marks exceed the exam total ({total_marks:g})"),
+        (entered & ~student_id.isin(roster_ids), "student is not in this class"),
+        (entered & student_id.where(entered).duplicated(keep=False), "student listed more than once"),
+    ]
+    failed = pd.Series(False, index=marks.index)
+    errors = []
+    for mask, message in checks:
+        if mask.any():
+            failed |= mask
+            errors.append(pd.DataFrame({"student_id": student_id[mask], "error": message}))
+
+    keep = entered & ~failed
+    rows = pd.DataFrame({"student_id": student_id[keep], "marks_obtained": obtained[keep]})
+    rows["percentage"] = exam_percentage(rows["marks_obtained"], total_marks)
+    errors = pd.concat(errors, ignore_index=True) if errors else pd.DataFrame(columns=["student_id", "error"])
+    return rows, errors
+
+def save_exam_grades(subject, exam_type, exam_date, total_marks, rows, teacher_id):
+    """Grade and insert a prepared exam (see prepare_exam_marks) in one transaction. Returns the row count."""
+    if rows.empty:
+        return 0
+    scales = get_grading_scales()
+    with get_db_connection() as conn:
+        if conn is None: raise Exception("Database connection failed")
+        with begin_write(conn):
+            cohorts = pd.DataFrame(conn.execute(text(
+                "SELECT student_id, course, semester FROM students WHERE student_id IN :ids"
+            ).bindparams(bindparam("ids", expanding=True)), {"ids": rows["student_id"].tolist()}).mappings().all(),
+                columns=["student_id", "course", "semester"])
+            cohorts = cohorts.set_index("student_id").reindex(rows["student_id"])
+            records = rows.assign(
+                grade=apply_grading_scales(rows["percentage"], cohorts["course"].to_numpy(), cohorts["semester"].to_numpy(), scales),
+                grade_id=reserve_ids("GRA", len(rows), conn), subject=subject, exam_type=exam_type,
+                total_marks=total_marks, date=exam_date, teacher_id=teacher_id,
+            ).to_dict("records")
+            # Summary deltas use the stored (rounded) percentages so sums match the base table
+            deltas = [{"student_id": row["student_id"], "subject": row["subject"], "exams": 1,
+                       "percentage_sum": row["percentage"], "last_exam_date": row["date"]}
+                      for row in repos.grades.insert_many(conn, records)]
+            apply_summary_deltas(conn, deltas)
+    return len(records)
+
+def regrade(course=None, semester=None, conn=None):
+    """Recompute stored letter grades under the current scales in one bulk UPDATE.
+
+    course/semester limit the pass to students a changed scale can affect
+    (None meaning any). Grades are matched to scales by the student's
+    current course and semester. Pass an open connection to regrade inside
+    an existing transaction, such as the one that changed a scale; otherwise
+    a connection is borrowed just for the pass. Returns the number of grades
+    that changed.
+    """
+    if conn is None:
+        with get_db_connection() as own_conn:
+            if own_conn is None: raise Exception("Database connection failed")
+            with begin_write(own_conn):
+                return regrade(course, semester, own_conn)
+    # Read on the same connection so scale changes not yet committed apply
+    scales = load_grading_scales(conn)
+    stored = pd.DataFrame(conn.execute(text("""
+        SELECT g.grade_id, g.percentage, g.grade, s.course, s.semester
+        FROM grades g
+        JOIN students s ON s.student_id = g.student_id
+        WHERE (CAST(:course AS TEXT) IS NULL OR s.course = :course)
+          AND (CAST(:semester AS TEXT) IS NULL OR s.semester = :semester)
+    """), {"course": course, "semester": semester}).mappings().all(),
+        columns=["grade_id", "percentage", "grade", "course", "semester"])
+    if stored.empty:
+        return 0
+    stored["new_grade"] = apply_grading_scales(stored["percentage"], stored["course"].to_numpy(),
+                                               stored["semester"].to_numpy(), scales)
+    changed = stored[stored["grade"].str.strip() != stored["new_grade"]]
+    if changed.empty:
+        return 0
+    if conn.dialect.name == "postgresql":
+        conn.execute(text("""
+            UPDATE grades g SET grade = v.grade
+            FROM unnest(CAST(:ids AS TEXT[]), CAST(:grades AS TEXT[])) AS v(grade_id, grade)
+            WHERE g.grade_id = v.grade_id
+        """), {"ids": changed["grade_id"].tolist(), "grades": changed["new_grade"].tolist()})
+    else:
+        # In-process, so one statement per row costs no round trips
+        conn.execute(text("UPDATE grades SET grade = :grade WHERE grade_id = :grade_id"),
+                     changed[["grade_id", "new_grade"]].rename(columns={"new_grade": "grade"}).to_dict("records"))
+    return len(changed)
+
+# --- Bulk Student Import ---
+IMPORT_REQUIRED_COLUMNS = ("first_name", "last_name", "email", "phone", "date_of_birth",
+                           "gender", "course", "year", "semester")
+IMPORT_OPTIONAL_COLUMNS = ("address", "emergency_contact", "password")
+IMPORT_CHUNK_ROWS = 5000
+# VARCHAR limits of the students table; longer values would fail the whole chunk's bulk load
+IMPORT_MAX_LENGTHS = {"first_name": 50, "last_name": 50, "email": 100, "phone": 20, "emergency_contact": 20}
+# Columns an import writes, in the order of the bulk load into students
+STUDENT_IMPORT_FIELDS = STUDENT_FIELDS
+VALID_YEAR_SEMESTERS = pd.MultiIndex.from_tuples(
+    [(year, semester) for year, semesters in SEMESTER_MAP.items() for semester in semesters])
+
+def read_import_chunks(uploaded_file, chunk_rows=IMPORT_CHUNK_ROWS):
+    """Yield an uploaded CSV/XLSX file in chunks of stripped strings ('' for blanks).
+
+    Each chunk is indexed by spreadsheet row number (the header is row 1) so
+    errors can point back at the file.
+    """
+    if uploaded_file.name.lower().endswith((".xlsx", ".xls")):
+        # pandas cannot stream Excel files; read once and slice
+        frame = pd.read_excel(uploaded_file, dtype=str)
+        chunks = (frame.iloc[start:start + chunk_rows] for start in range(0, len(frame), chunk_rows))
+    else:
+        chunks = pd.read_csv(uploaded_file, dtype=str, chunksize=chunk_rows)
+    for chunk in chunks:
+        chunk = chunk.fillna("").apply(lambda column: column.str.strip())
+        chunk.columns = [str(c).strip().lower().replace(" ", "_") for c in chunk.columns]
+        chunk.index = chunk.index + 2
+        yield chunk
+
+def validate_student_chunk(conn, chunk, seen_emails):
+    """Run the add-student checks over a whole chunk at once.
+
+    Emails are checked against earlier rows of the file (seen_emails) and
+    against the students table. Returns (valid_rows, errors) where errors is
+    a Series of messages indexed by row number.
+    """
+    blank = {column: chunk[column] == "" for column in IMPORT_REQUIRED_COLUMNS}
+    checks = [(blank[column], f"{column} is required") for column in IMPORT_REQUIRED_COLUMNS]
+    checks += [(chunk[column].str.len() > limit, f"{column} is longer than {limit} characters")
+               for column, limit in IMPORT_MAX_LENGTHS.items()]
+
+    email = chunk["email"]
+    checks.append((~blank["email"] & ~email.str.match(EMAIL_PATTERN), "invalid email address"))
+    dob = pd.to_datetime(chunk["date_of_birth"], format="ISO8601", errors="coerce")
+    checks.append((~blank["date_of_birth"] & dob.isna(), "date_of_birth must be YYYY-MM-DD"))
+    for column, options in (("gender", GENDER_OPTIONS), ("course", COURSE_OPTIONS), ("year", YEAR_OPTIONS)):
+        checks.append((~blank[column] & ~chunk[column].isin(options), f"unknown {column} (expected one of: {', '.join(options)})"))
+    year_semester = pd.MultiIndex.from_arrays([chunk["year"], chunk["semester"]])
+    checks.append((chunk["year"].isin(YEAR_OPTIONS) & ~blank["semester"] & ~year_semester.isin(VALID_YEAR_SEMESTERS),
+                   "semester does not belong to the given year"))
+
+    candidates = email[~blank["email"]].unique().tolist()
+    existing = set(conn.execute(text("SELECT email FROM students WHERE email IN :emails").bindparams(
+        bindparam("emails", expanding=True)), {"emails": candidates}).scalars()) if candidates else set()
+    checks.append((~blank["email"] & (email.duplicated() | email.isin(seen_emails)), "duplicate email in file"))
+    checks.append((email.isin(existing), "email already registered"))
+
+    failed = [pd.Series(message, index=chunk.index[mask.to_numpy()]) for mask, message in checks if mask.any()]
+    errors = pd.concat(failed) if failed else pd.Series(dtype=object)
+    valid = chunk[~chunk.index.isin(errors.index)].copy()
+    valid["date_of_birth"] = dob[valid.index].dt.date
+    return valid, errors
+
+def import_students(uploaded_file):
+    """Validate and load a student file chunk by chunk.
+
+    Each chunk is loaded in its own transaction, so a database failure only
+    loses that chunk; its passwords are hashed before the transaction opens.
+    Returns (imported_count, errors, credentials) where errors has one row
+    per rejected file row and credentials lists the generated passwords.
+    """
+    imported, error_parts, credential_parts = 0, [], []
+    seen_emails = set()
+    for chunk in read_import_chunks(uploaded_file):
+        missing = [column for column in IMPORT_REQUIRED_COLUMNS if column not in chunk.columns]
+        if missing:
+            raise ValueError(f"Missing required columns: {', '.join(missing)}")
+        for column in IMPORT_OPTIONAL_COLUMNS:
+            if column not in chunk.columns:
+                chunk[column] = ""
+        generated = chunk["password"] == ""
+        chunk.loc[generated, "password"] = [generate_password() for _ in range(generated.sum())]
+        plain_passwords = chunk["password"].copy()
+        chunk["password"] = hash_import_passwords(plain_passwords, generated)
+
+        try:
+            with get_db_connection() as conn:
+                if conn is None: raise Exception("Database connection failed")
+                with begin_write(conn):
+                    valid, errors = validate_student_chunk(conn, chunk, seen_emails)
+                    error_parts.append(errors)
+                    if valid.empty:
+                        continue
+                    valid["student_id"] = reserve_ids("STU", len(valid), conn)
+                    valid["enrollment_date"] = date.today()
+                    valid["status"] = "Active"
+                    valid[["address", "emergency_contact"]] = valid[["address", "emergency_contact"]].replace("", None)
+                    repos.students.bulk_insert(conn, valid)
+                    enroll_in_cohort_sections(conn, valid["student_id"].tolist())
+            seen_emails.update(valid["email"])
+            imported += len(valid)
+            new_credentials = generated[valid.index]
+            credential_parts.append(valid.loc[new_credentials, ["student_id", "first_name", "last_name", "email"]]
+                                    .assign(password=plain_passwords[valid.index][new_credentials]))
+        except Exception as e:
+            error_parts.append(pd.Series(f"not imported: {str(e).splitlines()[0]}", index=chunk.index))
+
+    if imported:
+        invalidate_reference_cache("students")
+    errors = pd.concat(error_parts) if error_parts else pd.Series(dtype=object)
+    report = (errors.groupby(level=0).agg("; ".join).rename_axis("row").reset_index(name="errors")
+              if not errors.empty else pd.DataFrame(columns=["row", "errors"]))
+    credentials = pd.concat(credential_parts) if credential_parts else pd.DataFrame()
+    return imported, report, credentials
+
+def bulk_import_students_form():
+    """Admin form for importing many students from a CSV/XLSX file."""
+    with st.expander("📥 Bulk Import Students", expanded=False):
+        st.write(f"Required columns: `{'`, `'.join(IMPORT_REQUIRED_COLUMNS)}`. "
+                 f"Optional: `{'`, `'.join(IMPORT_OPTIONAL_COLUMNS)}` (a password is generated when blank).")
+        template = pd.DataFrame(columns=list(IMPORT_REQUIRED_COLUMNS + IMPORT_OPTIONAL_COLUMNS)).to_csv(index=False)
+        st.download_button("Download CSV template", template, file_name="students_template.csv", mime="text/csv")
+
+        uploaded_file = st.file_uploader("Student file", type=["csv", "xlsx"], key="student_import_file")
+        if uploaded_file is not None and st.button("Import Students", key="student_import_run"):
+            started = time.perf_counter()
+            try:
+                with st.spinner("Importing students..."):
+                    imported, report, credentials = import_students(uploaded_file)
+                st.session_state.student_import_result = {
+                    "imported": imported, "report": report, "credentials": credentials,
+                    "seconds": time.perf_counter() - started,
+                }
+            except ImportError:
+                st.error("Reading .xlsx files requires the openpyxl package.")
+            except Exception as e:
+                st.error(f"Error importing students: {e}")
+
+        result = st.session_state.get("student_import_result")
+        if result:
+            st.success(f"Imported {result['imported']} students in {result['seconds']:.1f}s. "
+                       f"{len(result['report'])} rows rejected.")
+            if not result['credentials'].empty:
+                st.warning("Generated passwords are shown only now. Download and share them securely.")
+                st.download_button("Download generated credentials", result['credentials'].to_csv(index=False),
+                                   file_name="student_credentials.csv", mime="text/csv")
+            if not result['report'].empty:
+                st.dataframe(result['report'], use_container_width=True, hide_index=True)
+                st.download_button("Download error report", result['report'].to_csv(index=False),
+                                   file_name="student_import_errors.csv", mime="text/csv")
+
+# --- Data Export ---
+EXPORT_SETTINGS = {
+    # Export files are written here first, so their size is bounded by disk, not RAM
+    "export_dir": get_setting("export_dir", os.path.join(tempfile.gettempdir(), "cms_exports"), section="export"),
+    # Larger files are left on the server instead of being offered as a browser download
+    "download_limit_mb": get_setting("download_limit_mb", 200, section="export"),
+    # Exports hold student records; older files are deleted when the next export starts
+    "retention_minutes": get_setting("retention_minutes", 60, section="export"),
+}
+EXPORT_FORMATS = ("csv", "parquet")
+
+# Each dataset is a base query plus the SQL expression behind every filter it supports
+EXPORT_DATASETS = {
+    "grades": {
+        "query": """
+            SELECT g.grade_id, g.student_id, s.first_name, s.last_name, s.course, g.subject, g.exam_type,
+                   g.marks_obtained, g.total_marks, g.percentage, g.grade, g.date, g.teacher_id
+            FROM grades g JOIN students s ON s.student_id = g.student_id
+        """,
+        "filters": {"date": "g.date", "subject": "g.subject", "course": "s.course", "teacher_id": "g.teacher_id"},
+        "order": "g.date, g.student_id",
+    },
+    "attendance": {
+        "query": """
+            SELECT a.attendance_id, a.student_id, s.first_name, s.last_name, s.course, a.subject, a.date,
+                   a.status, a.teacher_id
+            FROM attendance a JOIN students s ON s.student_id = a.student_id
+        """,
+        "filters": {"date": "a.date", "subject": "a.subject", "course": "s.course", "teacher_id": "a.teacher_id"},
+        "order": "a.date, a.student_id",
+    },
+    "students": {
+        "query": f"SELECT {', '.join(STUDENT_PROFILE_COLUMNS)} FROM students",
+        "filters": {"date": "enrollment_date", "course": "course"},
+        "order": "student_id",
+    },
+}
+
+def build_export_query(dataset, start_date=None, end_date=None, subject=None, course=None, teacher_id=None):
+    """SQL and parameters for one export. Filters left as None are not applied.
+
+    The date range applies to the dataset's own date (exam date, class date
+    or enrollment date). Raises ValueError for a filter the dataset lacks.
+    """
+    spec = EXPORT_DATASETS[dataset]
+    requested = {"subject": subject, "course": course, "teacher_id": teacher_id}
+    conditions, params = [], {}
+    for name, value in requested.items():
+        if value is None:
+            continue
+        if name not in spec["filters"]:
+            raise ValueError(f"The {dataset} export cannot be filtered by {name}")
+        conditions.append(f"{spec['filters'][name]} = :{name}")
+        params[name] = value
+    if start_date is not None:
+        conditions.append(f"{spec['filters']['date']} >= :start_date")
+        params["start_date"] = start_date
+    if end_date is not None:
+        conditions.append(f"{spec['filters']['date']} <= :end_date")
+        params["end_date"] = end_date
+    where_sql = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    return f"{spec['query']} {where_sql} ORDER BY {spec['order']}", params
+
+def _export_schema(table, file_format):
+    """Fix the output schema from the first batch: all-NULL columns become strings,
+    and CSV gets plain values instead of dictionary-encoded ones."""
+    fields = []
+    for field in table.schema:
+        arrow_type = field.type
+        if pa.types.is_null(arrow_type):
+            arrow_type = pa.string()
+        elif pa.types.is_dictionary(arrow_type) and file_format == "csv":
+            arrow_type = arrow_type.value_type
+        fields.append(pa.field(field.name, arrow_type))
+    return pa.schema(fields)
+
+def export_dataset(dataset, file_format, path=None, batch_rows=COMPACT_FETCH_ROWS, **filters):
+    """Stream a dataset to a CSV or Parquet file one batch at a time.
+
+    Rows come from a server-side cursor and each batch is written before the
+    next is fetched, so memory stays bounded by batch_rows whatever the size
+    of the export. Returns (path, row_count).
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise ValueError(f"Unsupported export format: {file_format}")
+    query, params = build_export_query(dataset, **filters)
+    if path is None:
+        export_dir = EXPORT_SETTINGS["export_dir"]
+        os.makedirs(export_dir, mode=0o700, exist_ok=True)
+        os.chmod(export_dir, 0o700)  # also tightens a directory left by an older version
+        prune_exports(export_dir)
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(export_dir, f"{dataset}_{stamp}_{secrets.token_hex(3)}.{file_format}")
+    # Created owner-only before the writer opens it, so the data is never world-readable
+    os.close(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+
+    rows, writer, schema = 0, None, None
+    try:
+        with get_db_connection() as conn:
+            if conn is None: raise Exception("Database connection failed")
+            result = stream_query(conn, query, params, batch_rows)
+            for batch in arrow_batches(result, batch_rows):
+                if writer is None:
+                    schema = _export_schema(batch, file_format)
+                    writer = pa_csv.CSVWriter(path, schema) if file_format == "csv" else pq.ParquetWriter(path, schema)
+                writer.write_table(batch.cast(schema))
+                rows += batch.num_rows
+            if writer is None:
+                # No rows: still write the header / schema
+                empty = pa.table({name: pa.array([], type=COMPACT_COLUMN_TYPES.get(name, pa.null())) for name in result.keys()})
+                schema = _export_schema(empty, file_format)
+                writer = pa_csv.CSVWriter(path, schema) if file_format == "csv" else pq.ParquetWriter(path, schema)
+                writer.write_table(schema.empty_table())
+    finally:
+        if writer is not None:
+            writer.close()
+    return path, rows
+
+def prune_exports(export_dir, max_age_minutes=None):
+    """Delete export files in export_dir older than the retention period."""
+    if max_age_minutes is None:
+        max_age_minutes = EXPORT_SETTINGS["retention_minutes"]
+    cutoff = time.time() - max_age_minutes * 60
+    for dataset in EXPORT_DATASETS:
+        for file_format in EXPORT_FORMATS:
+            for path in glob.glob(os.path.join(export_dir, f"{dataset}_*.{file_format}")):
+                try:
+                    if os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass  # Removed by another session's prune
+
+def export_file_reader(path):
+    """A no-argument callable returning the file's bytes, for a deferred st.download_button."""
+    def read():
+        with open(path, "rb") as f:
+            return f.read()
+    return read
+
+def export_data_page():
+    """Admin page for exporting grades, attendance and student records."""
+    st.subheader("📤 Export Data")
+    st.caption("Rows stream from the database in batches straight into the file, so exports of any size run in bounded memory.")
+
+    dataset = st.selectbox("Dataset", list(EXPORT_DATASETS), format_func=str.title, key="export_dataset")
+    available = EXPORT_DATASETS[dataset]["filters"]
+    with st.form("export_form"):
+        col1, col2 = st.columns(2)
+        date_range = col1.date_input("Date range (optional)", value=(), key="export_dates")
+        file_format = col2.selectbox("Format", EXPORT_FORMATS, format_func=str.upper)
+        filters = {}
+        col1, col2, col3 = st.columns(3)
+        if "subject" in available:
+            subjects = get_all_subjects()
+            names = subjects['name'].tolist() if not subjects.empty else []
+            filters["subject"] = col1.selectbox("Subject", [None] + names, format_func=lambda v: v or "All")
+        if "course" in available:
+            filters["course"] = col2.selectbox("Course", [None] + COURSE_OPTIONS, format_func=lambda v: v or "All")
+        if "teacher_id" in available:
+            teachers = get_all_teachers()
+            teacher_names = (dict(zip(teachers['teacher_id'], teachers['first_name'] + " " + teachers['last_name']))
+                             if not teachers.empty else {})
+            filters["teacher_id"] = col3.selectbox("Teacher", [None] + list(teacher_names),
+                                                   format_func=lambda v: teacher_names.get(v, "All"))
+        submitted = st.form_submit_button("Export")
+
+    if submitted:
+        if len(date_range) == 2:
+            filters["start_date"], filters["end_date"] = date_range
+        elif len(date_range) == 1:
+            filters["start_date"] = date_range[0]
         try:
-            return pd.read_sql("SELECT * FROM subjects ORDER BY name", conn).to_dict('records')
+            started = time.perf_counter()
+            with st.spinner("Exporting..."):
+                path, rows = export_dataset(dataset, file_format, **filters)
+            st.session_state.last_export = {"path": path, "rows": rows, "seconds": time.perf_counter() - started}
         except Exception as e:
-            st.error(f"Error fetching subjects: {e}")
-            return []
+            st.error(f"Error exporting {dataset}: {e}")
+
+    export = st.session_state.get("last_export")
+    if export and os.path.exists(export["path"]):
+        size_mb = os.path.getsize(export["path"]) / 1e6
+        st.success(f"Exported {export['rows']} rows ({size_mb:.1f} MB) in {export['seconds']:.1f}s.")
+        if size_mb <= EXPORT_SETTINGS["download_limit_mb"]:
+            # Deferred: the file is only read when the button is clicked, not on every rerun
+            st.download_button("Download", export_file_reader(export["path"]), file_name=os.path.basename(export["path"]))
+        else:
+            st.info(f"The file is larger than the {EXPORT_SETTINGS['download_limit_mb']} MB download limit "
+                    f"and was left on the server at `{export['path']}`.")
 
 # --- Admin Dashboard Functions ---
 def admin_dashboard():
@@ -374,8 +2272,9 @@ def admin_dashboard():
     st.sidebar.markdown(f"**Welcome, {st.session_state.current_user['first_name']}**")
     st.sidebar.button("Logout", on_click=logout)
 
-    menu = ["📊 Dashboard", "👨‍🏫 Manage Teachers", "👨‍🎓 Manage Students", "📚 Manage Subjects"]
+    menu = ["📊 Dashboard", "👨‍🏫 Manage Teachers", "👨‍🎓 Manage Students", "📚 Manage Subjects", "🏫 Manage Sections", "📏 Grading Scales", "📤 Export Data"]
     choice = st.selectbox("Navigation", menu)
+    get_query_metrics().set_page(f"Admin · {choice}")
 
     if choice == "📊 Dashboard":
         admin_home()
@@ -385,19 +2284,108 @@ def admin_dashboard():
         manage_students_admin()
     elif choice == "📚 Manage Subjects":
         manage_subjects_admin()
+    elif choice == "🏫 Manage Sections":
+        manage_sections_admin()
+    elif choice == "📏 Grading Scales":
+        manage_grading_scales_admin()
+    elif choice == "📤 Export Data":
+        export_data_page()
+
+    query_debug_panel()
+
+def query_debug_panel():
+    """Collapsible per-rerun query statistics for admins, to spot N+1 patterns and slow statements."""
+    with st.expander("🐞 Query Debug"):
+        metrics = get_query_metrics()
+        log = metrics.current()
+        if log is None:
+            st.info("Query instrumentation is not active for this rerun.")
+            return
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Queries This Rerun", log.queries)
+        col2.metric("Database Time", f"{log.total_ms:.1f} ms")
+        col3.metric("Connections", log.connections)
+        col4.metric("Rows Returned", log.rows)
+
+        repeated = [{"statement": s, "executions": n} for s, n in log.repeats.most_common() if n > 1]
+        if repeated:
+            st.warning("Statements executed more than once in this rerun (possible N+1):")
+            st.dataframe(pd.DataFrame(repeated), use_container_width=True, hide_index=True)
+        if log.statements:
+            st.caption("Statements in this rerun (up to this panel)")
+            st.dataframe(pd.DataFrame(list(log.statements)), use_container_width=True, hide_index=True)
+
+        with metrics._lock:
+            pages = {page: dict(totals) for page, totals in metrics.pages.items()}
+            slow = list(metrics.slow_queries)
+        if pages:
+            st.caption("Per page, all sessions since the server started")
+            per_page = pd.DataFrame.from_dict(pages, orient="index")
+            per_page["queries_per_rerun"] = (per_page["queries"] / per_page["reruns"]).round(1)
+            per_page["ms_per_rerun"] = (per_page["db_ms"] / per_page["reruns"]).round(1)
+            st.dataframe(per_page.drop(columns="db_ms").sort_values("queries_per_rerun", ascending=False),
+                         use_container_width=True)
+        st.caption(f"Slow queries (≥ {DEBUG_SETTINGS['slow_query_ms']} ms), parameters redacted")
+        if slow:
+            st.dataframe(pd.DataFrame(slow[::-1]), use_container_width=True, hide_index=True)
+        else:
+            st.write("None recorded.")
 
 def admin_home():
     """The home page of the admin dashboard with overview stats."""
     st.subheader("📊 System Overview")
-    students = get_all_students()
-    teachers = get_all_teachers()
+    student_count, _ = count_rows("students")
+    teacher_count, _ = count_rows("teachers")
     subjects = get_all_subjects()
     
     col1, col2, col3 = st.columns(3)
-    col1.metric("Total Students", len(students))
-    col2.metric("Total Teachers", len(teachers))
+    col1.metric("Total Students", student_count)
+    col2.metric("Total Teachers", teacher_count)
     col3.metric("Total Subjects", len(subjects))
 
+    with st.expander("🔌 Database Connection Pool"):
+        stats = get_pool_stats()
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Checked Out", f"{stats.get('checked_out', 0)} / {POOL_SETTINGS['pool_size']}")
+        col2.metric("Overflow In Use", stats.get("overflow", 0))
+        col3.metric("Avg Checkout Wait", f"{stats['avg_wait_ms']:.1f} ms")
+        col4.metric("Pool Timeouts", stats["timeouts"])
+        st.json(stats)
+
+    with st.expander("🧮 Student Summary Consistency"):
+        st.caption("Dashboards read per-student, per-subject totals from a summary table kept current by the "
+                   "grade and attendance write paths. Check compares it with the raw rows; Rebuild recomputes it.")
+        col1, col2 = st.columns(2)
+        if col1.button("Check Summary"):
+            try:
+                mismatches = check_student_subject_summary()
+                if mismatches.empty:
+                    st.success("Summary matches the grade and attendance tables.")
+                else:
+                    st.warning(f"{len(mismatches)} summary rows disagree with the base tables.")
+                    st.dataframe(mismatches, use_container_width=True, hide_index=True)
+            except Exception as e:
+                st.error(f"Error checking summary: {e}")
+        if col2.button("Rebuild Summary"):
+            try:
+                with get_db_connection() as conn:
+                    if conn is None: raise Exception("Database connection failed")
+                    with begin_write(conn):
+                        rows = rebuild_student_subject_summary(conn)
+                st.success(f"Summary rebuilt: {rows} rows.")
+            except Exception as e:
+                st.error(f"Error rebuilding summary: {e}")
+
+    with st.expander("🩺 Query Plan Check"):
+        st.caption(f"Schema version {SCHEMA_VERSION}. Confirms the planner can use the index behind each hot query.")
+        if engine.dialect.name != "postgresql":
+            st.info("The plan check reads PostgreSQL's EXPLAIN output and is not available on an embedded database.")
+        elif st.button("Run EXPLAIN Check"):
+            try:
+                st.dataframe(pd.DataFrame(check_query_plans()), use_container_width=True)
+            except Exception as e:
+                st.error(f"Error checking query plans: {e}")
+
 def manage_teachers_admin():
     """Admin interface for managing teachers."""
     st.subheader("👨‍🏫 Manage Teachers")
@@ -471,7 +2459,7 @@ def manage_teachers_admin():
                             teacher_id = generate_teacher_id()
                             with get_db_connection() as conn:
                                 if conn is None: raise Exception("Database connection failed")
-                                with conn.begin(): # Start transaction
+                                with begin_write(conn): # Start transaction
                                     conn.execute(text("""
                                         INSERT INTO teachers (teacher_id, username, password, first_name, last_name, email, role)
                                         VALUES (:tid, :user, :pass, :fname, :lname, :email, 'teacher')
@@ -483,6 +2471,7 @@ def manage_teachers_admin():
                                         "lname": last_name,
                                         "email": email
                                     })
+                            invalidate_reference_cache("teachers")
                             
                             st.session_state.new_teacher_credentials = {
                                 'id': teacher_id,
@@ -502,7 +2491,6 @@ def manage_teachers_admin():
 
     st.markdown("---")
     st.write("**All Teachers List**")
-    teachers = get_all_teachers()
     
     if 'teacher_password_reset_info' in st.session_state:
         info = st.session_state.teacher_password_reset_info
@@ -511,69 +2499,75 @@ def manage_teachers_admin():
         st.warning("Please share this new password securely.")
         del st.session_state.teacher_password_reset_info
     
-    if teachers:
-        df_teachers = pd.DataFrame(teachers)
-        df_teachers_display = df_teachers[df_teachers['role'] != 'admin']
+    teacher_total = count_rows("teachers", where=NON_ADMIN_TEACHERS)
+    teachers = keyset_pager("teacher_list", get_teachers_page, TEACHER_KEYSET, teacher_total, "teachers") if teacher_total[0] else pd.DataFrame()
+    
+    if not teachers.empty:
+        st.dataframe(teachers, use_container_width=True)
         
-        if not df_teachers_display.empty:
-            st.dataframe(df_teachers_display, use_container_width=True)
-            
-            teacher_options = {f"{t['teacher_id']} - {t['first_name']} {t['last_name']}": t['teacher_id'] 
-                               for t in teachers if t['role'] != 'admin'}
-            selected_teacher_label = st.selectbox("Select a teacher to manage", options=[""] + list(teacher_options.keys()))
+        teacher_options = dict(zip(teachers['teacher_id'] + " - " + teachers['first_name'] + " " + teachers['last_name'],
+                                   teachers['teacher_id']))
+        selected_teacher_label = st.selectbox("Select a teacher to manage", options=[""] + list(teacher_options.keys()))
+        
+        if selected_teacher_label:
+            teacher_id = teacher_options[selected_teacher_label]
             
-            if selected_teacher_label:
-                teacher_id = teacher_options[selected_teacher_label]
+            with st.expander("🔑 Manage Selected Teacher", expanded=True):
+                st.write(f"**Actions for:** {selected_teacher_label}")
                 
-                with st.expander("🔑 Manage Selected Teacher", expanded=True):
-                    st.write(f"**Actions for:** {selected_teacher_label}")
-                    
-                    if st.button("Generate & Set New Password", key=f"gen_teacher_pw_{teacher_id}"):
-                        new_pw = generate_password()
-                        try:
-                            with get_db_connection() as conn:
-                                if conn is None: raise Exception("Database connection failed")
-                                with conn.begin():
-                                    conn.execute(text("UPDATE teachers SET password = :pass WHERE teacher_id = :tid"),
-                                                 {"pass": hash_password(new_pw), "tid": teacher_id})
-                            st.session_state.teacher_password_reset_info = {
-                                'teacher_id': teacher_id, 
-                                'new_password': new_pw
-                            }
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Error resetting password: {e}")
-
-                    with st.form(key=f"custom_teacher_pw_{teacher_id}"):
-                        st.write("Or, set a custom password:")
-                        custom_pw = st.text_input("New Custom Password", type="password", key=f"custom_pwd_{teacher_id}")
-                        if st.form_submit_button("Set Custom Password"):
-                            if custom_pw:
-                                try:
-                                    with get_db_connection() as conn:
-                                        if conn is None: raise Exception("Database connection failed")
-                                        with conn.begin():
-                                            conn.execute(text("UPDATE teachers SET password = :pass WHERE teacher_id = :tid"),
-                                                         {"pass": hash_password(custom_pw), "tid": teacher_id})
-                                    st.success(f"Successfully set a new password for {teacher_id}.")
-                                except Exception as e:
-                                    st.error(f"Error setting password: {e}")
-                            else:
-                                st.warning("Password cannot be empty.")
-                    
-                    st.markdown("---")
-                    if st.button("🗑️ Delete This Teacher", type="primary", key=f"del_teacher_{teacher_id}"):
-                        try:
-                            with get_db_connection() as conn:
-                                if conn is None: raise Exception("Database connection failed")
-                                with conn.begin():
-                                    conn.execute(text("DELETE FROM teachers WHERE teacher_id = :tid"), {"tid": teacher_id})
-                            st.success(f"Teacher {teacher_id} has been deleted.")
-                            st.rerun()
-                        except Exception as e:
-                            st.error(f"Error deleting teacher: {e}")
-        else:
-            st.info("No teachers found (besides admin). Add some teachers above.")
+                if st.button("Generate & Set New Password", key=f"gen_teacher_pw_{teacher_id}"):
+                    new_pw = generate_password()
+                    try:
+                        with get_db_connection() as conn:
+                            if conn is None: raise Exception("Database connection failed")
+                            with begin_write(conn):
+                                conn.execute(text("UPDATE teachers SET password = :pass WHERE teacher_id = :tid"),
+                                             {"pass": hash_password(new_pw), "tid": teacher_id})
+                        st.session_state.teacher_password_reset_info = {
+                            'teacher_id': teacher_id, 
+                            'new_password': new_pw
+                        }
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error resetting password: {e}")
+
+                with st.form(key=f"custom_teacher_pw_{teacher_id}"):
+                    st.write("Or, set a custom password:")
+                    custom_pw = st.text_input("New Custom Password", type="password", key=f"custom_pwd_{teacher_id}")
+                    if st.form_submit_button("Set Custom Password"):
+                        if custom_pw:
+                            try:
+                                with get_db_connection() as conn:
+                                    if conn is None: raise Exception("Database connection failed")
+                                    with begin_write(conn):
+                                        conn.execute(text("UPDATE teachers SET password = :pass WHERE teacher_id = :tid"),
+                                                     {"pass": hash_password(custom_pw), "tid": teacher_id})
+                                st.success(f"Successfully set a new password for {teacher_id}.")
+                            except Exception as e:
+                                st.error(f"Error setting password: {e}")
+                        else:
+                            st.warning("Password cannot be empty.")
+                
+                st.markdown("---")
+                if st.button("🗑️ Delete This Teacher", type="primary", key=f"del_teacher_{teacher_id}"):
+                    try:
+                        with get_db_connection() as conn:
+                            if conn is None: raise Exception("Database connection failed")
+                            with begin_write(conn):
+                                # The delete cascades to this teacher's grades and attendance
+                                affected = conn.execute(text("""
+                                    SELECT student_id, subject FROM grades WHERE teacher_id = :tid
+                                    UNION SELECT student_id, subject FROM attendance WHERE teacher_id = :tid
+                                """), {"tid": teacher_id}).all()
+                                conn.execute(text("DELETE FROM teachers WHERE teacher_id = :tid"), {"tid": teacher_id})
+                                recompute_summary_keys(conn, affected)
+                        invalidate_reference_cache("teachers")
+                        st.success(f"Teacher {teacher_id} has been deleted.")
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"Error deleting teacher: {e}")
+    else:
+        st.info("No teachers found (besides admin). Add some teachers above.")
 
 def manage_subjects_admin():
     """Admin interface for managing subjects."""
@@ -588,9 +2582,10 @@ def manage_subjects_admin():
                 subject_id = generate_id("SUB", "subjects", "subject_id")
                 with get_db_connection() as conn:
                     if conn is None: raise Exception("Database connection failed")
-                    with conn.begin():
+                    with begin_write(conn):
                         conn.execute(text("INSERT INTO subjects (subject_id, name, credits) VALUES (:sid, :name, :credits)"),
                                      {"sid": subject_id, "name": name, "credits": credits})
+                    invalidate_reference_cache("subjects")
                     st.success(f"Subject '{name}' added!")
                     st.rerun()
             except sqlalchemy.exc.IntegrityError:
@@ -599,8 +2594,164 @@ def manage_subjects_admin():
                 st.error(f"Error adding subject: {e}")
 
     subjects = get_all_subjects()
-    if subjects:
-        st.dataframe(pd.DataFrame(subjects), use_container_width=True)
+    if not subjects.empty:
+        st.dataframe(subjects, use_container_width=True)
+
+def manage_sections_admin():
+    """Admin interface for class sections (subject x cohort x teacher) and their rosters."""
+    st.subheader("🏫 Manage Sections")
+
+    subjects = get_all_subjects()
+    teachers = get_all_teachers()
+    if not teachers.empty:
+        teachers = teachers[teachers['role'] != 'admin']
+    if subjects.empty or teachers.empty:
+        st.info("Add at least one subject and one teacher before creating sections.")
+        return
+
+    with st.expander("➕ Create a Section", expanded=False):
+        # Year sits outside the form so the semester options follow it
+        year = st.selectbox("Year*", YEAR_OPTIONS, key="section_year_selector")
+        with st.form("new_section_form", clear_on_submit=True):
+            col1, col2 = st.columns(2)
+            subject_names = dict(zip(subjects['subject_id'], subjects['name']))
+            teacher_names = dict(zip(teachers['teacher_id'], teachers['first_name'] + " " + teachers['last_name']
+                                     + " (" + teachers['teacher_id'] + ")"))
+            with col1:
+                subject_id = st.selectbox("Subject*", options=list(subject_names), format_func=subject_names.get)
+                teacher_id = st.selectbox("Teacher*", options=list(teacher_names), format_func=teacher_names.get)
+            with col2:
+                course = st.selectbox("Course*", COURSE_OPTIONS)
+                semester = st.selectbox("Semester*", SEMESTER_MAP.get(year, []))
+            if st.form_submit_button("Create Section"):
+                try:
+                    section_id, enrolled = create_section(subject_id, subject_names[subject_id], teacher_id, course, year, semester)
+                    st.success(f"Section {section_id} created with {enrolled} students enrolled.")
+                except sqlalchemy.exc.IntegrityError:
+                    st.error("A section for this subject and cohort already exists.")
+                except Exception as e:
+                    st.error(f"Error creating section: {e}")
+
+    sections = get_sections()
+    if sections.empty:
+        st.info("No sections yet. Teachers see the whole student list until they are assigned sections.")
+        return
+
+    st.dataframe(sections.drop(columns=['subject_id', 'teacher_id']), use_container_width=True, hide_index=True)
+
+    labels = dict(zip(sections['section_id'], sections['section_id'] + " - " + section_labels(sections)))
+    section_id = st.selectbox("Select a section to manage", options=[""] + list(labels), format_func=lambda sid: labels.get(sid, ""))
+    if section_id:
+        col1, col2 = st.columns(2)
+        if col1.button("🔄 Enroll Missing Cohort Students", key=f"resync_{section_id}"):
+            try:
+                with get_db_connection() as conn:
+                    if conn is None: raise Exception("Database connection failed")
+                    with begin_write(conn):
+                        enrolled = enroll_cohort(conn, section_id)
+                invalidate_reference_cache("sections")
+                st.success(f"{enrolled} students newly enrolled.")
+            except Exception as e:
+                st.error(f"Error enrolling students: {e}")
+        if col2.button("🗑️ Delete This Section", type="primary", key=f"del_section_{section_id}"):
+            try:
+                with get_db_connection() as conn:
+                    if conn is None: raise Exception("Database connection failed")
+                    with begin_write(conn):
+                        conn.execute(text("DELETE FROM sections WHERE section_id = :sid"), {"sid": section_id})
+                invalidate_reference_cache("sections")
+                st.success(f"Section {section_id} has been deleted.")
+                st.rerun()
+            except Exception as e:
+                st.error(f"Error deleting section: {e}")
+
+def manage_grading_scales_admin():
+    """Admin interface for grading scales, with a re-grade of affected grades on save."""
+    st.subheader("📏 Grading Scales")
+    st.write("The most specific scale applies: course and semester, then course, then semester, then the default.")
+
+    if 'regrade_result' in st.session_state:
+        st.success(f"Scale saved. {st.session_state.regrade_result} existing grades changed.")
+        del st.session_state.regrade_result
+
+    scales = get_grading_scales()
+    scopes = {s['scale_id']: f"{s['name']} ({s['course'] or 'any course'}, {s['semester'] or 'any semester'})" for s in scales}
+    scale_id = st.selectbox("Scale", options=["new"] + list(scopes),
+                            format_func=lambda sid: scopes.get(sid, "➕ New scale"), key="grading_scale_choice")
+    scale = next((s for s in scales if s['scale_id'] == scale_id), None)
+
+    all_semesters = [sem for sems in SEMESTER_MAP.values() for sem in sems]
+    with st.form(f"grading_scale_form_{scale_id}"):
+        name = st.text_input("Name*", value=scale['name'] if scale else "")
+        col1, col2 = st.columns(2)
+        course_options = ["Any"] + COURSE_OPTIONS
+        semester_options = ["Any"] + all_semesters
+        course = col1.selectbox("Course", course_options,
+                                index=course_options.index(scale['course']) if scale and scale['course'] else 0)
+        semester = col2.selectbox("Semester", semester_options,
+                                  index=semester_options.index(scale['semester']) if scale and scale['semester'] else 0)
+        boundaries = pd.DataFrame(sorted(scale['boundaries'] if scale else DEFAULT_GRADING_SCALE, reverse=True),
+                                  columns=["minimum_percentage", "letter"])
+        edited = st.data_editor(boundaries, num_rows="dynamic", hide_index=True, use_container_width=True,
+                                column_config={
+                                    "minimum_percentage": st.column_config.NumberColumn("Minimum %", min_value=0.0, max_value=100.0),
+                                    "letter": st.column_config.TextColumn("Letter", max_chars=2),
+                                })
+        submitted = st.form_submit_button("Save Scale and Re-grade")
+
+    if submitted:
+        edited = edited.dropna(how="all")
+        new_boundaries = [[float(m), str(l).strip()] for m, l in edited.itertuples(index=False)
+                          if pd.notna(m) and pd.notna(l)]
+        error = validate_grading_scale(new_boundaries) if len(new_boundaries) == len(edited) else "Every boundary needs a minimum and a letter."
+        if not name:
+            error = "Please give the scale a name."
+        if error:
+            st.error(error)
+            return
+        scope = {"course": None if course == "Any" else course, "semester": None if semester == "Any" else semester}
+        try:
+            with get_db_connection() as conn:
+                if conn is None: raise Exception("Database connection failed")
+                with begin_write(conn):
+                    params = {"name": name, "boundaries": json.dumps(new_boundaries), **scope}
+                    if scale:
+                        conn.execute(text("""
+                            UPDATE grading_scales SET name = :name, course = :course, semester = :semester, boundaries = :boundaries
+                            WHERE scale_id = :sid
+                        """), {**params, "sid": scale_id})
+                    else:
+                        conn.execute(text("""
+                            INSERT INTO grading_scales (scale_id, name, course, semester, boundaries)
+                            VALUES (:sid, :name, :course, :semester, :boundaries)
+                        """), {**params, "sid": reserve_ids("SCL", 1, conn)[0]})
+                    # Same transaction: a failed regrade also undoes the scale change,
+                    # so stored grades never disagree with the saved scales.
+                    # A scope change can affect the old scope's students as well as the new one's
+                    changed = regrade(**scope, conn=conn)
+                    if scale and (scale['course'], scale['semester']) != (scope['course'], scope['semester']):
+                        changed += regrade(scale['course'], scale['semester'], conn)
+            invalidate_reference_cache("grading_scales")
+            st.session_state.regrade_result = changed
+            st.rerun()
+        except sqlalchemy.exc.IntegrityError:
+            st.error("A scale for this course and semester already exists.")
+        except Exception as e:
+            st.error(f"Error saving grading scale: {e}")
+
+    if scale and (scale['course'] or scale['semester']):
+        if st.button("🗑️ Delete This Scale", type="primary", key=f"del_scale_{scale_id}"):
+            try:
+                with get_db_connection() as conn:
+                    if conn is None: raise Exception("Database connection failed")
+                    with begin_write(conn):
+                        conn.execute(text("DELETE FROM grading_scales WHERE scale_id = :sid"), {"sid": scale_id})
+                        changed = regrade(scale['course'], scale['semester'], conn)
+                invalidate_reference_cache("grading_scales")
+                st.session_state.regrade_result = changed
+                st.rerun()
+            except Exception as e:
+                st.error(f"Error deleting grading scale: {e}")
 
 # --- Teacher Dashboard ---
 def teacher_dashboard():
@@ -611,6 +2762,7 @@ def teacher_dashboard():
 
     menu = ["📊 Dashboard", "👨‍🎓 Manage Students", "📝 Record Grades", "📅 Mark Attendance", "📈 View Reports"]
     choice = st.selectbox("Navigation", menu)
+    get_query_metrics().set_page(f"Teacher · {choice}")
 
     if choice == "📊 Dashboard":
         teacher_home()
@@ -623,57 +2775,113 @@ def teacher_dashboard():
     elif choice == "📈 View Reports":
         teacher_view_reports()
 
+def select_class(key):
+    """Let a teacher pick the class to work with.
+
+    Returns (subject_name, roster): roster is the section's enrolled students.
+    Teachers without sections pick a subject instead and get roster=None, so
+    the caller falls back to institution-wide lists. Returns (None, None) if
+    there is nothing to pick.
+    """
+    sections = get_sections(teacher_id=st.session_state.current_user['teacher_id'])
+    if not sections.empty:
+        labels = dict(zip(sections['section_id'], section_labels(sections)))
+        section_id = st.selectbox("Select Class", options=list(labels), format_func=labels.get, key=f"{key}_section")
+        subject = sections.loc[sections['section_id'] == section_id, 'subject'].iloc[0]
+        return subject, get_section_roster(section_id)
+
+    subjects = get_all_subjects()
+    if subjects.empty:
+        st.warning("No subjects found. Please contact admin to add subjects.")
+        return None, None
+    st.info("You have no class sections yet, so all students are listed. An admin can assign sections under 🏫 Manage Sections.")
+    subject = st.selectbox("Select Subject", options=subjects['name'].tolist(), key=f"{key}_subject")
+    return subject, None
+
 def teacher_home():
     """Teacher dashboard home page."""
     st.subheader("📊 Teacher Overview")
     
-    students = get_all_students()
+    student_count, _ = count_rows("students")
     subjects = get_all_subjects()
     
     col1, col2, col3 = st.columns(3)
-    col1.metric("Total Students", len(students))
+    col1.metric("Total Students", student_count)
     col2.metric("Available Subjects", len(subjects))
     
     with get_db_connection() as conn:
         if conn:
             try:
-                # Fixed MySQL-specific DATE_SUB/CURDATE to Postgres equivalent
-                recent_grades = pd.read_sql("""
-                    SELECT COUNT(*) as count FROM grades 
-                    WHERE teacher_id = %s AND date >= (CURRENT_DATE - INTERVAL '7 days')
-                """, conn, params=(st.session_state.current_user['teacher_id'],))
-                col3.metric("Grades This Week", recent_grades['count'].iloc[0] if not recent_grades.empty else 0)
+                # The cutoff is computed here so the query runs unchanged on every backend
+                recent_grades = conn.execute(text("""
+                    SELECT COUNT(*) FROM grades 
+                    WHERE teacher_id = :tid AND date >= :since
+                """), {"tid": st.session_state.current_user['teacher_id'], "since": date.today() - timedelta(days=7)}).scalar()
+                col3.metric("Grades This Week", recent_grades or 0)
             except Exception as e:
                 st.error(f"Error loading dashboard stats: {e}")
                 col3.metric("Grades This Week", "Error")
 
+    overview = get_section_overview(st.session_state.current_user['teacher_id'])
+    if not overview.empty:
+        st.markdown("---")
+        st.subheader("🏫 Your Classes")
+        st.dataframe(overview, use_container_width=True, hide_index=True, column_config={
+            "average_percentage": st.column_config.NumberColumn("Average %", format="%.1f"),
+            "attendance_percentage": st.column_config.NumberColumn("Attendance %", format="%.1f"),
+        })
+
 
 def teacher_record_grades():
     """Teacher interface for recording grades."""
     st.subheader("📝 Record Student Grades")
     
-    students = get_all_students()
-    subjects = get_all_subjects()
-    
-    if not students:
+    if not count_rows("students")[0]:
         st.warning("No students found. Please add students first.")
         return
     
-    if not subjects:
-        st.warning("No subjects found. Please contact admin to add subjects.")
+    selected_subject, roster = select_class("grades")
+    if selected_subject is None:
+        return
+    
+    entry_mode = st.radio("Entry mode", ["Single Student", "Whole Exam"], horizontal=True, key="grade_entry_mode")
+    if entry_mode == "Whole Exam":
+        record_exam_grades(selected_subject, roster if roster is not None else get_all_students())
+    else:
+        record_single_grade(selected_subject, roster)
+    
+    st.markdown("---")
+    st.subheader("📊 Recent Grades Recorded")
+    
+    with get_db_connection() as conn:
+        if conn:
+            try:
+                recent_grades = repos.grades.recent_for_teacher(conn, st.session_state.current_user['teacher_id'])
+                
+                if not recent_grades.empty:
+                    st.dataframe(recent_grades, use_container_width=True)
+                else:
+                    st.info("No grades recorded by you yet.")
+            except Exception as e:
+                st.error(f"Error loading recent grades: {e}")
+
+def record_single_grade(selected_subject, roster):
+    """Record one student's grade; roster=None means search all students."""
+    # The student pickers sit outside the form so they update immediately
+    if roster is None:
+        student_id = student_search_picker("Find Student*", key="grade_student")
+    elif not roster.empty:
+        roster_labels = dict(zip(roster['student_id'], roster['student_id'] + " - " + roster['first_name'] + " " + roster['last_name']))
+        student_id = st.selectbox("Select Student*", options=list(roster_labels), format_func=roster_labels.get, key="grade_roster_student")
+    else:
+        st.warning("No students are enrolled in this class.")
         return
     
     with st.form("grade_form", clear_on_submit=True):
         col1, col2 = st.columns(2)
         
         with col1:
-            student_options = [f"{s['student_id']} - {s['first_name']} {s['last_name']}" for s in students]
-            selected_student = st.selectbox("Select Student*", options=student_options)
-            
-            subject_options = [s['name'] for s in subjects]
-            selected_subject = st.selectbox("Select Subject*", options=subject_options)
-            
-            exam_type = st.selectbox("Exam Type*", options=["Mid-term", "Final", "Quiz", "Assignment", "Project"])
+            exam_type = st.selectbox("Exam Type*", options=EXAM_TYPES)
         
         with col2:
             marks_obtained = st.number_input("Marks Obtained*", min_value=0.0, max_value=1000.0, step=0.5)
@@ -683,183 +2891,229 @@ def teacher_record_grades():
         submitted = st.form_submit_button("Record Grade")
         
         if submitted:
-            if selected_student and selected_subject and marks_obtained is not None and total_marks > 0:
-                student_id = selected_student.split(" - ")[0]
-                percentage = (marks_obtained / total_marks) * 100
-                grade = calculate_grade(percentage)
-                grade_id = generate_grade_id()
+            if student_id and selected_subject and marks_obtained is not None and total_marks > 0:
+                percentage = float(exam_percentage(marks_obtained, total_marks))
+                cohort = get_student_profile(student_id, columns=("course", "semester")) or {}
+                grade = calculate_grade(percentage, cohort.get('course'), cohort.get('semester'))
                 
                 try:
+                    grade_id = generate_grade_id()
                     with get_db_connection() as conn:
                         if conn is None: raise Exception("Database connection failed")
-                        with conn.begin():
-                            conn.execute(text("""
+                        with begin_write(conn):
+                            stored_percentage = conn.execute(text("""
                                 INSERT INTO grades (grade_id, student_id, subject, exam_type, marks_obtained, total_marks, percentage, grade, date, teacher_id)
                                 VALUES (:gid, :sid, :sub, :etype, :mobt, :mtot, :perc, :grade, :date, :tid)
+                                RETURNING percentage
                             """), {
                                 "gid": grade_id, "sid": student_id, "sub": selected_subject, "etype": exam_type,
                                 "mobt": marks_obtained, "mtot": total_marks, "perc": percentage,
                                 "grade": grade, "date": exam_date, "tid": st.session_state.current_user['teacher_id']
-                            })
+                            }).scalar()
+                            apply_summary_deltas(conn, [{"student_id": student_id, "subject": selected_subject, "exams": 1,
+                                                         "percentage_sum": stored_percentage, "last_exam_date": exam_date}])
                     st.success(f"Grade recorded successfully! Grade: {grade} ({percentage:.1f}%)")
                 except Exception as e:
                     st.error(f"Error recording grade: {e}")
             else:
                 st.error("Please fill all required fields.")
+
+def record_exam_grades(selected_subject, students):
+    """Enter one exam's marks for a whole class from a grid or an uploaded sheet, saved in one transaction."""
+    if students.empty:
+        st.warning("No students are enrolled in this class.")
+        return
     
-    st.markdown("---")
-    st.subheader("📊 Recent Grades Recorded")
+    if 'exam_grades_saved' in st.session_state:
+        saved = st.session_state.exam_grades_saved
+        st.success(f"Recorded {saved['count']} grades for {saved['subject']} ({saved['exam_type']}).")
+        del st.session_state.exam_grades_saved
     
-    with get_db_connection() as conn:
-        if conn:
+    source = st.radio("Marks source", ["Enter in grid", "Upload sheet"], horizontal=True, key="exam_marks_source")
+    uploaded_file = None
+    if source == "Upload sheet":
+        uploaded_file = st.file_uploader("Marks sheet with columns student_id, marks_obtained", type=["csv", "xlsx"], key="exam_marks_file")
+    
+    with st.form("exam_grades_form"):
+        col1, col2, col3 = st.columns(3)
+        exam_type = col1.selectbox("Exam Type*", options=EXAM_TYPES)
+        total_marks = col2.number_input("Total Marks*", min_value=1.0, max_value=1000.0, step=0.5, value=100.0)
+        exam_date = col3.date_input("Exam Date*", value=date.today())
+        
+        if source == "Enter in grid":
+            grid = pd.DataFrame({
+                "student_id": students['student_id'],
+                "name": students['first_name'] + " " + students['last_name'],
+                "marks_obtained": np.nan,
+            }).reset_index(drop=True)
+            # Bumping the key after a save gives a fresh, empty grid
+            edited = st.data_editor(
+                grid,
+                key=f"exam_grid_{st.session_state.get('exam_grid_version', 0)}",
+                hide_index=True,
+                use_container_width=True,
+                disabled=["student_id", "name"],
+                column_config={
+                    "student_id": "Student ID",
+                    "name": "Name",
+                    "marks_obtained": st.column_config.NumberColumn("Marks Obtained", min_value=0.0, step=0.5),
+                },
+            )
+        
+        submitted = st.form_submit_button("Save Exam Grades")
+    
+    if submitted:
+        if source == "Upload sheet":
+            if uploaded_file is None:
+                st.error("Please upload a marks sheet.")
+                return
             try:
-                recent_grades = pd.read_sql("""
-                    SELECT g.grade_id, g.student_id, s.first_name, s.last_name, g.subject, g.exam_type, 
-                           g.marks_obtained, g.total_marks, g.percentage, g.grade, g.date
-                    FROM grades g
-                    JOIN students s ON g.student_id = s.student_id
-                    WHERE g.teacher_id = %s
-                    ORDER BY g.date DESC
-                    LIMIT 10
-                """, conn, params=(st.session_state.current_user['teacher_id'],))
-                
-                if not recent_grades.empty:
-                    st.dataframe(recent_grades, use_container_width=True)
-                else:
-                    st.info("No grades recorded by you yet.")
+                marks = pd.concat(read_import_chunks(uploaded_file))
+            except ImportError:
+                st.error("Reading .xlsx files requires the openpyxl package.")
+                return
             except Exception as e:
-                st.error(f"Error loading recent grades: {e}")
+                st.error(f"Error reading marks sheet: {e}")
+                return
+            if not {"student_id", "marks_obtained"}.issubset(marks.columns):
+                st.error("The sheet needs student_id and marks_obtained columns.")
+                return
+        else:
+            marks = edited
+        
+        rows, errors = prepare_exam_marks(marks, total_marks, students['student_id'])
+        if not errors.empty:
+            st.error(f"{len(errors)} problems found. Nothing was saved.")
+            st.dataframe(errors, use_container_width=True, hide_index=True)
+            return
+        if rows.empty:
+            st.warning("No marks entered.")
+            return
+        try:
+            count = save_exam_grades(selected_subject, exam_type, exam_date, total_marks, rows,
+                                     st.session_state.current_user['teacher_id'])
+            st.session_state.exam_grades_saved = {"count": count, "subject": selected_subject, "exam_type": exam_type}
+            st.session_state.exam_grid_version = st.session_state.get('exam_grid_version', 0) + 1
+            st.rerun()
+        except Exception as e:
+            st.error(f"Error recording grades: {e}")
 
 def teacher_mark_attendance():
     """Teacher interface for marking attendance."""
     st.subheader("📅 Mark Student Attendance")
     
-    students = get_all_students()
-    subjects = get_all_subjects()
-    
-    if not students:
-        st.warning("No students found.")
-        return
-    if not subjects:
-        st.warning("No subjects found.")
-        return
-    
     col1, col2 = st.columns(2)
     with col1:
-        subject_options = [s['name'] for s in subjects]
-        selected_subject = st.selectbox("Select Subject", options=subject_options)
+        selected_subject, students = select_class("attendance")
     with col2:
         attendance_date = st.date_input("Date", value=date.today())
     
+    if selected_subject is None:
+        return
+    if students is None:
+        students = get_all_students()
+    if students.empty:
+        st.warning("No students found.")
+        return
+    
+    if 'attendance_save_result' in st.session_state:
+        saved = st.session_state.attendance_save_result
+        st.success(f"Attendance saved! {saved['inserted']} new, {saved['updated']} updated, {saved['unchanged']} unchanged.")
+        del st.session_state.attendance_save_result
+
     if selected_subject and attendance_date:
         st.markdown("---")
         st.subheader(f"Marking Attendance for {selected_subject} on {attendance_date}")
 
-        existing_attendance = {}
-        with get_db_connection() as conn:
-            if conn:
-                try:
-                    query = "SELECT student_id, status FROM attendance WHERE date = %s AND subject = %s"
-                    existing_df = pd.read_sql(query, conn, params=(attendance_date, selected_subject))
-                    existing_attendance = dict(zip(existing_df['student_id'], existing_df['status']))
-                except Exception as e:
-                    st.error(f"Error loading existing attendance: {e}")
-        
+        grid_id = (selected_subject, attendance_date, tuple(students['student_id']))
+        grid = st.session_state.get('attendance_grid')
+        if grid is None or grid['id'] != grid_id:
+            grid = {'id': grid_id, 'df': load_attendance_grid(students, attendance_date, selected_subject), 'version': 0}
+            st.session_state.attendance_grid = grid
+
+        # One data_editor for the whole roster instead of a radio per student;
+        # the form keeps cell edits local until a button is pressed.
         with st.form("attendance_form"):
-            attendance_data = {}
-            for student in students:
-                student_id = student['student_id']
-                current_status = existing_attendance.get(student_id, 'Present')
-                status_index = 0 if current_status == 'Present' else 1
-                
-                cols = st.columns([3, 2])
-                cols[0].write(f"{student['first_name']} {student['last_name']} ({student_id})")
-                attendance_data[student_id] = cols[1].radio(
-                    "Status", 
-                    ['Present', 'Absent'], 
-                    index=status_index, 
-                    key=f"status_{student_id}", 
-                    horizontal=True,
-                    label_visibility="collapsed"
+            edited = st.data_editor(
+                grid['df'],
+                key=f"attendance_editor_{grid['version']}",
+                hide_index=True,
+                use_container_width=True,
+                disabled=["student_id", "name", "saved_status"],
+                column_order=["select", "student_id", "name", "present"],
+                column_config={
+                    "select": st.column_config.CheckboxColumn("Select", width="small"),
+                    "student_id": "Student ID",
+                    "name": "Name",
+                    "present": st.column_config.CheckboxColumn("Present"),
+                },
+            )
+            col1, col2, col3 = st.columns(3)
+            mark_all_present = col1.form_submit_button("✅ Mark All Present")
+            mark_selected_absent = col2.form_submit_button("❌ Mark Selected Absent")
+            save = col3.form_submit_button("💾 Save Attendance", type="primary")
+
+        if mark_all_present or mark_selected_absent:
+            updated = edited.copy()
+            if mark_all_present:
+                updated['present'] = True
+            else:
+                updated.loc[updated['select'], 'present'] = False
+            updated['select'] = False
+            grid['df'] = updated
+            grid['version'] += 1  # fresh editor key so it starts from the updated frame
+            st.rerun()
+
+        if save:
+            statuses = pd.Series(np.where(edited['present'], 'Present', 'Absent'), index=edited['student_id'])
+            changed = statuses[statuses.values != edited['saved_status'].values]
+            try:
+                result = save_attendance(
+                    attendance_date, selected_subject, changed.to_dict(),
+                    st.session_state.current_user['teacher_id']
                 )
-            
-            if st.form_submit_button("Save Attendance"):
-                try:
-                    with get_db_connection() as conn:
-                        if conn is None: raise Exception("Database connection failed")
-                        
-                        # Use list of dicts for executemany with named parameters
-                        records_to_insert = []
-                        for student_id, status in attendance_data.items():
-                            records_to_insert.append({
-                                "aid": generate_attendance_id(),
-                                "sid": student_id,
-                                "date": attendance_date,
-                                "sub": selected_subject,
-                                "status": status,
-                                "tid": st.session_state.current_user['teacher_id']
-                            })
-                        
-                        with conn.begin(): # Start transaction
-                            # Delete existing records for this day/subject first
-                            delete_query = text("DELETE FROM attendance WHERE date = :date AND subject = :subject")
-                            conn.execute(delete_query, {"date": attendance_date, "subject": selected_subject})
-
-                            # Insert all new records
-                            insert_query = text("""
-                                INSERT INTO attendance (attendance_id, student_id, date, subject, status, teacher_id)
-                                VALUES (:aid, :sid, :date, :sub, :status, :tid)
-                            """)
-                            if records_to_insert:
-                                conn.execute(insert_query, records_to_insert)
-                        
-                        st.success("Attendance saved successfully!")
-                        st.rerun()
-                except Exception as e:
-                    st.error(f"Error saving attendance: {e}")
+                result['unchanged'] += len(statuses) - len(changed)
+                st.session_state.attendance_save_result = result
+                del st.session_state.attendance_grid  # reload saved statuses from the database
+                st.rerun()
+            except Exception as e:
+                st.error(f"Error saving attendance: {e}")
 
 def teacher_view_reports():
     """Teacher interface for viewing reports."""
     st.subheader("📈 Student Reports")
     
-    students = get_all_students()
-    if not students:
+    if not count_rows("students")[0]:
         st.warning("No students found.")
         return
     
-    student_options = [""] + [f"{s['student_id']} - {s['first_name']} {s['last_name']}" for s in students]
-    selected_student = st.selectbox("Select Student for Detailed Report", options=student_options)
+    student_id = student_search_picker("Find Student for Detailed Report", key="report_student")
     
-    if selected_student:
-        student_id = selected_student.split(" - ")[0]
-        student_info = next((s for s in students if s['student_id'] == student_id), None)
+    if student_id:
+        student_info = get_student_profile(student_id, columns=STUDENT_PICKER_COLUMNS)
         
         if student_info:
             st.markdown("---")
             st.subheader(f"Report for {student_info['first_name']} {student_info['last_name']}")
             
             grades = get_student_grades(student_id)
-            if grades:
+            if not grades.empty:
                 st.write("**Grades:**")
-                df_grades = pd.DataFrame(grades)
-                st.dataframe(df_grades[['subject', 'exam_type', 'marks_obtained', 'total_marks', 'percentage', 'grade', 'date']], use_container_width=True)
+                st.dataframe(grades[['subject', 'exam_type', 'marks_obtained', 'total_marks', 'percentage', 'grade', 'date']], use_container_width=True)
             else:
                 st.info("No grades recorded for this student.")
             
             attendance = get_student_attendance(student_id)
-            if attendance:
+            if not attendance.empty:
                 st.write("**Attendance:**")
-                df_attendance = pd.DataFrame(attendance)
-                st.dataframe(df_attendance[['date', 'subject', 'status']], use_container_width=True)
+                st.dataframe(attendance[['date', 'subject', 'status']], use_container_width=True)
                 
-                total = len(attendance)
-                present = len([a for a in attendance if a['status'] == 'Present'])
-                percent = (present / total * 100) if total > 0 else 0
-                
-                col1, col2, col3 = st.columns(3)
-                col1.metric("Total Classes", total)
-                col2.metric("Classes Present", present)
-                col3.metric("Attendance %", f"{percent:.1f}%")
+                summary, _ = get_attendance_summary(student_id)
+                if summary:
+                    col1, col2, col3 = st.columns(3)
+                    col1.metric("Total Classes", summary['classes'])
+                    col2.metric("Classes Present", summary['present'])
+                    col3.metric("Attendance %", f"{summary['attendance_percentage'] or 0:.1f}%")
             else:
                 st.info("No attendance recorded for this student.")
 
@@ -872,6 +3126,7 @@ def student_dashboard():
 
     menu = ["📊 Dashboard", "📝 View Grades", "📅 View Attendance", "👤 Profile"]
     choice = st.selectbox("Navigation", menu)
+    get_query_metrics().set_page(f"Student · {choice}")
 
     if choice == "📊 Dashboard":
         student_home()
@@ -886,43 +3141,39 @@ def student_home():
     """Student dashboard home page."""
     st.subheader("📊 Your Academic Overview")
     student_id = st.session_state.current_user['student_id']
-    grades = get_student_grades(student_id)
-    attendance = get_student_attendance(student_id)
+    grades, _ = get_grade_summary(student_id)
+    attendance, _ = get_attendance_summary(student_id)
     
     col1, col2, col3 = st.columns(3)
-    if grades:
-        avg_percentage = sum(float(g['percentage']) for g in grades) / len(grades) # Ensure float
-        col1.metric("Overall Average", f"{avg_percentage:.1f}%")
+    if grades and grades['exams']:
+        col1.metric("Overall Average", f"{grades['average_percentage']:.1f}%")
     else:
         col1.metric("Overall Average", "N/A")
     
-    col2.metric("Total Exams Logged", len(grades))
+    col2.metric("Total Exams Logged", grades['exams'] if grades else 0)
     
-    if attendance:
-        present_count = len([a for a in attendance if a['status'] == 'Present'])
-        attendance_percentage = (present_count / len(attendance)) * 100
-        col3.metric("Attendance", f"{attendance_percentage:.1f}%")
+    if attendance and attendance['classes']:
+        col3.metric("Attendance", f"{attendance['attendance_percentage']:.1f}%")
     else:
         col3.metric("Attendance", "N/A")
 
 def student_view_grades():
     """Student interface for viewing grades."""
     st.subheader("📝 Your Grades")
-    grades = get_student_grades(st.session_state.current_user['student_id'])
+    student_id = st.session_state.current_user['student_id']
+    grades = get_student_grades(student_id)
     
-    if grades:
-        df_grades = pd.DataFrame(grades)
-        # Ensure percentage is numeric for aggregation
-        df_grades['percentage'] = pd.to_numeric(df_grades['percentage'])
-        
-        st.dataframe(df_grades[['subject', 'exam_type', 'marks_obtained', 'total_marks', 'percentage', 'grade', 'date']], use_container_width=True)
+    if not grades.empty:
+        st.dataframe(grades[['subject', 'exam_type', 'marks_obtained', 'total_marks', 'percentage', 'grade', 'date']], use_container_width=True)
         
         st.markdown("---")
         st.subheader("📊 Grade Analysis by Subject")
         
-        subject_averages = df_grades.groupby('subject')['percentage'].mean().reset_index()
-        subject_averages.rename(columns={'percentage': 'Average Percentage'}, inplace=True)
-        st.bar_chart(subject_averages.set_index('subject'))
+        _, by_subject = get_grade_summary(student_id)
+        if not by_subject.empty:
+            subject_averages = by_subject.set_index('subject')[['average_percentage']]
+            subject_averages.rename(columns={'average_percentage': 'Average Percentage'}, inplace=True)
+            st.bar_chart(subject_averages)
 
     else:
         st.info("No grades available yet.")
@@ -930,30 +3181,28 @@ def student_view_grades():
 def student_view_attendance():
     """Student interface for viewing attendance."""
     st.subheader("📅 Your Attendance")
-    attendance = get_student_attendance(st.session_state.current_user['student_id'])
+    student_id = st.session_state.current_user['student_id']
+    attendance = get_student_attendance(student_id)
     
-    if attendance:
-        df_attendance = pd.DataFrame(attendance)
-        st.dataframe(df_attendance[['date', 'subject', 'status']], use_container_width=True)
+    if not attendance.empty:
+        st.dataframe(attendance[['date', 'subject', 'status']], use_container_width=True)
         
         st.markdown("---")
         st.subheader("📊 Attendance Summary")
         
-        total = len(attendance)
-        present = len([a for a in attendance if a['status'] == 'Present'])
-        absent = total - present
-        percent = (present / total * 100) if total > 0 else 0
+        summary, by_subject = get_attendance_summary(student_id)
+        if summary:
+            col1, col2, col3, col4 = st.columns(4)
+            col1.metric("Total Classes", summary['classes'])
+            col2.metric("Present", summary['present'])
+            col3.metric("Absent", summary['classes'] - summary['present'])
+            col4.metric("Attendance %", f"{summary['attendance_percentage'] or 0:.1f}%")
         
-        col1, col2, col3, col4 = st.columns(4)
-        col1.metric("Total Classes", total)
-        col2.metric("Present", present)
-        col3.metric("Absent", absent)
-        col4.metric("Attendance %", f"{percent:.1f}%")
-        
-        st.write("**Subject-wise Attendance:**")
-        subject_summary = df_attendance.groupby('subject')['status'].apply(lambda s: (s == 'Present').sum() / s.count() * 100).reset_index()
-        subject_summary.rename(columns={'status': 'Attendance Percentage'}, inplace=True)
-        st.bar_chart(subject_summary.set_index('subject'))
+        if not by_subject.empty:
+            st.write("**Subject-wise Attendance:**")
+            subject_summary = by_subject.set_index('subject')[['attendance_percentage']]
+            subject_summary.rename(columns={'attendance_percentage': 'Attendance Percentage'}, inplace=True)
+            st.bar_chart(subject_summary)
 
     else:
         st.info("No attendance records available yet.")
@@ -1003,17 +3252,10 @@ def add_student_form():
         
         # Controller 2: Year Selection (This triggers the semester update)
         st.write("**Course Details**")
-        year_options = ["1st Year", "2nd Year", "3rd Year", "4th Year"]
-        year = st.selectbox("Year*", year_options, key="student_year_selector")
+        year = st.selectbox("Year*", YEAR_OPTIONS, key="student_year_selector")
 
         # The logic to determine semester options now runs immediately when 'year' is changed.
-        semester_map = {
-            "1st Year": ["1st Semester", "2nd Semester"],
-            "2nd Year": ["3rd Semester", "4th Semester"],
-            "3rd Year": ["5th Semester", "6th Semester"],
-            "4th Year": ["7th Semester", "8th Semester"],
-        }
-        semester_options = semester_map.get(year, [])
+        semester_options = SEMESTER_MAP.get(year, [])
         
         # --- THE FORM ITSELF STARTS HERE ---
         with st.form("add_student_form", clear_on_submit=True):
@@ -1028,8 +3270,8 @@ def add_student_form():
             with col2:
                 # The 'year' is already selected outside, so we just show other course fields here.
                 st.write("‎") # Empty space for alignment
-                gender = st.selectbox("Gender*", ["Male", "Female", "Other"])
-                course = st.selectbox("Course*", ["Data Science", "Computer Science", "Machine Learning", "Web Development", "Software Engineering"])
+                gender = st.selectbox("Gender*", GENDER_OPTIONS)
+                course = st.selectbox("Course*", COURSE_OPTIONS)
                 
                 # The semester dropdown now correctly uses the options calculated outside the form.
                 semester = st.selectbox("Semester*", semester_options)
@@ -1078,7 +3320,7 @@ def add_student_form():
                         student_id = generate_student_id()
                         with get_db_connection() as conn:
                             if conn is None: raise Exception("Database connection failed")
-                            with conn.begin():
+                            with begin_write(conn):
                                 conn.execute(text("""
                                     INSERT INTO students (student_id, first_name, last_name, email, phone, date_of_birth, 
                                                           gender, course, year, semester, enrollment_date, password, status)
@@ -1088,6 +3330,8 @@ def add_student_form():
                                     "dob": date_of_birth, "gender": gender, "course": course, "year": year, "sem": semester,
                                     "edate": date.today(), "pass": hash_password(password)
                                 })
+                                enroll_in_cohort_sections(conn, [student_id])
+                        invalidate_reference_cache("students")
                         
                         st.session_state.new_student_credentials = {
                             "id": student_id,
@@ -1106,14 +3350,14 @@ def student_management_interface(can_delete=False):
     """A reusable UI component for viewing and managing students."""
     st.markdown("---")
     st.subheader("Student List & Management")
-    students = get_all_students()
+    student_total = count_rows("students")
+    students = keyset_pager("student_list", get_students_page, STUDENT_KEYSET, student_total, "students") if student_total[0] else pd.DataFrame()
 
-    if not students:
+    if students.empty:
         st.info("No students found.")
         return
 
-    df_students = pd.DataFrame(students)
-    st.dataframe(df_students[['student_id', 'first_name', 'last_name', 'gender', 'course', 'email', 'phone', 'status']], use_container_width=True)
+    st.dataframe(students[list(STUDENT_LIST_COLUMNS)], use_container_width=True)
 
     if 'password_reset_info' in st.session_state:
         info = st.session_state.password_reset_info
@@ -1122,21 +3366,28 @@ def student_management_interface(can_delete=False):
         st.warning("Please share this new password with the student securely.")
         del st.session_state.password_reset_info
 
-    student_options = {f"{s['student_id']} - {s['first_name']} {s['last_name']}": s['student_id'] for s in students}
-    selected_label = st.selectbox("Select a student to manage", [""] + list(student_options.keys()), key="student_manage_select")
+    student_id = student_search_picker("Find a student to manage", key="student_manage")
+
+    profile = get_student_profile(student_id) if student_id else None
 
-    if selected_label:
-        student_id = student_options[selected_label]
+    if profile:
+        with st.expander("📇 Student Profile"):
+            col1, col2 = st.columns(2)
+            col1.write(f"**Date of Birth:** {profile['date_of_birth']}")
+            col1.write(f"**Year & Semester:** {profile['year']}, {profile['semester']}")
+            col1.write(f"**Enrollment Date:** {profile['enrollment_date']}")
+            col2.write(f"**Address:** {profile['address'] or 'N/A'}")
+            col2.write(f"**Emergency Contact:** {profile['emergency_contact'] or 'N/A'}")
         
         with st.expander("🔑 Manage Selected Student", expanded=True):
-            st.write(f"**Actions for:** {selected_label}")
+            st.write(f"**Actions for:** {student_id} - {profile['first_name']} {profile['last_name']}")
             
             if st.button("Generate & Set New Password", key=f"gen_pw_{student_id}"):
                 new_pw = generate_password()
                 try:
                     with get_db_connection() as conn:
                         if conn is None: raise Exception("Database connection failed")
-                        with conn.begin():
+                        with begin_write(conn):
                             conn.execute(text("UPDATE students SET password = :pass WHERE student_id = :sid"),
                                          {"pass": hash_password(new_pw), "sid": student_id})
                     st.session_state.password_reset_info = {'student_id': student_id, 'new_password': new_pw}
@@ -1152,7 +3403,7 @@ def student_management_interface(can_delete=False):
                         try:
                             with get_db_connection() as conn:
                                 if conn is None: raise Exception("Database connection failed")
-                                with conn.begin():
+                                with begin_write(conn):
                                     conn.execute(text("UPDATE students SET password = :pass WHERE student_id = :sid"),
                                                  {"pass": hash_password(custom_pw), "sid": student_id})
                             st.success(f"Successfully set a new password for {student_id}.")
@@ -1167,8 +3418,9 @@ def student_management_interface(can_delete=False):
                     try:
                         with get_db_connection() as conn:
                             if conn is None: raise Exception("Database connection failed")
-                            with conn.begin():
+                            with begin_write(conn):
                                 conn.execute(text("DELETE FROM students WHERE student_id = :sid"), {"sid": student_id})
+                        invalidate_reference_cache("students")
                         st.success(f"Student {student_id} has been deleted.")
                         st.rerun()
                     except Exception as e:
@@ -1178,6 +3430,7 @@ def manage_students_admin():
     """Admin interface for managing students."""
     st.subheader("👨‍🎓 Manage Students")
     add_student_form()
+    bulk_import_students_form()
     student_management_interface(can_delete=True)
 
 def teacher_manage_students():
@@ -1190,18 +3443,16 @@ def teacher_manage_students():
 def main():
     """The main function to run the Streamlit application."""
     st.set_page_config(page_title="School Management System", layout="wide", page_icon="🎓")
+    get_query_metrics().start_rerun()
     
-    if 'db_initialized' not in st.session_state:
-        st.info("Initializing database... Please wait.")
-        if init_database():
-            initialize_default_data()
-            st.session_state.db_initialized = True
-            st.rerun()
-        else:
-            st.error("DATABASE INITIALIZATION FAILED. Please check your database credentials and ensure the Postgres server is running.")
-            st.stop()
+    try:
+        bootstrap_database()
+    except Exception as e:
+        st.error(f"DATABASE INITIALIZATION FAILED: {e}. Please check your database credentials and ensure the Postgres server is running.")
+        st.stop()
 
     if not st.session_state.get('logged_in'):
+        get_query_metrics().set_page("Login")
         login_page()
     else:
         user_type = st.session_state.user_type
@@ -0,0 +1,250 @@
+"""Password hashing shared by the CMS apps.
+
+Hashes are stored as self-describing strings,
+
+    scrypt$<log2 n>$<r>$<p>$<salt>$<hash>
+
+so the cost can be raised at any time: a successful login whose stored
+hash was made with other parameters, or by the legacy unsalted SHA-256
+scheme, gets a replacement hash with the current ones. Verification
+happens in Python after the user row is looked up, never in SQL.
+
+Hashing runs on a small thread pool. A burst of logins queues there instead
+of running scrypt (and holding its memory) on every script thread at once.
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+import statistics
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+class PasswordHasher(ABC):
+    """One hashing scheme; subclasses implement hash() and verify()."""
+
+    algorithm = None
+
+    def identifies(self, encoded):
+        """Whether a stored hash was made by this scheme."""
+        return encoded.startswith(f"{self.algorithm}$")
+
+    @abstractmethod
+    def hash(self, password):
+        """A new stored hash for password."""
+
+    @abstractmethod
+    def verify(self, password, encoded):
+        """Whether password matches a stored hash this scheme identifies."""
+
+    def needs_rehash(self, encoded):
+        """Whether a hash this scheme verifies should be replaced by a fresh one."""
+        return False
+
+class ScryptHasher(PasswordHasher):
+    """scrypt with a random salt per password.
+
+    Each hash takes about 128 * r * n bytes of memory, and time grows with
+    n as well; see calibrate_scrypt() for picking n.
+    """
+
+    algorithm = "scrypt"
+
+    def __init__(self, n=2 ** 14, r=8, p=1, salt_bytes=16, hash_bytes=32):
+        if n < 2 or n & (n - 1):
+            raise ValueError("scrypt n must be a power of two")
+        self.n, self.r, self.p = n, r, p
+        self.salt_bytes, self.hash_bytes = salt_bytes, hash_bytes
+
+    @staticmethod
+    def _derive(password, salt, n, r, p, length):
+        # OpenSSL refuses anything over maxmem, which defaults to 32 MiB
+        maxmem = 128 * r * (n + p + 2) + 1024 * 1024
+        return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, dklen=length, maxmem=maxmem)
+
+    def hash(self, password):
+        salt = secrets.token_bytes(self.salt_bytes)
+        digest = self._derive(password, salt, self.n, self.r, self.p, self.hash_bytes)
+        return "$".join((self.algorithm, str(self.n.bit_length() - 1), str(self.r), str(self.p),
+                         base64.b64encode(salt).decode(), base64.b64encode(digest).decode()))
+
+    @staticmethod
+    def _parse(encoded):
+        _, log2_n, r, p, salt, digest = encoded.split("$")
+        return 2 ** int(log2_n), int(r), int(p), base64.b64decode(salt), base64.b64decode(digest)
+
+    def verify(self, password, encoded):
+        try:
+            n, r, p, salt, digest = self._parse(encoded)
+        except ValueError:
+            return False
+        return hmac.compare_digest(self._derive(password, salt, n, r, p, len(digest)), digest)
+
+    def needs_rehash(self, encoded):
+        n, r, p, salt, digest = self._parse(encoded)
+        return (n, r, p, len(salt), len(digest)) != (self.n, self.r, self.p, self.salt_bytes, self.hash_bytes)
+
+class LegacySHA256Hasher(PasswordHasher):
+    """Unsalted SHA-256 hex digests, as stored before salted hashing. Verify-only."""
+
+    algorithm = "sha256"
+
+    def identifies(self, encoded):
+        return len(encoded) == 64 and all(c in "0123456789abcdef" for c in encoded)
+
+    def hash(self, password):
+        raise NotImplementedError("legacy SHA-256 hashes are only verified, never created")
+
+    def verify(self, password, encoded):
+        return hmac.compare_digest(hashlib.sha256(password.encode()).hexdigest(), encoded)
+
+    def needs_rehash(self, encoded):
+        return True
+
+class VerificationCache:
+    """Recent successful verifications, so a user logging in again skips the KDF.
+
+    Entries are keyed by an HMAC of the stored hash and the password under a
+    per-process random key; neither is kept. A password change alters the
+    stored hash, so old entries stop matching.
+    """
+
+    def __init__(self, size=1024, ttl=300):
+        self.size, self.ttl = size, ttl
+        self._key = secrets.token_bytes(32)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _entry_key(self, password, encoded):
+        return hmac.new(self._key, f"{encoded}\0{password}".encode(), hashlib.sha256).digest()
+
+    def has(self, password, encoded):
+        if self.size <= 0 or self.ttl <= 0:
+            return False
+        key = self._entry_key(password, encoded)
+        with self._lock:
+            stored_at = self._entries.get(key)
+            if stored_at is None:
+                return False
+            if time.monotonic() - stored_at > self.ttl:
+                del self._entries[key]
+                return False
+            return True
+
+    def add(self, password, encoded):
+        if self.size <= 0 or self.ttl <= 0:
+            return
+        key = self._entry_key(password, encoded)
+        with self._lock:
+            self._entries[key] = time.monotonic()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+class PasswordContext:
+    """The current hasher, the legacy schemes still accepted, and the pool hashing runs on.
+
+    bulk_hasher, if given, is a cheaper hasher for machine-generated random
+    passwords set in bulk; needs_rehash() upgrades those on first login.
+    """
+
+    def __init__(self, hasher, legacy=(LegacySHA256Hasher(),), workers=4, cache_size=1024, cache_ttl=300,
+                 bulk_hasher=None):
+        self.hasher = hasher
+        self.bulk_hasher = bulk_hasher or hasher
+        self.hashers = (hasher, *legacy)
+        self.cache = VerificationCache(cache_size, cache_ttl)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._dummy_hash = None
+
+    def _run(self, function, *args):
+        return self._pool.submit(function, *args).result()
+
+    def hash(self, password):
+        return self._run(self.hasher.hash, password)
+
+    def hash_many(self, passwords, hasher=None):
+        """Hash a batch of passwords across the pool, in order."""
+        return list(self._pool.map((hasher or self.hasher).hash, passwords))
+
+    def identify(self, encoded):
+        return next((h for h in self.hashers if encoded and h.identifies(encoded)), None)
+
+    def verify(self, password, encoded):
+        """Check a password against a stored hash.
+
+        Returns (ok, new_hash). new_hash is a replacement to store when the
+        stored hash uses an older scheme or cost, otherwise None. A missing
+        or unrecognised hash still costs one hash, so unknown users cannot
+        be told apart by timing.
+        """
+        hasher = self.identify(encoded)
+        if hasher is None:
+            self._verify_dummy(password)
+            return False, None
+        if self.cache.has(password, encoded):
+            return True, None
+        if not self._run(hasher.verify, password, encoded):
+            return False, None
+        if hasher is not self.hasher or self.hasher.needs_rehash(encoded):
+            return True, self.hash(password)
+        self.cache.add(password, encoded)
+        return True, None
+
+    def _verify_dummy(self, password):
+        if self._dummy_hash is None:
+            self._dummy_hash = self.hash(secrets.token_urlsafe(16))
+        self._run(self.hasher.verify, password, self._dummy_hash)
+
+def calibrate_scrypt(budget_ms, r=8, p=1, min_log2_n=10, max_log2_n=20, rounds=3):
+    """Time one scrypt hash at increasing n.
+
+    Returns (timings, best_n): timings is a list of dicts with n, memory_mib
+    and median ms; best_n is the largest n within budget_ms (None if even
+    the smallest is over). Stops at the first n over budget.
+    """
+    timings, best_n = [], None
+    for log2_n in range(min_log2_n, max_log2_n + 1):
+        hasher = ScryptHasher(n=2 ** log2_n, r=r, p=p)
+        samples = []
+        for _ in range(rounds):
+            started = time.perf_counter()
+            hasher.hash("calibration-password")
+            samples.append((time.perf_counter() - started) * 1000)
+        elapsed = statistics.median(samples)
+        timings.append({"n": hasher.n, "memory_mib": 128 * r * hasher.n / 2 ** 20, "ms": elapsed})
+        if elapsed > budget_ms:
+            break
+        best_n = hasher.n
+    return timings, best_n
+
+def password_settings(get_setting):
+    """The [passwords] settings, read through the app's get_setting(name, default, section)."""
+    def setting(name, default):
+        return get_setting(name, default, section="passwords")
+    return {
+        # scrypt cost for new hashes; raise n as hardware allows (python benchmark.py
+        # passwords --budget-ms 250 suggests one). Existing hashes are upgraded on login.
+        "scrypt_n": setting("scrypt_n", 2 ** 14),
+        "scrypt_r": setting("scrypt_r", 8),
+        "scrypt_p": setting("scrypt_p", 1),
+        # Cost for generated import passwords: 64 random bits need no stretching
+        # to resist guessing, and import time scales with this
+        "import_scrypt_n": setting("import_scrypt_n", 2 ** 8),
+        # Hashes computed at once; each holds 128 * r * n bytes (16 MiB at the defaults)
+        "hash_workers": setting("hash_workers", 4),
+        "verify_cache_size": setting("verify_cache_size", 1024),
+        "verify_cache_ttl": setting("verify_cache_ttl", 300),
+    }
+
+def password_context_from_settings(get_setting):
+    """A PasswordContext configured from the [passwords] settings."""
+    settings = password_settings(get_setting)
+    hasher = ScryptHasher(n=settings["scrypt_n"], r=settings["scrypt_r"], p=settings["scrypt_p"])
+    bulk_hasher = ScryptHasher(n=settings["import_scrypt_n"], r=settings["scrypt_r"], p=settings["scrypt_p"])
+    return PasswordContext(hasher, workers=settings["hash_workers"],
+                           cache_size=settings["verify_cache_size"], cache_ttl=settings["verify_cache_ttl"],
+                           bulk_hasher=bulk_hasher)
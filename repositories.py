@@ -0,0 +1,430 @@
+"""Storage backends shared by the CMS apps (cmss.py on PostgreSQL, CMS.py on MySQL).
+
+Every repository method takes an open SQLAlchemy connection and runs inside
+the caller's transaction, so callers keep control of transaction boundaries
+and can combine repository calls with their own statements. Each dialect
+subclass swaps in that backend's fast path: COPY, LOAD DATA or executemany
+for bulk loads, ON CONFLICT or ON DUPLICATE KEY for upserts, and a
+server-side or unbuffered cursor for streaming reads.
+
+    repos = get_repositories(engine.dialect.name)
+    with engine.begin() as conn:
+        repos.attendance.save_class(conn, date.today(), "Data Science", {"STU001": "Present"}, "TEA002")
+"""
+import csv
+import io
+import os
+import tempfile
+from abc import ABC, abstractmethod
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import text, bindparam
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+# Each ID prefix maps to its table and key column. PostgreSQL also backs every
+# prefix with a sequence; the other backends allocate past the highest stored ID.
+ID_SEQUENCES = {
+    "STU": ("student_id_seq", "students", "student_id"),
+    "TEA": ("teacher_id_seq", "teachers", "teacher_id"),
+    "GRA": ("grade_id_seq", "grades", "grade_id"),
+    "ATT": ("attendance_id_seq", "attendance", "attendance_id"),
+    "SUB": ("subject_id_seq", "subjects", "subject_id"),
+    "SEC": ("section_id_seq", "sections", "section_id"),
+    "SCL": ("scale_id_seq", "grading_scales", "scale_id"),
+}
+
+STUDENT_FIELDS = ("student_id", "first_name", "last_name", "email", "phone", "date_of_birth", "gender",
+                  "course", "year", "semester", "address", "emergency_contact", "enrollment_date",
+                  "password", "status")
+TEACHER_FIELDS = ("teacher_id", "username", "password", "first_name", "last_name", "email", "subjects", "role")
+GRADE_FIELDS = ("grade_id", "student_id", "subject", "exam_type", "marks_obtained",
+                "total_marks", "percentage", "grade", "date", "teacher_id")
+INSERT_CHUNK_ROWS = 1000  # rows per multi-row INSERT statement
+STREAM_BATCH_ROWS = 50000
+
+ATTENDANCE_TABLE = sqlalchemy.table(
+    "attendance",
+    *[sqlalchemy.column(name) for name in ("attendance_id", "student_id", "date", "subject", "status", "teacher_id", "updated_at")]
+)
+GRADES_TABLE = sqlalchemy.table("grades", *[sqlalchemy.column(name) for name in GRADE_FIELDS])
+
+def format_id(prefix, number):
+    return f"{prefix}{number:03d}"
+
+def read_frame(conn, query, params=None):
+    """Run a query into a DataFrame."""
+    return pd.read_sql(text(query), conn, params=params)
+
+def _chunks(rows, size=INSERT_CHUNK_ROWS):
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+class Repository:
+    """Base for one table's queries; subclasses override the dialect-specific parts."""
+
+    def __init__(self, repos):
+        self.repos = repos
+
+class IdAllocator(Repository):
+    """Allocates prefixed IDs past the highest stored numeric ID.
+
+    Allocation happens in the caller's transaction. Concurrent writers can
+    still race for the same number; the primary key rejects the loser.
+    """
+
+    # Restricts MAX() to IDs made of the prefix and digits; written per dialect
+    numeric_suffix_filter = "{column} LIKE '{prefix}%'"
+    lock_clause = ""
+
+    def reserve(self, conn, prefix, n):
+        """Reserve n unique IDs for the given prefix."""
+        if n <= 0:
+            return []
+        _, table_name, column_name = ID_SEQUENCES[prefix]
+        # Table/column names come from ID_SEQUENCES, never from user input
+        last = conn.execute(text(f"""
+            SELECT {column_name} FROM {table_name}
+            WHERE {self.numeric_suffix_filter.format(column=column_name, prefix=prefix)}
+            ORDER BY LENGTH({column_name}) DESC, {column_name} DESC LIMIT 1 {self.lock_clause}
+        """)).scalar()
+        start = int(last[len(prefix):]) + 1 if last else 1
+        return [format_id(prefix, number) for number in range(start, start + n)]
+
+class PostgresIdAllocator(IdAllocator):
+    """Allocates IDs from the prefix's sequence in a single round trip."""
+
+    def reserve(self, conn, prefix, n):
+        if n <= 0:
+            return []
+        sequence_name = ID_SEQUENCES[prefix][0]
+        numbers = conn.execute(text(f"SELECT nextval('{sequence_name}') FROM generate_series(1, :n)"), {"n": n}).scalars().all()
+        return [format_id(prefix, number) for number in numbers]
+
+class MySQLIdAllocator(IdAllocator):
+    numeric_suffix_filter = "{column} REGEXP '^{prefix}[0-9]+$'"
+    # Next-key lock on the highest ID holds off other allocators until commit
+    lock_clause = "FOR UPDATE"
+
+class SQLiteIdAllocator(IdAllocator):
+    """Allocates IDs from the id_sequences counter table, SQLite's stand-in for sequences.
+
+    The counter is bumped by a single upsert, which takes SQLite's write
+    lock; the app allocates inside write transactions, which begin IMMEDIATE
+    on SQLite, so concurrent allocators queue on that lock (up to
+    busy_timeout) rather than fail.
+    A prefix without a counter row starts at 1.
+    """
+    numeric_suffix_filter = "{column} GLOB '{prefix}[0-9]*'"
+
+    def reserve(self, conn, prefix, n):
+        if n <= 0:
+            return []
+        last = conn.execute(text("""
+            INSERT INTO id_sequences (prefix, last_value) VALUES (:prefix, :n)
+            ON CONFLICT (prefix) DO UPDATE SET last_value = last_value + excluded.last_value
+            RETURNING last_value
+        """), {"prefix": prefix, "n": n}).scalar()
+        return [format_id(prefix, number) for number in range(last - n + 1, last + 1)]
+
+class StudentRepo(Repository):
+    def list(self, conn, columns=("*",), order_by="first_name, last_name"):
+        return read_frame(conn, f"SELECT {', '.join(columns)} FROM students ORDER BY {order_by}")
+
+    def find(self, conn, student_id, columns=("*",)):
+        row = conn.execute(text(f"SELECT {', '.join(columns)} FROM students WHERE student_id = :sid"),
+                           {"sid": student_id}).mappings().fetchone()
+        return dict(row) if row else None
+
+    def insert(self, conn, record):
+        columns = [field for field in STUDENT_FIELDS if field in record]
+        conn.execute(text(f"INSERT INTO students ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"),
+                     {column: record[column] for column in columns})
+
+    def bulk_insert(self, conn, frame):
+        """Load prepared student rows (all STUDENT_FIELDS columns) with batched INSERTs."""
+        columns = ", ".join(STUDENT_FIELDS)
+        placeholders = ", ".join(f":{column}" for column in STUDENT_FIELDS)
+        records = frame[list(STUDENT_FIELDS)].to_dict("records")
+        for chunk in _chunks(records):
+            conn.execute(text(f"INSERT INTO students ({columns}) VALUES ({placeholders})"), chunk)
+
+    def set_password(self, conn, student_id, password_hash):
+        conn.execute(text("UPDATE students SET password = :pass WHERE student_id = :sid"),
+                     {"pass": password_hash, "sid": student_id})
+
+    def delete(self, conn, student_id):
+        conn.execute(text("DELETE FROM students WHERE student_id = :sid"), {"sid": student_id})
+
+class PostgresStudentRepo(StudentRepo):
+    def bulk_insert(self, conn, frame):
+        """Load prepared student rows with COPY."""
+        if conn.dialect.driver != "psycopg2":
+            return super().bulk_insert(conn, frame)
+        buffer = io.StringIO()
+        frame.to_csv(buffer, columns=list(STUDENT_FIELDS), index=False, header=False)
+        buffer.seek(0)
+        cursor = conn.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY students ({', '.join(STUDENT_FIELDS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+
+class MySQLStudentRepo(StudentRepo):
+    def bulk_insert(self, conn, frame):
+        """Load prepared student rows with LOAD DATA LOCAL INFILE.
+
+        Servers ship with local_infile off; the batched INSERT fallback is
+        used whenever the server or client refuses it.
+        """
+        handle, path = tempfile.mkstemp(suffix=".csv")
+        try:
+            with os.fdopen(handle, "w", newline="") as f:
+                # \\N is how LOAD DATA spells NULL
+                frame[list(STUDENT_FIELDS)].to_csv(f, index=False, header=False, na_rep="\\N",
+                                                   quoting=csv.QUOTE_MINIMAL, lineterminator="\n")
+            # MySQL reads backslashes in the file name as escapes; forward slashes work on every OS
+            infile = path.replace(os.sep, "/")
+            try:
+                with conn.begin_nested():
+                    conn.exec_driver_sql(
+                        f"LOAD DATA LOCAL INFILE '{infile}' INTO TABLE students "
+                        "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' LINES TERMINATED BY '\\n' "
+                        f"({', '.join(STUDENT_FIELDS)})")
+            except sqlalchemy.exc.DBAPIError:
+                super().bulk_insert(conn, frame)
+        finally:
+            os.remove(path)
+
+class TeacherRepo(Repository):
+    def list(self, conn, columns=("teacher_id", "username", "first_name", "last_name", "email", "role")):
+        return read_frame(conn, f"SELECT {', '.join(columns)} FROM teachers ORDER BY first_name")
+
+    def find_by_username(self, conn, username, columns=("*",)):
+        row = conn.execute(text(f"SELECT {', '.join(columns)} FROM teachers WHERE username = :user"),
+                           {"user": username}).mappings().fetchone()
+        return dict(row) if row else None
+
+    def insert(self, conn, record):
+        columns = [field for field in TEACHER_FIELDS if field in record]
+        conn.execute(text(f"INSERT INTO teachers ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"),
+                     {column: record[column] for column in columns})
+
+    def set_password(self, conn, teacher_id, password_hash):
+        conn.execute(text("UPDATE teachers SET password = :pass WHERE teacher_id = :tid"),
+                     {"pass": password_hash, "tid": teacher_id})
+
+    def delete(self, conn, teacher_id):
+        conn.execute(text("DELETE FROM teachers WHERE teacher_id = :tid"), {"tid": teacher_id})
+
+class SubjectRepo(Repository):
+    def list(self, conn):
+        return read_frame(conn, "SELECT * FROM subjects ORDER BY name")
+
+    def insert_many(self, conn, records):
+        """Insert subjects given as dicts with subject_id, name and credits."""
+        conn.execute(text("INSERT INTO subjects (subject_id, name, credits) VALUES (:subject_id, :name, :credits)"), records)
+
+class GradeRepo(Repository):
+    def for_student(self, conn, student_id, read=read_frame):
+        """A student's grades, newest first. `read` lets callers choose the frame reader."""
+        return read(conn, "SELECT * FROM grades WHERE student_id = :sid ORDER BY date DESC", {"sid": student_id})
+
+    def recent_for_teacher(self, conn, teacher_id, limit=10):
+        return read_frame(conn, """
+            SELECT g.grade_id, g.student_id, s.first_name, s.last_name, g.subject, g.exam_type,
+                   g.marks_obtained, g.total_marks, g.percentage, g.grade, g.date
+            FROM grades g
+            JOIN students s ON g.student_id = s.student_id
+            WHERE g.teacher_id = :tid
+            ORDER BY g.date DESC
+            LIMIT :limit
+        """, {"tid": teacher_id, "limit": limit})
+
+    def insert_many(self, conn, records):
+        """Insert grade rows (dicts with GRADE_FIELDS).
+
+        Returns the stored student_id, subject, percentage and date of each
+        row, read back with RETURNING where the backend supports it.
+        """
+        stored = []
+        for chunk in _chunks(records):
+            stmt = sqlalchemy.insert(GRADES_TABLE).values(chunk)
+            if conn.dialect.insert_returning:
+                stmt = stmt.returning(GRADES_TABLE.c.student_id, GRADES_TABLE.c.subject,
+                                      GRADES_TABLE.c.percentage, GRADES_TABLE.c.date)
+                stored += [dict(row) for row in conn.execute(stmt).mappings()]
+            else:
+                conn.execute(stmt)
+                # DECIMAL(5,2) columns round to the stored value
+                stored += [{"student_id": r["student_id"], "subject": r["subject"],
+                            "percentage": round(r["percentage"], 2), "date": r["date"]} for r in chunk]
+        return stored
+
+class AttendanceRepo(Repository, ABC):
+    def for_student(self, conn, student_id, read=read_frame):
+        """A student's attendance, newest first. `read` lets callers choose the frame reader."""
+        return read(conn, "SELECT * FROM attendance WHERE student_id = :sid ORDER BY date DESC", {"sid": student_id})
+
+    def for_class(self, conn, attendance_date, subject):
+        """student_id and status of every row stored for one date and subject."""
+        return read_frame(conn, "SELECT student_id, status FROM attendance WHERE date = :date AND subject = :subject",
+                          {"date": attendance_date, "subject": subject})
+
+    def save_class(self, conn, attendance_date, subject, statuses, teacher_id):
+        """Write attendance for one date and subject, touching only rows whose status changed.
+
+        statuses maps student_id -> 'Present'/'Absent'; students not in it are
+        left alone. Returns the written rows as dicts with student_id, status
+        and inserted (False for an update).
+        """
+        if not statuses:
+            return []
+        existing = conn.execute(text("""
+            SELECT student_id, attendance_id, status FROM attendance
+            WHERE date = :date AND subject = :subject AND student_id IN :ids
+        """).bindparams(bindparam("ids", expanding=True)),
+            {"date": attendance_date, "subject": subject, "ids": list(statuses)}).mappings().all()
+        existing = {row['student_id']: row for row in existing}
+
+        changed = {sid: status for sid, status in statuses.items()
+                   if sid not in existing or existing[sid]['status'] != status}
+        new_ids = iter(self.repos.ids.reserve(conn, "ATT", sum(1 for sid in changed if sid not in existing)))
+        rows = [{
+            "attendance_id": existing[sid]['attendance_id'] if sid in existing else next(new_ids),
+            "student_id": sid,
+            "date": attendance_date,
+            "subject": subject,
+            "status": status,
+            "teacher_id": teacher_id,
+        } for sid, status in changed.items()]
+        written = []
+        for chunk in _chunks(rows):
+            written += self._upsert(conn, chunk, existing)
+        return written
+
+    def _upsert(self, conn, rows, existing):
+        """Insert rows or update the stored status; returns the written rows.
+
+        The upsert covers rows another session inserted after the read in
+        save_class. Backends that cannot report insert vs update classify
+        rows by that read.
+        """
+        stmt = self._upsert_statement(rows)
+        conn.execute(stmt)
+        return [{"student_id": row["student_id"], "status": row["status"], "inserted": row["student_id"] not in existing}
+                for row in rows]
+
+    @abstractmethod
+    def _upsert_statement(self, rows):
+        """The backend's insert-or-update-status statement for rows."""
+
+class PostgresAttendanceRepo(AttendanceRepo):
+    def _upsert(self, conn, rows, existing):
+        # xmax = 0 on a returned row means it was freshly inserted
+        stmt = self._upsert_statement(rows).returning(
+            sqlalchemy.literal_column("xmax = 0").label("inserted"), ATTENDANCE_TABLE.c.student_id, ATTENDANCE_TABLE.c.status)
+        return [{"student_id": student_id, "status": status, "inserted": inserted}
+                for inserted, student_id, status in conn.execute(stmt)]
+
+    def _upsert_statement(self, rows):
+        stmt = pg_insert(ATTENDANCE_TABLE).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=["student_id", "date", "subject"],
+            set_={"status": stmt.excluded.status, "teacher_id": stmt.excluded.teacher_id,
+                  "updated_at": sqlalchemy.func.current_timestamp()},
+            where=ATTENDANCE_TABLE.c.status.is_distinct_from(stmt.excluded.status),
+        )
+
+class MySQLAttendanceRepo(AttendanceRepo):
+    def _upsert_statement(self, rows):
+        # updated_at refreshes itself through ON UPDATE CURRENT_TIMESTAMP
+        stmt = mysql_insert(ATTENDANCE_TABLE).values(rows)
+        return stmt.on_duplicate_key_update(status=stmt.inserted.status, teacher_id=stmt.inserted.teacher_id)
+
+class SQLiteAttendanceRepo(AttendanceRepo):
+    def _upsert_statement(self, rows):
+        stmt = sqlite_insert(ATTENDANCE_TABLE).values(rows)
+        return stmt.on_conflict_do_update(
+            index_elements=["student_id", "date", "subject"],
+            set_={"status": stmt.excluded.status, "teacher_id": stmt.excluded.teacher_id,
+                  "updated_at": sqlalchemy.func.current_timestamp()},
+            where=ATTENDANCE_TABLE.c.status != stmt.excluded.status,
+        )
+
+class StreamedRows:
+    """Rows of an unbuffered DBAPI cursor, with the keys()/partitions() interface of a SQLAlchemy Result."""
+
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def keys(self):
+        return [column[0] for column in self.cursor.description]
+
+    def partitions(self, size):
+        try:
+            while rows := self.cursor.fetchmany(size):
+                yield rows
+        finally:
+            self.cursor.close()
+
+class Repositories:
+    """The repositories for one backend, plus its streaming read."""
+
+    id_allocator = IdAllocator
+    student_repo = StudentRepo
+    attendance_repo = AttendanceRepo
+
+    def __init__(self, dialect_name):
+        self.dialect_name = dialect_name
+        self.ids = self.id_allocator(self)
+        self.students = self.student_repo(self)
+        self.teachers = TeacherRepo(self)
+        self.subjects = SubjectRepo(self)
+        self.grades = GradeRepo(self)
+        self.attendance = self.attendance_repo(self)
+
+    def stream(self, conn, query, params=None, batch_rows=STREAM_BATCH_ROWS):
+        """Execute a query on a server-side cursor that buffers at most batch_rows rows client-side.
+
+        The result is read with .keys() and .partitions(batch_rows).
+        """
+        return conn.execution_options(stream_results=True, max_row_buffer=batch_rows).execute(text(query), params or {})
+
+class PostgresRepositories(Repositories):
+    id_allocator = PostgresIdAllocator
+    student_repo = PostgresStudentRepo
+    attendance_repo = PostgresAttendanceRepo
+
+class MySQLRepositories(Repositories):
+    id_allocator = MySQLIdAllocator
+    student_repo = MySQLStudentRepo
+    attendance_repo = MySQLAttendanceRepo
+
+    def stream(self, conn, query, params=None, batch_rows=STREAM_BATCH_ROWS):
+        # SQLAlchemy's mysqlconnector dialect has no server-side cursors, so
+        # read through an unbuffered cursor on the raw connection instead
+        compiled = text(query).bindparams(**(params or {})).compile(dialect=conn.dialect)
+        cursor = conn.connection.dbapi_connection.cursor(buffered=False)
+        cursor.execute(str(compiled), compiled.params)
+        return StreamedRows(cursor)
+
+class SQLiteRepositories(Repositories):
+    # SQLite cursors already step through rows lazily
+    id_allocator = SQLiteIdAllocator
+    attendance_repo = SQLiteAttendanceRepo
+
+BACKENDS = {
+    "postgresql": PostgresRepositories,
+    "mysql": MySQLRepositories,
+    "sqlite": SQLiteRepositories,
+}
+
+def get_repositories(dialect_name):
+    """Repositories for a SQLAlchemy dialect name (engine.dialect.name)."""
+    try:
+        return BACKENDS[dialect_name](dialect_name)
+    except KeyError:
+        raise ValueError(f"Unsupported database backend: {dialect_name}") from None